@@ -0,0 +1,191 @@
+from gutenberg_API.API import get_pair_sampler
+from utils import truncate_pair
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+import random
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+
+class PairBatches(object):
+    """
+    desc: iterator of fixed-size batches of transposition pairs, built from the paragraph store in
+          background threads while the current batch is consumed. every pair of paragraphs x and y in which y
+          is num_sequential - 1 paragraphs after x gives a (1, x, y) and a (0, y, x) example, as in
+          make_transposition_pair_dataset. the pairs are selected once; every epoch is a new shuffle of them.
+
+          a batch is a dictionary of:
+            labels, first_ids, second_ids: (batch_size,) arrays
+            padded: first, second: (batch_size, length) token id arrays padded with pad_id, and first_lengths,
+                    second_lengths. length is num_tokens if it is an integer, else the longest in the batch
+            packed: tokens: the token ids of first, second, first, second, ... back to back, and offsets:
+                    (2 * batch_size + 1,) array; segment i is tokens[offsets[i]:offsets[i + 1]]
+          arrays are array.array, or numpy arrays if numpy=True.
+    """
+
+    def __init__(self,
+                 encode: Callable[[Sequence[str]], Sequence[int]],
+                 batch_size: int = 32,
+                 max_len: Optional[int] = 512,
+                 min_len: Optional[int] = 10,
+                 max_sent: Optional[int] = 60,
+                 min_sent: Optional[int] = 3,
+                 books: Optional[List] = None,
+                 tags: Optional[List] = None,
+                 books_features: Optional[Dict] = None,
+                 num_sequential: int = 2,
+                 num_tokens=None,
+                 seed: int = 0,
+                 shuffle: bool = True,
+                 drop_last: bool = False,
+                 packed: bool = False,
+                 pad_id: int = 0,
+                 num_workers: int = 2,
+                 prefetch: int = 8,
+                 numpy: bool = False):
+        """
+        :param encode: a function from words to token ids, e.g. gutenberg_API.vocab.Vocabulary.encode
+        :param batch_size: number of examples of a batch
+        :param max_len, min_len, max_sent, min_sent, books, tags, books_features: same as get_paragraphs
+        :param num_sequential: same as get_paragraph_words; pairs are the first and the last paragraph of
+                               windows of num_sequential paragraphs
+        :param num_tokens: same as make_transposition_pair_dataset, an integer or a utils.TokenBudget
+        :param seed: seed of shuffling; epoch e is shuffled with (seed, e)
+        :param shuffle: if it is False examples are in corpus order
+        :param drop_last: if it is True a last batch smaller than batch_size is dropped
+        :param packed: if it is True batches are packed instead of padded
+        :param pad_id: token id of padding
+        :param num_workers: number of threads which build batches
+        :param prefetch: number of batches built ahead of the consumer
+        :param numpy: if it is True batches hold numpy arrays instead of array.array
+        """
+        if num_sequential < 2:
+            raise ValueError("num_sequential should be at least 2; pairs are the first and the last paragraph of a window")
+        if numpy:
+            try:
+                import numpy as np
+            except ImportError:
+                raise ImportError("numpy is required for numpy=True")
+            self._np = np
+        else:
+            self._np = None
+        self._encode = encode
+        self._batch_size = batch_size
+        self._num_tokens = num_tokens
+        self._seed = seed
+        self._shuffle = shuffle
+        self._drop_last = drop_last
+        self._packed = packed
+        self._pad_id = pad_id
+        self._num_workers = num_workers
+        self._prefetch = max(prefetch, 1)
+        self._epoch = 0
+        self._sampler = get_pair_sampler(books=books, tags=tags, max_len=max_len, min_len=min_len,
+                                         max_sent=max_sent, min_sent=min_sent,
+                                         books_features=books_features)
+        self._pairs = self._sampler.distance_pairs(num_sequential - 1)
+
+    @property
+    def num_examples(self) -> int:
+        return 2 * len(self._pairs)
+
+    def __len__(self):
+        """
+        :return: number of batches of an epoch
+        """
+        if self._drop_last:
+            return self.num_examples // self._batch_size
+        return -(-self.num_examples // self._batch_size)
+
+    def __iter__(self) -> Iterator[Dict]:
+        """
+        desc: iterates the next epoch.
+        """
+        epoch = self._epoch
+        self._epoch += 1
+        return self.epoch(epoch)
+
+    def epoch(self, epoch: int) -> Iterator[Dict]:
+        """
+        :return: iterator of the batches of epoch. the order only depends on seed and epoch
+        """
+        examples = list(range(self.num_examples))
+        if self._shuffle:
+            random.Random("%s-%d" % (self._seed, epoch)).shuffle(examples)
+        size = self._batch_size
+        end = len(examples) - len(examples) % size if self._drop_last else len(examples)
+        chunks = (examples[i:i + size] for i in range(0, end, size))
+        with ThreadPoolExecutor(self._num_workers) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(self._batch, chunk))
+                if len(pending) >= self._prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _batch(self, examples: List[int]) -> Dict:
+        labels, first_ids, second_ids, segments = [], [], [], []
+        paragraph, encode = self._sampler.paragraph, self._encode
+        for e in examples:
+            x, y = (paragraph(r) for r in self._pairs[e >> 1])
+            # even examples are in the correct order
+            label = 1 - (e & 1)
+            if not label:
+                x, y = y, x
+            x_words, y_words = x.text("words"), y.text("words")
+            first, second = truncate_pair(encode(x_words), encode(y_words), self._num_tokens,
+                                          x_words, y_words, x.id, y.id)
+            labels.append(label)
+            first_ids.append(x.id)
+            second_ids.append(y.id)
+            segments.append(first)
+            segments.append(second)
+        batch = {
+            "labels": self._array("b", labels),
+            "first_ids": self._array("q", first_ids),
+            "second_ids": self._array("q", second_ids),
+        }
+        if self._packed:
+            batch.update(self._pack(segments))
+        else:
+            batch.update(self._pad(segments))
+        return batch
+
+    def _array(self, typecode, values):
+        if self._np is not None:
+            return self._np.array(values, dtype=_DTYPES[typecode])
+        return array(typecode, values)
+
+    def _pack(self, segments):
+        offsets = array("q", [0])
+        tokens = array("i")
+        for segment in segments:
+            tokens.extend(array("i", segment))
+            offsets.append(len(tokens))
+        if self._np is not None:
+            return {"tokens": self._np.frombuffer(tokens, dtype=self._np.int32),
+                    "offsets": self._np.frombuffer(offsets, dtype=self._np.int64)}
+        return {"tokens": tokens, "offsets": offsets}
+
+    def _pad(self, segments):
+        if isinstance(self._num_tokens, int):
+            length = self._num_tokens
+        else:
+            length = max([len(segment) for segment in segments] + [0])
+        res = dict()
+        for name, part in (("first", segments[0::2]), ("second", segments[1::2])):
+            padded = array("i", [self._pad_id]) * (length * len(part))
+            for i, segment in enumerate(part):
+                padded[i * length:i * length + len(segment)] = array("i", segment)
+            lengths = [len(segment) for segment in part]
+            if self._np is not None:
+                res[name] = self._np.frombuffer(padded, dtype=self._np.int32).reshape(
+                    len(part), length)
+            else:
+                res[name] = padded
+            res[name + "_lengths"] = self._array("i", lengths)
+        return res
+
+
+_DTYPES = {"b": "int8", "i": "int32", "q": "int64"}
@@ -0,0 +1,228 @@
+"""
+desc: times and memory-profiles the stages of the dataset pipeline on a synthetic corpus:
+        load -> get_paragraphs -> utils.filter -> get_paragraph_words -> make_transposition_pair_dataset
+        -> write_tsv
+      each stage is measured separately and the results are printed (or written) as JSON.
+
+usage: python benchmarks/run.py --paragraphs 100000 [--backend store|container|pickle] [--memory] [--output result.json]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "gutenberg_API")]
+
+import container  # noqa: E402
+import corpus  # noqa: E402
+import utils  # noqa: E402
+from synthetic import corpus_paths, generate_corpus  # noqa: E402
+
+STAGES = ("load", "get_paragraphs", "filter", "get_paragraph_words",
+          "make_transposition_pair_dataset", "write_tsv")
+
+
+def _max_rss():
+    """
+    :return: peak resident set size of the process in bytes
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _measure(func, memory):
+    """
+    desc: runs func once.
+
+    :return: (result, seconds, peak traced bytes or None)
+    """
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def _pipeline(paths, backend, config, output_dir):
+    """
+    desc: the stages as (name, function of the previous result) pairs. every run uses a fresh Corpus without
+          a result cache, so repeats do not hit the cache of the previous one.
+    """
+    store_path = paths["PARAGRAPH_STORE_PATH"] if backend == "store" else os.path.join(
+        output_dir, "no_store")
+    bounds = dict(max_len=config["max_len"], min_len=config["min_len"],
+                  max_sent=config["max_sent"], min_sent=config["min_sent"])
+
+    def load(_):
+        corpus._default_corpus = corpus.Corpus(
+            books_path=paths["BOOKS_DATA_PATH"],
+            bookshelves_path=paths["BOOK_SHELVES_PATH"],
+            paragraph_metadata_path=paths["PARAGRAPH_METADATA_PATH"],
+            paragraph_data_path=paths["PARAGRAPH_DATA_PATH"],
+            store_path=store_path,
+            books_index_path=paths["BOOKS_INDEX_PATH"],
+            cache_size=0)
+        c = corpus._default_corpus
+        return len(c.store()) if backend == "store" else len(c._pickled_paragraphs())
+
+    def get_paragraphs(_):
+        return corpus.default_corpus().get_paragraphs(
+            tags=config["tags"], num_sequential=config["num_sequential"])
+
+    def filter(paragraphs):
+        return utils.filter(paragraphs, **bounds)
+
+    def get_paragraph_words(_):
+        return utils.get_paragraph_words(tags=config["tags"],
+                                         num_sequential=config["num_sequential"],
+                                         seed=config["seed"], **bounds)
+
+    def make_transposition_pair_dataset(words):
+        pairs = [tuple(window[:2]) for window in words]
+        return utils.make_transposition_pair_dataset(
+            pairs, num_tokens=config["num_tokens"],
+            validation_split=config["validation_split"], seed=config["seed"])
+
+    def write_tsv(data):
+        utils.write_tsv(data[0], os.path.join(output_dir, "train.tsv"))
+        return data[0]
+
+    return [("load", load), ("get_paragraphs", get_paragraphs), ("filter", filter),
+            ("get_paragraph_words", get_paragraph_words),
+            ("make_transposition_pair_dataset", make_transposition_pair_dataset),
+            ("write_tsv", write_tsv)]
+
+
+def _size(result):
+    if isinstance(result, int):
+        return result
+    if isinstance(result, tuple):
+        return sum(len(part) for part in result)
+    return len(result)
+
+
+def run(paths, backend="store", repeat=3, memory=False, output_dir=None, **config):
+    """
+    desc: runs the pipeline repeat times and measures each stage. if memory is True one more run is traced
+          with tracemalloc; it is kept apart because tracing slows Python code down.
+
+    :return: a dictionary {stage: {"seconds": [...], "min_seconds", "median_seconds", "items",
+             "peak_traced_bytes", "max_rss_bytes"}}
+    """
+    config = dict(DEFAULT_CONFIG, **config)
+    output_dir = output_dir or tempfile.mkdtemp(prefix="bench-")
+    results = {name: {"seconds": []} for name in STAGES}
+    for i in range(repeat + memory):
+        traced = memory and i == repeat
+        previous = None
+        for name, func in _pipeline(paths, backend, config, output_dir):
+            previous, seconds, peak = _measure(lambda: func(previous), traced)
+            stage = results[name]
+            if traced:
+                stage["peak_traced_bytes"] = peak
+            else:
+                stage["seconds"].append(seconds)
+                stage["items"] = _size(previous)
+            stage["max_rss_bytes"] = _max_rss()
+    for stage in results.values():
+        if stage["seconds"]:
+            stage["min_seconds"] = min(stage["seconds"])
+            stage["median_seconds"] = statistics.median(stage["seconds"])
+    return results
+
+
+DEFAULT_CONFIG = {
+    "tags": [[0, 1, 2]],
+    "num_sequential": 2,
+    "max_len": 512,
+    "min_len": 10,
+    "max_sent": 60,
+    "min_sent": 3,
+    "num_tokens": 128,
+    "validation_split": 0.1,
+    "seed": 0,
+}
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the dataset pipeline")
+    parser.add_argument("--paragraphs", type=int, default=10000)
+    parser.add_argument("--books", type=int, default=None)
+    parser.add_argument("--corpus-seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=None,
+                        help="directory of the synthetic corpus. it is generated if it does not exist, "
+                             "and a temporary one is used and removed if it is not given")
+    parser.add_argument("--backend", choices=("store", "container", "pickle"), default="store",
+                        help="paragraph store, data containers (converted from the pickles) or pickles. "
+                             "containers are removed from the data directory for pickle runs")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--memory", action="store_true",
+                        help="trace the peak memory of each stage in an extra run")
+    parser.add_argument("--output", default=None, help="JSON file of the results, stdout by default")
+    args = parser.parse_args(argv)
+
+    temporary = args.data_dir is None
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="bench-corpus-")
+    try:
+        start = time.perf_counter()
+        if temporary or not os.path.isdir(data_dir):
+            paths = generate_corpus(data_dir, args.paragraphs, args.books, args.corpus_seed,
+                                    store=args.backend == "store")
+        else:
+            paths = corpus_paths(data_dir)
+        if args.backend == "container":
+            container.migrate(data_dir)
+        elif args.backend == "pickle":
+            for name in container.DATA_FILES:
+                target = container.container_path(paths[name])
+                if os.path.isfile(target):
+                    os.remove(target)
+        generate_seconds = time.perf_counter() - start
+        stages = run(paths, args.backend, args.repeat, args.memory, output_dir=data_dir)
+    finally:
+        if temporary:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": {"paragraphs": args.paragraphs, "books": args.books, "seed": args.corpus_seed,
+                   "generate_seconds": generate_seconds},
+        "backend": args.backend,
+        "repeat": args.repeat,
+        "config": DEFAULT_CONFIG,
+        "stages": stages,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+desc: synthetic corpus generator for benchmarks. writes paragraph_metadata.pkl, paragraph_data.pkl,
+      books_data.pkl and books_shelves.pkl with the shapes create_paragraphs and get_books expect,
+      and optionally the columnar paragraph store.
+
+usage: python benchmarks/synthetic.py OUTPUT_DIR --paragraphs 100000 [--store]
+"""
+import argparse
+import itertools
+import os
+import pickle
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "gutenberg_API")]
+
+import HP  # noqa: E402
+from store import StoreWriter  # noqa: E402
+
+LANGUAGES = ["en", "fr", "de", "es", "fi"]
+BOOKSHELVES = ["Fiction", "History", "Poetry", "Science", "Philosophy", "Children"]
+QUOTE = '"'
+
+
+def _vocabulary(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = {
+        "".join(rng.choice(letters) for _ in range(rng.randint(1, 9)))
+        for _ in range(size)
+    }
+    return sorted(words)
+
+
+def _paragraph(rng, words, cum_weights):
+    num_sentences = min(int(rng.expovariate(1 / 4)) + 1, 80)
+    dialogue = rng.random() < 0.3
+    sentences = []
+    for _ in range(num_sentences):
+        sent = rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 30)) + ["."]
+        if dialogue and rng.random() < 0.7:
+            sent = [QUOTE] + sent + [QUOTE]
+        sentences.append(sent)
+    return sentences
+
+
+def _tags(sentences):
+    num_words = sum(len(sent) for sent in sentences)
+    quoted = sum(QUOTE in sent for sent in sentences)
+    tags = {HP.Tags.PARAGRAPH}
+    if num_words < 50:
+        tags.add(HP.Tags.SHORT)
+    elif num_words < 200:
+        tags.add(HP.Tags.MEDIUM)
+    elif num_words < 1000:
+        tags.add(HP.Tags.LONG)
+    else:
+        tags.add(HP.Tags.TOO_LONG)
+    if quoted == len(sentences):
+        tags.add(HP.Tags.WHOLE_DIALOGUE)
+    elif quoted:
+        tags.add(HP.Tags.WITH_DIALOGUE)
+    else:
+        tags.add(HP.Tags.WITHOUT_DIALOGUE)
+    return tags
+
+
+def iter_corpus(num_paragraphs, num_books=None, seed=0, vocabulary_size=20000):
+    """
+    desc: yields (book_id, book metadata, list of (paragraph metadata, sentences)) for each book. paragraph
+          ids are consecutive and every book is a single next_id chain.
+
+    :param num_paragraphs: total number of paragraphs
+    :param num_books: (Optional) number of books. by default a book has 200 paragraphs on average
+    :param seed: seed of the generator
+    :param vocabulary_size: number of distinct words
+    """
+    rng = random.Random(seed)
+    words = _vocabulary(vocabulary_size, rng)
+    # zipfian word frequencies
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    num_books = num_books or max(1, num_paragraphs // 200)
+    cuts = sorted(rng.sample(range(1, num_paragraphs), num_books - 1)) if num_books > 1 else []
+    bounds = [0] + cuts + [num_paragraphs]
+    for b in range(num_books):
+        book_id = b + 1
+        metadata = {
+            "title": {"Book %d" % book_id},
+            "authors": {"Author %d" % rng.randrange(max(1, num_books // 3))},
+            "language": {rng.choice(LANGUAGES)},
+            "bookshelves": set(rng.sample(BOOKSHELVES, rng.randint(0, 2))),
+        }
+        ids = range(bounds[b] + 1, bounds[b + 1] + 1)
+        paragraphs = []
+        for j, i in enumerate(ids):
+            sentences = _paragraph(rng, words, cum_weights)
+            met = {"id": i, "book_id": book_id, "tags": _tags(sentences)}
+            if j > 0:
+                met["prev_id"] = i - 1
+            if j < len(ids) - 1:
+                met["next_id"] = i + 1
+            paragraphs.append((met, sentences))
+        yield book_id, metadata, paragraphs
+
+
+def corpus_paths(output_dir):
+    """
+    :return: a dictionary {HP attribute name: path of the file in output_dir}
+    """
+    return {
+        name: os.path.join(output_dir, os.path.basename(getattr(HP, name)))
+        for name in ("BOOKS_DATA_PATH", "BOOK_SHELVES_PATH",
+                     "PARAGRAPH_METADATA_PATH", "PARAGRAPH_DATA_PATH",
+                     "PARAGRAPH_STORE_PATH", "BOOKS_INDEX_PATH")
+    }
+
+
+def generate_corpus(output_dir, num_paragraphs, num_books=None, seed=0,
+                    pickles=True, store=False):
+    """
+    desc: writes a synthetic corpus to output_dir, with the file names of HP relative to "data/".
+
+    :param output_dir: output directory
+    :param num_paragraphs, num_books, seed: same as iter_corpus
+    :param pickles: write the four pickles
+    :param store: write the paragraph store; it is streamed, so it does not need the pickles in memory
+
+    :return: a dictionary of the written paths, with HP attribute names as keys
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = corpus_paths(output_dir)
+    metadata, text, books, shelves = dict(), dict(), dict(), dict()
+    writer = StoreWriter(paths["PARAGRAPH_STORE_PATH"]) if store else None
+    for book_id, book, paragraphs in iter_corpus(num_paragraphs, num_books, seed):
+        books[book_id] = book
+        for shelf in book["bookshelves"]:
+            shelves.setdefault(shelf, set()).add(book_id)
+        for met, sentences in paragraphs:
+            if pickles:
+                metadata[met["id"]] = met
+                text[met["id"]] = sentences
+            if writer is not None:
+                writer.add(met["id"], sentences, book_id=book_id,
+                           prev_id=met.get("prev_id"), next_id=met.get("next_id"),
+                           tags=met["tags"])
+    if writer is not None:
+        writer.close()
+    with open(paths["BOOKS_DATA_PATH"], "wb") as f:
+        pickle.dump(books, f)
+    with open(paths["BOOK_SHELVES_PATH"], "wb") as f:
+        pickle.dump(shelves, f)
+    if pickles:
+        with open(paths["PARAGRAPH_METADATA_PATH"], "wb") as f:
+            pickle.dump(metadata, f)
+        with open(paths["PARAGRAPH_DATA_PATH"], "wb") as f:
+            pickle.dump(text, f)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="generate a synthetic corpus")
+    parser.add_argument("output_dir")
+    parser.add_argument("--paragraphs", type=int, default=10000)
+    parser.add_argument("--books", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--store", action="store_true", help="also write the paragraph store")
+    parser.add_argument("--no-pickles", action="store_true", help="only write the store")
+    args = parser.parse_args()
+    generate_corpus(args.output_dir, args.paragraphs, args.books, args.seed,
+                    pickles=not args.no_pickles, store=args.store or args.no_pickles)
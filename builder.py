@@ -0,0 +1,398 @@
+from gutenberg_API.API import default_corpus, get_duplicate_paragraphs, get_paragraph_books, instrument
+from gutenberg_API.vocab import Vocabulary, WordPiece
+from utils import (TokenBudget, iter_paragraph_windows, iter_split_examples, write_split_examples,
+                   write_transposition_dataset)
+from writers import extension
+from array import array
+from multiprocessing import Pool
+import glob
+import hashlib
+import json
+import os
+import pickle
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MANIFEST_FILE = "manifest.json"
+CACHE_VERSION = 1
+# number of examples of a book pickled together in its cache file
+CACHE_BLOCK_SIZE = 4096
+# options which change the examples of a book; the others only change how they are merged and written
+EXAMPLE_OPTIONS = ("max_len", "min_len", "max_sent", "min_sent", "tags", "num_sequential",
+                   "num_tokens", "validation_split", "seed", "split_by", "wordpiece_path",
+                   "dedup_threshold")
+
+
+def shard_of(book_id: int, num_shards: int) -> int:
+    """
+    :return: the shard of a book. it only depends on book_id and num_shards, not on the worker count
+    """
+    return zlib.crc32(str(book_id).encode()) % num_shards
+
+
+def _build_shard(task: Dict) -> Dict:
+    shard = task["shard"]
+    config = task["config"]
+    encode = None
+    if config["vocabulary_path"] is not None:
+        encode = Vocabulary.load(config["vocabulary_path"]).encode
+    num_tokens = config["num_tokens"]
+    if config["wordpiece_path"] is not None:
+        num_tokens = TokenBudget(num_tokens, WordPiece.load(config["wordpiece_path"]))
+    duplicates = set(task["duplicates"]) if task["duplicates"] is not None else None
+    ext = extension(config["format"])
+    train_path = os.path.join(task["output_dir"], "train-%05d%s" % (shard, ext))
+    dev_path = os.path.join(task["output_dir"], "dev-%05d%s" % (shard, ext))
+    if task["cache_dir"] is not None:
+        examples = _cached_examples(task, num_tokens, encode, duplicates)
+        num_train, num_dev = write_split_examples(
+            examples,
+            train_path,
+            dev_path,
+            buffer_size=config["buffer_size"],
+            shuffle_seed="%s-%d" % (config["seed"], shard),
+            format=config["format"],
+            writer_options=task["writer_options"],
+            token_ids=encode is not None)
+    else:
+        windows = _windows(config, task["books"], duplicates)
+        num_train, num_dev = write_transposition_dataset(
+            windows,
+            train_path,
+            dev_path,
+            num_tokens=num_tokens,
+            validation_split=config["validation_split"],
+            buffer_size=config["buffer_size"],
+            seed=config["seed"],
+            split_by=config["split_by"],
+            shuffle_seed="%s-%d" % (config["seed"], shard),
+            format=config["format"],
+            writer_options=task["writer_options"],
+            encode=encode)
+    res = {
+        "shard": shard,
+        "books": len(task["books"]),
+        "book_ids": task["books"],
+        "train": os.path.basename(train_path),
+        "train_examples": num_train,
+        "dev": os.path.basename(dev_path),
+        "dev_examples": num_dev,
+    }
+    if task["key"] is not None:
+        res["key"] = task["key"]
+    return res
+
+
+def _windows(config: Dict, books: List[int], duplicates=None) -> Iterator[Tuple]:
+    return iter_paragraph_windows(config["max_len"],
+                                  config["min_len"],
+                                  config["max_sent"],
+                                  config["min_sent"],
+                                  books=books,
+                                  tags=config["tags"],
+                                  num_sequential=config["num_sequential"],
+                                  duplicates=duplicates)
+
+
+def _book_cache_path(cache_dir: str, book: int, fingerprint: str) -> str:
+    return os.path.join(cache_dir, "%d-%s.pkl" % (book, fingerprint))
+
+
+def _cached_examples(task: Dict, num_tokens, encode, duplicates=None) -> Iterator[Tuple[int, Tuple]]:
+    """
+    desc: (split, example) pairs of the books of a shard in increasing order of book id. the examples of
+          books which are not in the cache are built in one pass over their windows and appended to their
+          cache files; the others are read from the cache.
+    """
+    config, cache_dir, fingerprints = task["config"], task["cache_dir"], task["fingerprints"]
+    books = sorted(task["books"])
+    missing = [
+        book for book in books
+        if not os.path.isfile(_book_cache_path(cache_dir, book, fingerprints[book]))
+    ]
+    with instrument.current().stage("build_book_cache", len(missing)) as stage:
+        written = set()
+        book, f, pending = None, None, []
+        try:
+            windows = _windows(config, missing, duplicates) if missing else ()
+            for window in windows:
+                if window[0].book_id != book:
+                    # windows are grouped by book, so only the cache file of one book is open at a time
+                    if f is not None:
+                        _flush(pending, f)
+                        f.close()
+                    book = window[0].book_id
+                    path = _book_cache_path(cache_dir, book, fingerprints[book]) + ".tmp"
+                    f = open(path, "ab" if book in written else "wb")
+                    written.add(book)
+                    pending = []
+                pending.extend(
+                    iter_split_examples([window], num_tokens, config["validation_split"],
+                                        config["seed"], config["split_by"], encode))
+                if len(pending) >= CACHE_BLOCK_SIZE:
+                    _flush(pending, f)
+                    pending = []
+            if f is not None:
+                _flush(pending, f)
+        finally:
+            if f is not None:
+                f.close()
+        for book in missing:
+            path = _book_cache_path(cache_dir, book, fingerprints[book])
+            for stale in glob.glob(os.path.join(cache_dir, "%d-*.pkl" % book)):
+                os.remove(stale)
+            if book in written:
+                os.replace(path + ".tmp", path)
+            else:
+                open(path, "wb").close()
+            stage.count()
+    for book in books:
+        with open(_book_cache_path(cache_dir, book, fingerprints[book]), "rb") as f:
+            while True:
+                try:
+                    yield from pickle.load(f)
+                except EOFError:
+                    break
+
+
+def _flush(examples, f):
+    # examples of a book are appended as a stream of pickled lists
+    if examples:
+        pickle.dump(examples, f, pickle.HIGHEST_PROTOCOL)
+
+
+def config_key(config: Dict) -> str:
+    """
+    :return: a digest of the options which change the examples of a book, including the content of the
+             vocabularies
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps([CACHE_VERSION] + [config[name] for name in EXAMPLE_OPTIONS]).encode())
+    for name in ("vocabulary_path", "wordpiece_path"):
+        if config[name] is not None:
+            with open(config[name], "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def _with_duplicates(fingerprints: Dict[int, str], duplicates: array) -> Dict[int, str]:
+    """
+    :param duplicates: sorted ids of the dropped duplicate paragraphs
+    :return: fingerprints of the books combined with the ids of their own dropped paragraphs, which are
+             the only duplicates their examples depend on
+    """
+    by_book = dict()
+    for id, book in default_corpus().books_of(duplicates).items():
+        by_book.setdefault(book, []).append(id)
+    res = dict(fingerprints)
+    for book, ids in by_book.items():
+        if book in res:
+            h = hashlib.blake2b(res[book].encode(), digest_size=16)
+            h.update(array("q", sorted(ids)))
+            res[book] = h.hexdigest()
+    return res
+
+
+def _shard_key(config: Dict, key: str, shard: int, books: List[int], fingerprints: Dict,
+               writer_options: Optional[Dict]) -> str:
+    merge = [key, shard, config["buffer_size"], config["format"], writer_options,
+             [(book, fingerprints[book]) for book in books]]
+    return hashlib.blake2b(json.dumps(merge, sort_keys=True).encode(),
+                           digest_size=16).hexdigest()
+
+
+def _shard_exists(output_dir: str, shard: Dict, format: str) -> bool:
+    suffix = ".json" if format == "packed" else ""
+    return all(
+        os.path.isfile(os.path.join(output_dir, shard[name] + suffix))
+        for name in ("train", "dev"))
+
+
+def _previous_shards(output_dir: str, num_shards: int) -> Dict[int, Dict]:
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return dict()
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest["num_shards"] != num_shards:
+        return dict()
+    return {shard["shard"]: shard for shard in manifest["shards"]}
+
+
+def _assign_shards(books: List[int], num_shards: int, previous: Dict[int, Dict]) -> List[List[int]]:
+    """
+    :param previous: the shards of the previous manifest, see _previous_shards
+    :return: the books of every shard. books keep their shard in previous, and new books are put in new
+             shards of the average size of the previous ones, so the outputs of the other shards stay valid.
+             without previous shards books are assigned by shard_of
+    """
+    known = {book: shard["shard"] for shard in previous.values() for book in shard.get("book_ids", ())}
+    if not known:
+        shard_books = [[] for _ in range(num_shards)]
+        for book in books:
+            shard_books[shard_of(book, num_shards)].append(book)
+        return shard_books
+    shard_books = [[] for _ in range(max(num_shards, max(previous) + 1))]
+    new = []
+    for book in books:
+        if book in known:
+            shard_books[known[book]].append(book)
+        else:
+            new.append(book)
+    size = max(1, -(-len(known) // len(previous)))
+    for i in range(0, len(new), size):
+        shard_books.append(new[i:i + size])
+    return shard_books
+
+
+def _run_shards(tasks: List[Dict], num_workers: Optional[int]):
+    if num_workers == 1:
+        yield from map(_build_shard, tasks)
+    else:
+        with Pool(num_workers) as pool:
+            yield from pool.imap_unordered(_build_shard, tasks)
+
+
+def build_sharded_dataset(output_dir: str,
+                          max_len: int = 512,
+                          min_len: int = 10,
+                          max_sent: int = 60,
+                          min_sent: int = 3,
+                          books: Optional[List[int]] = None,
+                          tags: Optional[List] = None,
+                          num_sequential: int = 2,
+                          num_tokens: Optional[int] = None,
+                          validation_split: float = 0.1,
+                          num_shards: int = 16,
+                          num_workers: Optional[int] = None,
+                          buffer_size: int = 100000,
+                          seed: int = 0,
+                          split_by: str = "book",
+                          format: str = "tsv",
+                          writer_options: Optional[Dict] = None,
+                          vocabulary_path: Optional[str] = None,
+                          wordpiece_path: Optional[str] = None,
+                          cache_dir: Optional[str] = None,
+                          dedup_threshold: Optional[float] = None) -> Dict:
+    """
+    desc: builds the transposition pair dataset in parallel. books are partitioned into num_shards
+          shards and every shard is filtered, paired and written to its own train/dev TSV files by a
+          worker process. a manifest.json in output_dir records the configuration, the books and the
+          sizes of shards. outputs only depend on seed and num_shards, not on num_workers.
+
+    :param output_dir: directory of shard files and the manifest
+    :param max_len, min_len, max_sent, min_sent, tags, num_sequential: same as get_paragraph_words. pairs
+           are made of the first and the last paragraph of every window of num_sequential paragraphs
+    :param books: (Optional) a list of book ids to build from. if it is None all books are used
+    :param num_tokens, validation_split: same as make_transposition_pair_dataset
+    :param num_shards: number of shards of a first build. with cache_dir, rebuilds keep the shards of the manifest
+                       in output_dir and add shards for new books, so there may be more
+    :param num_workers: (Optional) number of worker processes. if it is None os.cpu_count() is used
+    :param buffer_size: number of examples buffered for shuffling in each shard split
+    :param seed: seed of splitting and shuffling. splits are assigned by split_of, so they do not depend on
+                 num_shards either
+    :param split_by, format, writer_options: same as write_transposition_dataset. writer_options should be
+           picklable
+    :param vocabulary_path: (Optional) path of a saved Vocabulary. if it is given examples are written as
+                            token ids
+    :param wordpiece_path: (Optional) path of a WordPiece vocab.txt. if it is given num_tokens is the number
+                           of subwords of each pair (utils.TokenBudget) instead of the number of words of
+                           each paragraph
+    :param cache_dir: (Optional) directory of a per-book cache of examples, which makes rebuilds
+                      incremental. examples are cached under the fingerprint of the paragraphs of their book
+                      (Corpus.book_fingerprints) and a digest of the options which change them, so a rebuild
+                      only pairs new or changed books. books keep their shard and new books get new shards
+                      (_assign_shards), so a rebuild rewrites the shards of new, changed or removed books
+                      and costs about the size of those shards. a shard whose books and options did not change
+                      since the manifest in output_dir was written is not rewritten at all; the other shards are
+                      merged from the cache in increasing order of book id, which is not the corpus order used
+                      without a cache, so the shuffled outputs of the two modes differ
+    :param dedup_threshold: (Optional) if it is given, near duplicate paragraphs of all selected books are found
+                            once (get_duplicate_paragraphs) and pairs with a duplicate are dropped in every shard,
+                            so duplicates in different shards can't leak between train and dev. with cache_dir,
+                            the dropped paragraphs of a book are part of its fingerprint, so a change of the
+                            duplicates only rebuilds the books whose paragraphs are dropped differently
+
+    :return: the manifest
+    """
+    if num_sequential < 2:
+        raise ValueError("num_sequential should be at least 2; pairs are the first and the last paragraph of a window")
+    os.makedirs(output_dir, exist_ok=True)
+    config = {
+        "max_len": max_len,
+        "min_len": min_len,
+        "max_sent": max_sent,
+        "min_sent": min_sent,
+        "tags": tags,
+        "num_sequential": num_sequential,
+        "num_tokens": num_tokens,
+        "validation_split": validation_split,
+        "buffer_size": buffer_size,
+        "seed": seed,
+        "split_by": split_by,
+        "format": format,
+        "vocabulary_path": vocabulary_path,
+        "wordpiece_path": wordpiece_path,
+        "dedup_threshold": dedup_threshold,
+    }
+    all_books = get_paragraph_books()
+    if books is not None:
+        all_books = sorted(set(all_books) & set(books))
+    previous = _previous_shards(output_dir, num_shards) if cache_dir is not None else dict()
+    shard_books = _assign_shards(all_books, num_shards, previous)
+    duplicates = None
+    if dedup_threshold is not None:
+        duplicates = array("q", sorted(get_duplicate_paragraphs(books=all_books,
+                                                                tags=tags,
+                                                                max_len=max_len,
+                                                                min_len=min_len,
+                                                                max_sent=max_sent,
+                                                                min_sent=min_sent,
+                                                                threshold=dedup_threshold)))
+    tasks = [{
+        "shard": shard,
+        "books": shard_books[shard],
+        "config": config,
+        "writer_options": writer_options,
+        "output_dir": output_dir,
+        "duplicates": duplicates,
+        "cache_dir": None,
+        "key": None,
+    } for shard in range(len(shard_books))]
+
+    shards = []
+    if cache_dir is not None:
+        key = config_key(config)
+        book_cache_dir = os.path.join(cache_dir, key)
+        os.makedirs(book_cache_dir, exist_ok=True)
+        fingerprints = default_corpus().book_fingerprints(all_books)
+        if duplicates is not None:
+            fingerprints = _with_duplicates(fingerprints, duplicates)
+        for task in list(tasks):
+            books = task["books"]
+            task["cache_dir"] = book_cache_dir
+            task["fingerprints"] = {book: fingerprints[book] for book in books}
+            task["key"] = _shard_key(config, key, task["shard"], books, fingerprints,
+                                     writer_options)
+            old = previous.get(task["shard"])
+            if old is not None and old.get("key") == task["key"] and _shard_exists(
+                    output_dir, old, format):
+                shards.append(dict(old, book_ids=books))
+                tasks.remove(task)
+
+    with instrument.current().stage("build_shards", len(tasks)) as stage:
+        for shard in _run_shards(tasks, num_workers):
+            shards.append(shard)
+            stage.count()
+    shards.sort(key=lambda shard: shard["shard"])
+
+    manifest = {
+        "config": config,
+        "num_shards": num_shards,
+        "train_examples": sum(shard["train_examples"] for shard in shards),
+        "dev_examples": sum(shard["dev_examples"] for shard in shards),
+        "shards": shards,
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
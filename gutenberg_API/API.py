@@ -1,9 +1,8 @@
-import HP
-import pickle
-import os
-from typing import Dict, List, Optional
-from gutenberg_book import GutenbergBook, create_gutenberg_books
-from paragraph import create_paragraphs
+from typing import Dict, Iterator, List, Optional, Union
+from corpus import default_corpus
+# modules outside the package import instrument from here, so they share the process-wide
+# instrumentation with corpus
+import instrument  # noqa: F401
 
 
 def get_books(books_list: Optional[List] = None,
@@ -18,31 +17,7 @@ def get_books(books_list: Optional[List] = None,
     Returns:
          a dictionary of books objects {id: GutenbergBook(id)/metadata(id)}
     """
-    if books_list is not None and books_features is not None:
-        raise AttributeError(
-            "only one of books_list and books_features should be identified")
-    if os.path.isfile(HP.BOOKS_DATA_PATH):
-        pk = open(HP.BOOKS_DATA_PATH, "rb")
-        books_metadata = pickle.load(pk)
-        pk.close()
-        assert isinstance(books_metadata, dict)
-
-    else:
-        books_metadata = dict()
-
-    if books_list is not None:
-        books_list = books_list & set(books_metadata)
-        books_metadata = {id: books_metadata[id] for id in books_list}
-    if books_features is not None:
-        for feature, items in books_features.items():
-            books_metadata = {
-                id: metadata
-                for id, metadata in books_metadata.items()
-                if items.issubset(metadata[feature])
-            }
-    if book_object:
-        return create_gutenberg_books(books_metadata, dic=True)
-    return books_metadata
+    return default_corpus().get_books(books_list, books_features, book_object)
 
 
 def get_bookshelves(bookshelves_list: Optional[List] = None) -> Dict:
@@ -55,20 +30,17 @@ def get_bookshelves(bookshelves_list: Optional[List] = None) -> Dict:
         a dictionary of bookshelves {bookshelf: bookshelf_elements_id}
 
     """
-    if os.path.isfile(HP.BOOK_SHELVES_PATH):
-        pk = open(HP.BOOK_SHELVES_PATH, "rb")
-        bookshelves = pickle.load(pk)
-        pk.close()
-        assert isinstance(bookshelves, dict)
-        if bookshelves_list is not None:
-            bookshelves_list = bookshelves_list & set(bookshelves)
-            bookshelves = {
-                bookshelf: bookshelves[bookshelf]
-                for bookshelf in bookshelves_list
-            }
-    else:
-        bookshelves = dict()
-    return bookshelves
+    return default_corpus().get_bookshelves(bookshelves_list)
+
+
+def get_paragraph_books() -> List[int]:
+    """
+
+    Returns:
+        a sorted list of the ids of books which have paragraphs
+
+    """
+    return default_corpus().get_paragraph_books()
 
 
 def get_paragraphs(paragraph_id: Optional[List[int]] = None,
@@ -76,7 +48,12 @@ def get_paragraphs(paragraph_id: Optional[List[int]] = None,
                    tags: Optional[List] = None,
                    num_sequential: int = 1,
                    paragraph_object: bool = True,
-                   lowercase: bool = False) -> List:
+                   lowercase: bool = False,
+                   max_len: Optional[int] = None,
+                   min_len: Optional[int] = None,
+                   max_sent: Optional[int] = None,
+                   min_sent: Optional[int] = None,
+                   books_features: Optional[Dict] = None) -> List:
     """
 
     Get paragraphs from args.
@@ -90,63 +67,142 @@ def get_paragraphs(paragraph_id: Optional[List[int]] = None,
         num_sequential: the number of sequential paragraphs
         paragraph_object: if it is True outputs will be type of Paragraph
         lowercase: if it is True, then the output will be lowercase. it does not have effect if paragraph_object=True.
+        max_len: (Optional) maximum number of words in a paragraph
+        min_len: (Optional) minimum number of words in a paragraph
+        max_sent: (Optional) maximum number of sentences in a paragraph
+        min_sent: (Optional) minimum number of sentences in a paragraph
+        books_features: (Optional) only paragraphs of books with these features, as in get_books. it is
+                        resolved on the book index and combined with books
 
     Returns:
         a list of paragraphs or list of tuples of paragraphs if num_sequential > 1
 
     """
-    if paragraph_id is not None and (books is not None or tags is not None):
-        raise ValueError(
-            "if paragraph_id is given, books and tags can't be accepted.")
-    with open(HP.PARAGRAPH_METADATA_PATH, "rb") as pkl:
-        met_data = pickle.load(pkl)
-    with open(HP.PARAGRAPH_DATA_PATH, "rb") as pkl:
-        text = pickle.load(pkl, encoding='latin1')
-    pars = create_paragraphs(met_data, text)
-    if paragraph_id is not None:
-        pars = {i: par for i, par in pars.items() if par.id in paragraph_id}
-    if books is not None:
-        books = {i for i in books if isinstance(i, int)} | {
-            book.id for book in books if isinstance(book, GutenbergBook)
-        }
-        pars = {i: par for i, par in pars.items() if par.book_id in books}
-    if tags is not None:
-        tags = [{tag} for tag in tags if isinstance(tag, int)
-               ] + [set(tag) for tag in tags if not isinstance(tag, int)]
-        pars = {
-            i: par
-            for i, par in pars.items()
-            if all([not par.tags.isdisjoint(tag) for tag in tags])
-        }
-
-    if num_sequential == 1:
-        if paragraph_object:
-            return list(pars.values())
-        else:
-            return [par.text(lowercase=lowercase) for par in pars.values()]
-    elif num_sequential > 1:
-        pars2 = []
-        for par in pars.values():
-            pp = [par]
-            next_par = par
-            flag = True
-            for k in range(1, num_sequential):
-                cur_par = next_par
-                id = cur_par.next_id
-                if id not in pars:
-                    flag = False
-                    break
-                next_par = pars[id]
-                pp.append(next_par)
-            if flag:
-                pars2.append(tuple(pp))
-        if paragraph_object:
-            return pars2
-        else:
-            return [
-                tuple(par.text(lowercase=lowercase)
-                      for par in pt)
-                for pt in pars2
-            ]
-    else:
-        raise ValueError("num_sequential most be positive")
+    return default_corpus().get_paragraphs(paragraph_id, books, tags,
+                                           num_sequential, paragraph_object,
+                                           lowercase, max_len, min_len,
+                                           max_sent, min_sent, books_features)
+
+
+def iter_paragraphs(paragraph_id: Optional[List[int]] = None,
+                    books: Optional[List] = None,
+                    tags: Optional[List] = None,
+                    num_sequential: int = 1,
+                    paragraph_object: bool = True,
+                    lowercase: bool = False,
+                    max_len: Optional[int] = None,
+                    min_len: Optional[int] = None,
+                    max_sent: Optional[int] = None,
+                    min_sent: Optional[int] = None,
+                    books_features: Optional[Dict] = None) -> Iterator:
+    """
+
+    Same as get_paragraphs, but returns an iterator. with a paragraph store, paragraphs are
+    created as they are consumed and are not kept afterwards.
+
+    """
+    return default_corpus().iter_paragraphs(paragraph_id, books, tags,
+                                            num_sequential, paragraph_object,
+                                            lowercase, max_len, min_len,
+                                            max_sent, min_sent, books_features)
+
+
+def get_pair_sampler(paragraph_id: Optional[List[int]] = None,
+                     books: Optional[List] = None,
+                     tags: Optional[List] = None,
+                     max_len: Optional[int] = None,
+                     min_len: Optional[int] = None,
+                     max_sent: Optional[int] = None,
+                     min_sent: Optional[int] = None,
+                     books_features: Optional[Dict] = None,
+                     seed: Optional[int] = None):
+    """
+
+    Args:
+        paragraph_id, books, tags, max_len, min_len, max_sent, min_sent, books_features: same as
+            get_paragraphs
+        seed: (Optional) seed of sampling
+
+    Returns:
+        a pairs.PairSampler over the paragraphs satisfying the conditions, for distance, cross book and
+        permutation sampling
+
+    """
+    return default_corpus().pair_sampler(paragraph_id, books, tags, max_len,
+                                         min_len, max_sent, min_sent,
+                                         books_features, seed)
+
+
+def sample_paragraphs(quotas: Dict,
+                      max_per_book: Optional[Union[int, Dict[int, int]]] = None,
+                      num_sequential: int = 1,
+                      books: Optional[List] = None,
+                      tags: Optional[List] = None,
+                      paragraph_object: bool = True,
+                      lowercase: bool = False,
+                      max_len: Optional[int] = None,
+                      min_len: Optional[int] = None,
+                      max_sent: Optional[int] = None,
+                      min_sent: Optional[int] = None,
+                      books_features: Optional[Dict] = None,
+                      seed: Optional[int] = None) -> Dict:
+    """
+
+    Sample paragraphs, or tuples of sequential paragraphs, with a quota for every tag and a cap on every
+    book, e.g. {HP.Tags.SHORT: 1000, HP.Tags.MEDIUM: 1000, HP.Tags.LONG: 1000} with max_per_book=20.
+    with a paragraph store the samples are drawn from the tag and book indexes and only the sampled
+    paragraphs are read, so the time depends on the quotas rather than the size of the corpus.
+
+    Args:
+        quotas: a dictionary {tag: number of samples}. a key may be a tuple of tags, matched by a paragraph
+            with any of them. a tuple of paragraphs is matched by its first paragraph
+        max_per_book: (Optional) maximum number of samples of a book over all tags; an int, or a dictionary
+            {book id: maximum} in which other books are not capped
+        num_sequential, books, tags, paragraph_object, lowercase, max_len, min_len, max_sent, min_sent,
+            books_features: same as get_paragraphs
+        seed: (Optional) seed of sampling
+
+    Returns:
+        a dictionary {key of quotas: list of samples in corpus order}. a tag with fewer paragraphs than
+        its quota gives all of them, and a paragraph is sampled for one key only
+
+    """
+    return default_corpus().sample_paragraphs(quotas, max_per_book, num_sequential, books, tags,
+                                              paragraph_object, lowercase, max_len, min_len,
+                                              max_sent, min_sent, books_features, seed)
+
+
+def get_duplicate_paragraphs(paragraph_id: Optional[List[int]] = None,
+                             books: Optional[List] = None,
+                             tags: Optional[List] = None,
+                             max_len: Optional[int] = None,
+                             min_len: Optional[int] = None,
+                             max_sent: Optional[int] = None,
+                             min_sent: Optional[int] = None,
+                             books_features: Optional[Dict] = None,
+                             threshold: float = 0.8,
+                             num_perm: int = 64,
+                             shingle_size: int = 5,
+                             bands: Optional[int] = None) -> Dict[int, int]:
+    """
+
+    Find near duplicate paragraphs, e.g. the same paragraph in two editions of a book, with MinHash
+    signatures of word shingles and LSH. with a paragraph store the signatures are cached in the store
+    directory, so later calls only bucket them.
+
+    Args:
+        paragraph_id, books, tags, max_len, min_len, max_sent, min_sent, books_features: same as
+            get_paragraphs. only the selected paragraphs are compared
+        threshold: minimum estimated Jaccard similarity of the shingles of duplicates
+        num_perm: length of MinHash signatures
+        shingle_size: number of words of a shingle
+        bands: (Optional) number of LSH bands, a divisor of num_perm. by default it is chosen from threshold
+
+    Returns:
+        a dictionary {id of a duplicate paragraph: id of the paragraph which is kept}. of each group of
+        duplicates the paragraph with the smallest id is kept
+
+    """
+    return default_corpus().duplicates(paragraph_id, books, tags, max_len, min_len,
+                                       max_sent, min_sent, books_features, threshold,
+                                       num_perm, shingle_size, bands)
@@ -1,7 +1,9 @@
 BOOKS_DATA_PATH = "data/books_data.pkl"
 BOOK_SHELVES_PATH = "data/books_shelves.pkl"
+BOOKS_INDEX_PATH = "data/books_index.json"
 PARAGRAPH_METADATA_PATH = "data/paragraph_metadata.pkl"
 PARAGRAPH_DATA_PATH = "data/paragraph_data.pkl"
+PARAGRAPH_STORE_PATH = "data/paragraph_store"
 
 
 class Tags:
@@ -0,0 +1,97 @@
+from array import array
+
+
+def next_rows_of(ids, next_ids, row_of):
+    """
+
+    Turn a next_id column into an array of rows.
+
+    Args:
+        ids: a sequence; ids[r] is the id of the paragraph in row r
+        next_ids: a sequence; next_ids[r] is the id of the paragraph after row r, or 0/None
+        row_of: a function from an id to its row, or None if the id is unknown. it is only
+                called when the next paragraph is not in the next row.
+
+    Returns:
+        an array; the row after row r, or -1 if there is none
+
+    """
+    num_rows = len(ids)
+    res = array("q", bytes(8 * num_rows))
+    for r, nid in enumerate(next_ids):
+        if not nid:
+            res[r] = -1
+        elif r + 1 < num_rows and ids[r + 1] == nid:
+            res[r] = r + 1
+        else:
+            row = row_of(nid)
+            res[r] = -1 if row is None else row
+    return res
+
+
+def run_lengths(next_rows, rows, selected=None):
+    """
+
+    For every row compute the length of the chain of selected rows starting from it. each row is
+    visited once, so this is linear in len(rows).
+
+    Args:
+        next_rows: an array from row to the next row, -1 if there is none
+        rows: the selected rows in increasing order
+        selected: (Optional) a bytes bitset of the selected rows. if it is None every row is selected
+
+    Returns:
+        a dictionary {row: length of the run starting at row}
+
+    """
+    run = dict()
+    for r in reversed(rows):
+        if r in run:
+            continue
+        path = []
+        cur = r
+        while cur >= 0 and cur not in run and (
+                selected is None or selected[cur >> 3] >> (cur & 7) & 1):
+            path.append(cur)
+            # a row in progress counts as the end of the run, so corrupted cyclic chains stop
+            run[cur] = 0
+            cur = next_rows[cur]
+        tail = run.get(cur, 0) if cur >= 0 else 0
+        for p in reversed(path):
+            tail += 1
+            run[p] = tail
+    return run
+
+
+def windows(next_rows, rows, k, selected=None):
+    """
+
+    Find every window of k sequential selected rows.
+
+    Args:
+        next_rows, rows, selected: as in run_lengths
+        k: the length of windows
+
+    Returns:
+        a list of (start row, k) spans in increasing order of start
+
+    """
+    if k < 1:
+        raise ValueError("k most be positive")
+    run = run_lengths(next_rows, rows, selected)
+    return [(r, k) for r in rows if run[r] >= k]
+
+
+def window_rows(next_rows, span):
+    """
+
+    Returns:
+        the rows of a (start, k) span
+
+    """
+    row, k = span
+    res = [row]
+    for _ in range(k - 1):
+        row = next_rows[row]
+        res.append(row)
+    return res
@@ -0,0 +1,411 @@
+"""
+desc: a versioned container format for the books, bookshelves and paragraph data files, which replaces their
+      pickles. a container is a fixed size header, with a magic number, the schema version, the kind of data,
+      the payload size and a crc32 checksum of the payload, followed by typed columns. the header is
+      validated in O(1) before the payload is read, and loading does not run any code from the file.
+
+usage: python gutenberg_API/container.py migrate [--data-dir data] [--check]
+       python gutenberg_API/container.py validate [--data-dir data]
+"""
+import HP
+import argparse
+import gc
+import json
+import os
+import pickle
+import struct
+import sys
+import zlib
+from array import array
+from store import mask_to_tags, tags_to_mask
+
+MAGIC = b"TPDATA\r\n"
+SCHEMA_VERSION = 2
+SUFFIX = ".tpc"
+KINDS = ("books", "bookshelves", "paragraph_metadata", "paragraph_data")
+# magic, schema version, kind, payload size, crc32 of the payload
+_HEADER = struct.Struct("<8sHHQI4x")
+_SEPARATOR = "\x00"
+_PARAGRAPH_KEYS = ("id", "book_id", "prev_id", "next_id", "tags")
+
+
+class ContainerError(ValueError):
+    pass
+
+
+def newer_container(path):
+    """
+
+    Returns:
+        the path of the container of the pickle in path, if it exists and is not older than the pickle,
+        otherwise None. a container of another schema version is ignored if there is a pickle
+
+    """
+    target = container_path(path)
+    if not os.path.isfile(target):
+        return None
+    if os.path.isfile(path) and (os.path.getmtime(path) > os.path.getmtime(target) or
+                                 _schema_version(target) != SCHEMA_VERSION):
+        return None
+    return target
+
+
+def _schema_version(path):
+    with open(path, "rb") as f:
+        data = f.read(_HEADER.size)
+    if len(data) < _HEADER.size or not data.startswith(MAGIC):
+        return None
+    return _HEADER.unpack(data)[1]
+
+
+def container_path(path):
+    """
+
+    Returns:
+        the path of the container which replaces the pickle in path, e.g. data/books_data.tpc
+
+    """
+    return os.path.splitext(path)[0] + SUFFIX
+
+
+def _strings(values):
+    data = _SEPARATOR.join(values)
+    if data.count(_SEPARATOR) != max(len(values) - 1, 0):
+        raise ContainerError("strings should not contain %r" % _SEPARATOR)
+    return data.encode("utf-8")
+
+
+def _split(data, count):
+    if count == 0:
+        return []
+    return str(data, "utf-8").split(_SEPARATOR)
+
+
+def _nested(groups):
+    """
+
+    Flatten groups of strings to a strings column and an offsets column.
+
+    """
+    values = []
+    offsets = array("q", [0])
+    for group in groups:
+        values.extend(group)
+        offsets.append(len(values))
+    return _strings(values), offsets
+
+
+def _encode_books(books):
+    ids = array("q", sorted(books))
+    features = sorted({feature for id in ids for feature in books[id]})
+    columns = {"ids": ids, "features": _strings(features)}
+    for f, feature in enumerate(features):
+        groups = []
+        for id in ids:
+            value = books[id].get(feature, set())
+            if not isinstance(value, (set, frozenset)):
+                raise ContainerError("feature %r of book %d should be a set" % (feature, id))
+            groups.append(value)
+        types = {type(v) for group in groups for v in group}
+        if types <= {int}:
+            groups = [sorted(group) for group in groups]
+            column = array("q", [v for group in groups for v in group])
+            offsets = array("q", [0])
+            for group in groups:
+                offsets.append(offsets[-1] + len(group))
+        elif types == {str}:
+            column, offsets = _nested(sorted(group) for group in groups)
+        else:
+            raise ContainerError("feature %r should be a set of strings or of ints" % feature)
+        # columns are named by position, so any feature name can be stored
+        columns["feature_%d" % f] = column
+        columns["feature_%d_offsets" % f] = offsets
+        columns["feature_%d_present" % f] = array("b", [feature in books[id] for id in ids])
+    return columns
+
+
+def _decode_books(columns):
+    res = {id: dict() for id in columns["ids"]}
+    ids = columns["ids"]
+    features = _split(columns["features"], sum(name.endswith("_present") for name in columns))
+    for f, feature in enumerate(features):
+        offsets = columns["feature_%d_offsets" % f]
+        values = columns["feature_%d" % f]
+        if not isinstance(values, array):
+            values = _split(values, offsets[-1])
+        for i, present in enumerate(columns["feature_%d_present" % f]):
+            if present:
+                res[ids[i]][feature] = set(values[offsets[i]:offsets[i + 1]])
+    return res
+
+
+def _encode_bookshelves(shelves):
+    names = sorted(shelves)
+    books = array("q")
+    offsets = array("q", [0])
+    for name in names:
+        books.extend(sorted(shelves[name]))
+        offsets.append(len(books))
+    return {"names": _strings(names), "books": books, "offsets": offsets}
+
+
+def _decode_bookshelves(columns):
+    offsets, books = columns["offsets"], columns["books"]
+    names = _split(columns["names"], len(offsets) - 1)
+    return {name: set(books[offsets[i]:offsets[i + 1]]) for i, name in enumerate(names)}
+
+
+def _encode_paragraph_metadata(metadata):
+    ids = array("q", sorted(metadata))
+    columns = {"ids": ids, "keys": array("B"), "nulls": array("B")}
+    for key in _PARAGRAPH_KEYS[1:]:
+        columns[key] = array("Q" if key == "tags" else "q")
+    for id in ids:
+        met = metadata[id]
+        if set(met) - set(_PARAGRAPH_KEYS) or met.get("id", id) != id:
+            raise ContainerError("unsupported metadata of paragraph %d" % id)
+        # bit k of keys (nulls) is set if the k-th key of _PARAGRAPH_KEYS is in the metadata (and is None)
+        columns["keys"].append(sum(1 << k for k, key in enumerate(_PARAGRAPH_KEYS) if key in met))
+        columns["nulls"].append(sum(1 << k for k, key in enumerate(_PARAGRAPH_KEYS)
+                                    if key in met and met[key] is None))
+        for key in _PARAGRAPH_KEYS[1:]:
+            value = met.get(key)
+            if value is None:
+                value = 0
+            elif key == "tags":
+                value = tags_to_mask(value)
+            elif not isinstance(value, int):
+                raise ContainerError("%s of paragraph %d should be an int" % (key, id))
+            columns[key].append(value)
+    return columns
+
+
+def _decode_paragraph_metadata(columns):
+    full = (1 << len(_PARAGRAPH_KEYS)) - 1
+    fixes = {
+        (keys, nulls): ([key for k, key in enumerate(_PARAGRAPH_KEYS) if not keys >> k & 1],
+                        [key for k, key in enumerate(_PARAGRAPH_KEYS) if nulls >> k & 1])
+        for keys, nulls in set(zip(columns["keys"], columns["nulls"]))
+    }
+    tag_sets = {mask: mask_to_tags(mask) for mask in set(columns["tags"])}
+    res = dict()
+    for id, keys, nulls, book_id, prev_id, next_id, mask in zip(
+            columns["ids"], columns["keys"], columns["nulls"], columns["book_id"],
+            columns["prev_id"], columns["next_id"], columns["tags"]):
+        met = {"id": id, "book_id": book_id, "prev_id": prev_id, "next_id": next_id,
+               "tags": set(tag_sets[mask])}
+        if keys != full or nulls:
+            missing, none = fixes[keys, nulls]
+            for key in missing:
+                del met[key]
+            for key in none:
+                met[key] = None
+        res[id] = met
+    return res
+
+
+def _encode_paragraph_data(text):
+    ids = array("q", sorted(text))
+    vocabulary = dict()
+    words = array("I")
+    sentence_offsets = array("q", [0])
+    word_offsets = array("q", [0])
+    for id in ids:
+        for sent in text[id]:
+            # words are stored once and referenced by index, so equal words share one string when loaded
+            words.extend(vocabulary.setdefault(word, len(vocabulary)) for word in sent)
+            word_offsets.append(len(words))
+        sentence_offsets.append(len(word_offsets) - 1)
+    return {
+        "ids": ids,
+        "vocabulary": _strings(list(vocabulary)),
+        "words": words,
+        "sentence_offsets": sentence_offsets,
+        "word_offsets": word_offsets,
+    }
+
+
+def _decode_paragraph_data(columns):
+    ids = columns["ids"]
+    words = columns["words"]
+    vocabulary = _split(columns["vocabulary"], len(words))
+    words = list(map(vocabulary.__getitem__, words))
+    word_offsets = columns["word_offsets"]
+    sentences = [words[a:b] for a, b in zip(word_offsets, word_offsets[1:])]
+    offsets = columns["sentence_offsets"]
+    return {id: sentences[offsets[i]:offsets[i + 1]] for i, id in enumerate(ids)}
+
+
+_CODECS = {
+    "books": (_encode_books, _decode_books),
+    "bookshelves": (_encode_bookshelves, _decode_bookshelves),
+    "paragraph_metadata": (_encode_paragraph_metadata, _decode_paragraph_metadata),
+    "paragraph_data": (_encode_paragraph_data, _decode_paragraph_data),
+}
+
+
+def write(path, kind, value):
+    """
+
+    Write a container atomically.
+
+    Args:
+        path: path of the container
+        kind: one of KINDS
+        value: the data, with the shape of the pickle it replaces
+
+    """
+    if kind not in KINDS:
+        raise ValueError("kind should be one of %s" % list(KINDS))
+    columns = _CODECS[kind][0](value)
+    layout = []
+    parts = []
+    for name, column in columns.items():
+        data = column.tobytes() if isinstance(column, array) else column
+        layout.append([name, column.typecode if isinstance(column, array) else "s", len(data)])
+        parts.append(data)
+    table = json.dumps(layout).encode()
+    payload = b"".join([struct.pack("<Q", len(table)), table] + parts)
+    with open(path + ".tmp", "wb") as f:
+        f.write(_HEADER.pack(MAGIC, SCHEMA_VERSION, KINDS.index(kind), len(payload),
+                             zlib.crc32(payload)))
+        f.write(payload)
+    os.replace(path + ".tmp", path)
+
+
+def _check_header(f, path, kind):
+    data = f.read(_HEADER.size)
+    if len(data) < _HEADER.size:
+        raise ContainerError("%s is not a container" % path)
+    magic, version, code, size, checksum = _HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ContainerError("%s is not a container" % path)
+    if version != SCHEMA_VERSION:
+        raise ContainerError("unsupported schema version %d of %s" % (version, path))
+    if code >= len(KINDS) or KINDS[code] != kind:
+        raise ContainerError("%s is not a %s container" % (path, kind))
+    if os.fstat(f.fileno()).st_size != _HEADER.size + size:
+        raise ContainerError("%s is truncated" % path)
+    return size, checksum
+
+
+def read_header(path, kind):
+    """
+
+    Validate the header of a container in O(1), without reading the payload.
+
+    Returns:
+        a dictionary with the schema version, kind, payload size and checksum
+
+    """
+    with open(path, "rb") as f:
+        size, checksum = _check_header(f, path, kind)
+    return {"schema_version": SCHEMA_VERSION, "kind": kind, "size": size, "checksum": checksum}
+
+
+def read(path, kind, verify=True):
+    """
+
+    Args:
+        path: path of the container
+        kind: the expected kind
+        verify: if it is True the checksum of the payload is verified before it is decoded
+
+    Returns:
+        the data, with the shape of the pickle it replaces
+
+    """
+    with open(path, "rb") as f:
+        size, checksum = _check_header(f, path, kind)
+        payload = memoryview(f.read(size))
+    if verify and zlib.crc32(payload) != checksum:
+        raise ContainerError("checksum mismatch of %s" % path)
+    (table_size,) = struct.unpack_from("<Q", payload)
+    # decoding only builds acyclic containers, so the cyclic collector would only rescan them
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _decode(kind, payload, table_size)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _decode(kind, payload, table_size):
+    layout = json.loads(bytes(payload[8:8 + table_size]))
+    columns = dict()
+    start = 8 + table_size
+    for name, typecode, size in layout:
+        data = payload[start:start + size]
+        start += size
+        if typecode == "s":
+            columns[name] = data
+        else:
+            columns[name] = array(typecode)
+            columns[name].frombytes(data)
+    return _CODECS[kind][1](columns)
+
+
+# kind of every data file, by the HP attribute of its path
+DATA_FILES = {
+    "BOOKS_DATA_PATH": "books",
+    "BOOK_SHELVES_PATH": "bookshelves",
+    "PARAGRAPH_METADATA_PATH": "paragraph_metadata",
+    "PARAGRAPH_DATA_PATH": "paragraph_data",
+}
+
+
+def migrate(data_dir=None, check=False):
+    """
+
+    Convert the pickles of the data files to containers next to them. pickles without a container, newer
+    than it, or with a container of another schema version are converted.
+
+    Args:
+        data_dir: (Optional) directory of the data files. if it is None the paths of HP are used
+        check: if it is True every container is read back and compared with its pickle
+
+    Returns:
+        the list of written containers
+
+    """
+    res = []
+    for name, kind in DATA_FILES.items():
+        path = getattr(HP, name)
+        if data_dir is not None:
+            path = os.path.join(data_dir, os.path.basename(path))
+        target = container_path(path)
+        if not os.path.isfile(path):
+            continue
+        if newer_container(path) is not None:
+            continue
+        with open(path, "rb") as f:
+            value = pickle.load(f, encoding="latin1")
+        if not isinstance(value, dict):
+            raise ContainerError("%s is not a dictionary" % path)
+        write(target, kind, value)
+        if check and read(target, kind) != value:
+            os.remove(target)
+            raise ContainerError("%s does not round trip" % path)
+        res.append(target)
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="convert the data pickles to containers")
+    parser.add_argument("command", choices=("migrate", "validate"))
+    parser.add_argument("--data-dir", default=None, help="directory of the data files, data/ by default")
+    parser.add_argument("--check", action="store_true", help="compare the containers with the pickles")
+    args = parser.parse_args()
+    if args.command == "migrate":
+        for target in migrate(args.data_dir, args.check):
+            print("wrote %s" % target, file=sys.stderr)
+    else:
+        for name, kind in DATA_FILES.items():
+            path = getattr(HP, name)
+            if args.data_dir is not None:
+                path = os.path.join(args.data_dir, os.path.basename(path))
+            path = container_path(path)
+            if os.path.isfile(path):
+                read(path, kind)
+                print("%s: ok" % path, file=sys.stderr)
@@ -0,0 +1,718 @@
+import HP
+import container
+import hashlib
+import instrument
+import os
+import pickle
+from array import array
+from functools import partial
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Sized, Union
+from gutenberg_book import GutenbergBook, create_gutenberg_books
+from paragraph import LazyParagraphs, create_paragraphs
+from index import BookIndex, bitmap_from_rows, range_bitmap
+from pairs import PairSampler
+from sampling import StratifiedSampler
+from dedup import MinHasher, duplicate_rows, store_signatures
+from store import HEADER_FILE, ParagraphStore
+from chains import next_rows_of, window_rows, windows
+
+
+class Corpus(object):
+
+    def __init__(self,
+                 books_path: Optional[str] = None,
+                 bookshelves_path: Optional[str] = None,
+                 paragraph_metadata_path: Optional[str] = None,
+                 paragraph_data_path: Optional[str] = None,
+                 store_path: Optional[str] = None,
+                 books_index_path: Optional[str] = None,
+                 cache_size: int = 32):
+        """
+
+        A handle on the data files which loads (or memory-maps) each of them once and keeps an LRU
+        cache of get_paragraphs results. a file is reloaded, and the result cache cleared, when its
+        modification time changes.
+
+        Args:
+            books_path, bookshelves_path, paragraph_metadata_path, paragraph_data_path, store_path,
+            books_index_path: (Optional) paths of the data files. if a path is None the one in HP is used.
+            cache_size: maximum number of cached get_paragraphs results. 0 disables the cache.
+        """
+        self._paths = {
+            "books": books_path,
+            "bookshelves": bookshelves_path,
+            "paragraph_metadata": paragraph_metadata_path,
+            "paragraph_data": paragraph_data_path,
+            "store": store_path,
+            "books_index": books_index_path,
+        }
+        self._cache_size = cache_size
+        self._loaded = dict()
+        self._results = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def path(self, name: str) -> str:
+        defaults = {
+            "books": HP.BOOKS_DATA_PATH,
+            "bookshelves": HP.BOOK_SHELVES_PATH,
+            "paragraph_metadata": HP.PARAGRAPH_METADATA_PATH,
+            "paragraph_data": HP.PARAGRAPH_DATA_PATH,
+            "store": HP.PARAGRAPH_STORE_PATH,
+            "books_index": HP.BOOKS_INDEX_PATH,
+        }
+        return self._paths[name] or defaults[name]
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _get(self, name, paths, loader):
+        """
+
+        Return the cached value of name, calling loader(*paths) if it is missing or one of paths changed.
+
+        """
+        stamp = tuple(self._stamp(path) for path in paths)
+        cached = self._loaded.get(name)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        with instrument.current().stage("load_%s" % name) as stage:
+            value = loader(*paths)
+            if isinstance(value, Sized):
+                stage.items_out = len(value)
+        self._loaded[name] = (stamp, value)
+        if name in ("store", "paragraphs"):
+            self._results.clear()
+        return value
+
+    def _data_paths(self, name):
+        """
+
+        Returns:
+            the paths of a data file, its container first and then its pickle
+
+        """
+        path = self.path(name)
+        return [container.container_path(path), path]
+
+    def books_metadata(self) -> Dict:
+        return self._get("books", self._data_paths("books"),
+                         lambda *paths: _load_dict(*paths, kind="books"))
+
+    def book_index(self) -> BookIndex:
+        """
+
+        Returns:
+            the BookIndex of the books metadata. it is loaded from HP.BOOKS_INDEX_PATH, or built and saved
+            there if it is missing or was built from another version of the metadata.
+
+        """
+        return self._get("books_index", self._data_paths("books"), self._load_book_index)
+
+    def _load_book_index(self, *paths):
+        stamps = [self._stamp(path) for path in paths]
+        stamp = None if all(s is None for s in stamps) else [s and list(s) for s in stamps]
+        index_path = self.path("books_index")
+        if os.path.isfile(index_path):
+            index = BookIndex.load(index_path)
+            if index.stamp == stamp:
+                return index
+        index = BookIndex.build(self.books_metadata(), stamp)
+        if stamp is not None:
+            index.save(index_path)
+        return index
+
+    def book_ids(self, books_features: Dict) -> set:
+        """
+
+        Args:
+            books_features: features to get books with that feature, as in get_books
+
+        Returns:
+            the set of ids of books with those features
+
+        """
+        return set(self.get_books(books_features=books_features, book_object=False))
+
+    def bookshelves(self) -> Dict:
+        return self._get("bookshelves", self._data_paths("bookshelves"),
+                         lambda *paths: _load_dict(*paths, kind="bookshelves"))
+
+    def store(self) -> Optional[ParagraphStore]:
+        """
+
+        Returns:
+            the ParagraphStore, or None if there is no store and the pickles are used
+
+        """
+        header = os.path.join(self.path("store"), HEADER_FILE)
+        if not os.path.isfile(header):
+            return None
+        return self._get("store", [header],
+                         lambda _: ParagraphStore(self.path("store")))
+
+    def _pickled_paragraphs(self):
+        return self._get(
+            "paragraphs",
+            self._data_paths("paragraph_metadata") + self._data_paths("paragraph_data"),
+            _load_paragraphs)
+
+    def cache_info(self) -> Dict:
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "size": len(self._results),
+            "max_size": self._cache_size,
+        }
+
+    def clear_cache(self):
+        self._results.clear()
+        self._hits = 0
+        self._misses = 0
+
+    def get_books(self,
+                  books_list: Optional[List] = None,
+                  books_features: Optional[Dict] = None,
+                  book_object: bool = True) -> Dict:
+        """
+
+        Same as API.get_books
+
+        """
+        if books_list is not None and books_features is not None:
+            raise AttributeError(
+                "only one of books_list and books_features should be identified")
+        books_metadata = self.books_metadata()
+
+        if books_list is not None:
+            books_list = books_list & set(books_metadata)
+            books_metadata = {id: books_metadata[id] for id in books_list}
+        if books_features is not None:
+            indexed = {
+                feature: set(items)
+                for feature, items in books_features.items()
+                if feature in BookIndex.FEATURES
+            }
+            ids = self.book_index().select(indexed)
+            if ids is not None:
+                books_metadata = {
+                    id: books_metadata[id]
+                    for id in sorted(ids)
+                    if id in books_metadata
+                }
+            for feature, items in books_features.items():
+                if feature not in indexed:
+                    books_metadata = {
+                        id: metadata
+                        for id, metadata in books_metadata.items()
+                        if set(items).issubset(metadata[feature])
+                    }
+        if book_object:
+            return create_gutenberg_books(books_metadata, dic=True)
+        return dict(books_metadata)
+
+    def get_bookshelves(self, bookshelves_list: Optional[List] = None) -> Dict:
+        """
+
+        Same as API.get_bookshelves
+
+        """
+        bookshelves = self.bookshelves()
+        if bookshelves_list is not None:
+            bookshelves_list = bookshelves_list & set(bookshelves)
+            return {
+                bookshelf: bookshelves[bookshelf]
+                for bookshelf in bookshelves_list
+            }
+        return dict(bookshelves)
+
+    def get_paragraph_books(self) -> List[int]:
+        """
+
+        Same as API.get_paragraph_books
+
+        """
+        store = self.store()
+        if store is not None:
+            return [book for book in store.index.book_ids if book]
+        return sorted({
+            par.book_id
+            for par in self._pickled_paragraphs().values()
+            if par.book_id
+        })
+
+    def books_of(self, paragraph_id: List[int]) -> Dict[int, Optional[int]]:
+        """
+
+        Look up the book of paragraphs by id, without building or caching the paragraphs.
+
+        Returns:
+            a dictionary {paragraph id: book id, or None if it has no book}; unknown ids are left out
+
+        """
+        store = self.store()
+        res = dict()
+        if store is not None:
+            book_id = store.book_id
+            for i in paragraph_id:
+                row = store.row_of(i)
+                if row is not None:
+                    res[i] = book_id[row] or None
+        else:
+            pars = self._pickled_paragraphs()
+            for i in paragraph_id:
+                if i in pars:
+                    res[i] = pars[i].book_id
+        return res
+
+    def book_fingerprints(self, books: Optional[List[int]] = None) -> Dict[int, str]:
+        """
+
+        Fingerprint the paragraphs of books. a fingerprint changes when the ids, chain, tags, words or
+        counts of the paragraphs of the book change, so it tells which books a derived dataset
+        should be rebuilt for.
+
+        Args:
+            books: (Optional) a list of book ids. if it is None every book with paragraphs is used
+
+        Returns:
+            a dictionary {book id: hex digest}
+
+        """
+        if books is None:
+            books = self.get_paragraph_books()
+        store = self.store()
+        with instrument.current().stage("book_fingerprints", len(books)) as stage:
+            if store is not None:
+                res = {book: _store_fingerprint(store, book) for book in books}
+            else:
+                res = _paragraph_fingerprints(self._pickled_paragraphs(), books)
+            stage.items_out = len(res)
+        return res
+
+    def get_paragraphs(self,
+                       paragraph_id: Optional[List[int]] = None,
+                       books: Optional[List] = None,
+                       tags: Optional[List] = None,
+                       num_sequential: int = 1,
+                       paragraph_object: bool = True,
+                       lowercase: bool = False,
+                       max_len: Optional[int] = None,
+                       min_len: Optional[int] = None,
+                       max_sent: Optional[int] = None,
+                       min_sent: Optional[int] = None,
+                       books_features: Optional[Dict] = None) -> List:
+        """
+
+        Same as API.get_paragraphs. results are kept in an LRU cache keyed by the normalized arguments;
+        the returned list is a copy, but the paragraphs in it are shared with the cache.
+
+        """
+        _check_arguments(paragraph_id, books, tags, num_sequential,
+                         books_features)
+        books = self._resolve_books(books, books_features)
+        args = (paragraph_id, books, tags, num_sequential, paragraph_object,
+                lowercase, max_len, min_len, max_sent, min_sent)
+        # reload changed files first, which also clears the cache
+        if self.store() is None:
+            self._pickled_paragraphs()
+        key = _query_key(*args)
+        if key in self._results:
+            self._hits += 1
+            self._results.move_to_end(key)
+            return list(self._results[key])
+        self._misses += 1
+        with instrument.current().stage("select_paragraphs") as stage:
+            result = list(self.iter_paragraphs(*args))
+            stage.items_out = len(result)
+        if self._cache_size > 0:
+            self._results[key] = result
+            while len(self._results) > self._cache_size:
+                self._results.popitem(last=False)
+        return list(result)
+
+    def _resolve_books(self, books, books_features):
+        """
+
+        Intersect books with the books selected by books_features on the book index.
+
+        """
+        if books_features is None:
+            return books
+        selected = self.book_ids(books_features)
+        if books is None:
+            return selected
+        return _normalize_books(books) & selected
+
+    def pair_sampler(self,
+                     paragraph_id: Optional[List[int]] = None,
+                     books: Optional[List] = None,
+                     tags: Optional[List] = None,
+                     max_len: Optional[int] = None,
+                     min_len: Optional[int] = None,
+                     max_sent: Optional[int] = None,
+                     min_sent: Optional[int] = None,
+                     books_features: Optional[Dict] = None,
+                     seed: Optional[int] = None) -> PairSampler:
+        """
+
+        Same as API.get_pair_sampler
+
+        """
+        _check_arguments(paragraph_id, books, tags, 1, books_features)
+        books = self._resolve_books(books, books_features)
+        lengths = (max_len, min_len, max_sent, min_sent)
+        store = self.store()
+        if store is not None:
+            pars = _store_paragraphs(store, paragraph_id, books, tags, lengths)
+        else:
+            pars = _filter_paragraphs(self._pickled_paragraphs(), paragraph_id,
+                                      books, tags, lengths)
+        return PairSampler(pars, seed)
+
+    def sample_paragraphs(self,
+                          quotas: Dict,
+                          max_per_book: Optional[Union[int, Dict[int, int]]] = None,
+                          num_sequential: int = 1,
+                          books: Optional[List] = None,
+                          tags: Optional[List] = None,
+                          paragraph_object: bool = True,
+                          lowercase: bool = False,
+                          max_len: Optional[int] = None,
+                          min_len: Optional[int] = None,
+                          max_sent: Optional[int] = None,
+                          min_sent: Optional[int] = None,
+                          books_features: Optional[Dict] = None,
+                          seed: Optional[int] = None) -> Dict:
+        """
+
+        Same as API.sample_paragraphs. results are not cached.
+
+        """
+        _check_arguments(None, books, tags, num_sequential, books_features)
+        books = self._resolve_books(books, books_features)
+        lengths = (max_len, min_len, max_sent, min_sent)
+        strata = {name: {name} if isinstance(name, int) else set(name) for name in quotas}
+        store = self.store()
+        with instrument.current().stage("sample_paragraphs") as stage:
+            if store is not None:
+                pars = _store_paragraphs(store, None, books, tags, lengths)
+                bitmaps = dict()
+                for name, group in strata.items():
+                    bitmaps[name] = 0
+                    for tag in group:
+                        bitmaps[name] |= store.index.tag_bitmap(tag)
+                sampler = StratifiedSampler(pars.bits, store.index.next_rows,
+                                            store.book_id.__getitem__, seed)
+                paragraph = partial(pars.by_row, cache=False)
+            else:
+                pars = _filter_paragraphs(self._pickled_paragraphs(), None, books,
+                                          tags, lengths)
+                values = list(pars.values())
+                position = {i: r for r, i in enumerate(pars)}
+                next_rows = next_rows_of(list(pars), [par.next_id for par in values],
+                                         position.get)
+                bitmaps = {
+                    name: bitmap_from_rows((r for r, par in enumerate(values)
+                                            if not par.tags.isdisjoint(group)), len(values))
+                    for name, group in strata.items()
+                }
+                bits = range_bitmap(0, len(values)).to_bytes((len(values) + 7) // 8, "little")
+                sampler = StratifiedSampler(bits, next_rows, lambda r: values[r].book_id, seed)
+                paragraph = values.__getitem__
+            sampled = sampler.sample(bitmaps, quotas, num_sequential, max_per_book)
+            res = dict()
+            for name, spans in sampled.items():
+                items = [tuple(paragraph(r) for r in window) for window in spans]
+                if not paragraph_object:
+                    items = [tuple(par.text(lowercase=lowercase) for par in pt) for pt in items]
+                res[name] = items if num_sequential > 1 else [pt[0] for pt in items]
+            stage.items_out = sum(len(items) for items in res.values())
+        return res
+
+    def duplicates(self,
+                   paragraph_id: Optional[List[int]] = None,
+                   books: Optional[List] = None,
+                   tags: Optional[List] = None,
+                   max_len: Optional[int] = None,
+                   min_len: Optional[int] = None,
+                   max_sent: Optional[int] = None,
+                   min_sent: Optional[int] = None,
+                   books_features: Optional[Dict] = None,
+                   threshold: float = 0.8,
+                   num_perm: int = 64,
+                   shingle_size: int = 5,
+                   bands: Optional[int] = None) -> Dict[int, int]:
+        """
+
+        Same as API.get_duplicate_paragraphs
+
+        """
+        _check_arguments(paragraph_id, books, tags, 1, books_features)
+        books = self._resolve_books(books, books_features)
+        lengths = (max_len, min_len, max_sent, min_sent)
+        hasher = MinHasher(num_perm, shingle_size)
+        instrumentation = instrument.current()
+        store = self.store()
+        if store is not None:
+            pars = _store_paragraphs(store, paragraph_id, books, tags, lengths)
+            with instrumentation.stage("minhash_signatures", len(store)) as stage:
+                signatures = store_signatures(store, hasher)
+                stage.items_out = len(store)
+            rows = pars.rows()
+            ids = store.id
+        else:
+            pars = _filter_paragraphs(self._pickled_paragraphs(), paragraph_id,
+                                      books, tags, lengths)
+            values = [pars[i] for i in sorted(pars)]
+            with instrumentation.stage("minhash_signatures", len(values)) as stage:
+                signatures = hasher.signatures(par.text("words") for par in values)
+                stage.items_out = len(values)
+            rows = range(len(values))
+            ids = [par.id for par in values]
+        with instrumentation.stage("lsh_duplicates", len(rows)) as stage:
+            res = {
+                ids[r]: ids[kept]
+                for r, kept in duplicate_rows(signatures, rows, num_perm, threshold, bands).items()
+            }
+            stage.items_out = len(res)
+        return res
+
+    def iter_paragraphs(self,
+                        paragraph_id: Optional[List[int]] = None,
+                        books: Optional[List] = None,
+                        tags: Optional[List] = None,
+                        num_sequential: int = 1,
+                        paragraph_object: bool = True,
+                        lowercase: bool = False,
+                        max_len: Optional[int] = None,
+                        min_len: Optional[int] = None,
+                        max_sent: Optional[int] = None,
+                        min_sent: Optional[int] = None,
+                        books_features: Optional[Dict] = None) -> Iterator:
+        """
+
+        Same as API.iter_paragraphs. results are not cached.
+
+        """
+        _check_arguments(paragraph_id, books, tags, num_sequential,
+                         books_features)
+        books = self._resolve_books(books, books_features)
+        lengths = (max_len, min_len, max_sent, min_sent)
+        store = self.store()
+        if store is not None:
+            pars = _store_paragraphs(store, paragraph_id, books, tags, lengths)
+        else:
+            pars = _filter_paragraphs(self._pickled_paragraphs(), paragraph_id,
+                                      books, tags, lengths)
+
+        if num_sequential == 1:
+            if isinstance(pars, LazyParagraphs):
+                items = (pars.by_row(r, cache=False) for r in pars.rows())
+            else:
+                items = iter(pars.values())
+            if paragraph_object:
+                return items
+            return (par.text(lowercase=lowercase) for par in items)
+        items = _sequential_paragraphs(pars, num_sequential)
+        if paragraph_object:
+            return items
+        return (tuple(par.text(lowercase=lowercase)
+                      for par in pt)
+                for pt in items)
+
+
+_default_corpus = None
+
+
+def default_corpus() -> Corpus:
+    """
+
+    Returns:
+        the process-wide Corpus used by the functions of API
+
+    """
+    global _default_corpus
+    if _default_corpus is None:
+        _default_corpus = Corpus()
+    return _default_corpus
+
+
+def _load_dict(container_path, path, kind):
+    """
+
+    Load a data file from its container, or from its pickle if there is no container or the pickle is
+    newer (see container.migrate). both paths are given so that Corpus reloads when either changes.
+
+    """
+    if container.newer_container(path) == container_path:
+        return container.read(container_path, kind)
+    if not os.path.isfile(path):
+        return dict()
+    with open(path, "rb") as pk:
+        res = pickle.load(pk)
+    assert isinstance(res, dict)
+    return res
+
+
+def _load_paragraphs(metadata_container, metadata_path, data_container, data_path):
+    instrumentation = instrument.current()
+    containers = (container.newer_container(metadata_path) == metadata_container and
+                  container.newer_container(data_path) == data_container)
+    if containers:
+        with instrumentation.stage("read_paragraph_containers") as stage:
+            met_data = container.read(metadata_container, "paragraph_metadata")
+            text = container.read(data_container, "paragraph_data")
+            stage.items_out = len(met_data)
+    else:
+        with instrumentation.stage("unpickle_paragraphs") as stage:
+            with open(metadata_path, "rb") as pkl:
+                met_data = pickle.load(pkl)
+            with open(data_path, "rb") as pkl:
+                text = pickle.load(pkl, encoding='latin1')
+            stage.items_out = len(met_data)
+    with instrumentation.stage("create_paragraphs", len(met_data)) as stage:
+        # the columns of containers are typed and checksummed, so they are not validated again
+        pars = create_paragraphs(met_data, text, validate=not containers)
+        stage.items_out = len(pars)
+    return pars
+
+
+def _store_fingerprint(store, book):
+    rows = store.index.book_rows(book)
+    h = hashlib.blake2b(digest_size=16)
+    if not rows:
+        return h.hexdigest()
+    offsets = store.byte_offsets
+    if rows[-1] - rows[0] + 1 == len(rows):
+        start, end = rows[0], rows[-1] + 1
+        for column in (store.id, store.next_id, store.tags, store.num_words,
+                       store.num_sentences):
+            h.update(column[start:end])
+        h.update(array("q", (offsets[r + 1] - offsets[r] for r in rows)))
+        h.update(store.tokens[offsets[start]:offsets[end]])
+        return h.hexdigest()
+    for r in rows:
+        h.update(array("q", (store.id[r], store.next_id[r], store.tags[r], store.num_words[r],
+                             store.num_sentences[r], offsets[r + 1] - offsets[r])))
+        h.update(store.tokens[offsets[r]:offsets[r + 1]])
+    return h.hexdigest()
+
+
+def _paragraph_fingerprints(pars, books):
+    hashes = {book: hashlib.blake2b(digest_size=16) for book in books}
+    for id in sorted(pars):
+        par = pars[id]
+        h = hashes.get(par.book_id)
+        if h is not None:
+            h.update(repr((par.id, par.next_id, sorted(par.tags),
+                           par.text("sentences"))).encode())
+    return {book: h.hexdigest() for book, h in hashes.items()}
+
+
+def _check_arguments(paragraph_id, books, tags, num_sequential,
+                     books_features=None):
+    if paragraph_id is not None and (books is not None or tags is not None or
+                                     books_features is not None):
+        raise ValueError(
+            "if paragraph_id is given, books, books_features and tags can't be accepted.")
+    if num_sequential < 1:
+        raise ValueError("num_sequential most be positive")
+
+
+def _normalize_books(books):
+    return {i for i in books if isinstance(i, int)} | {
+        book.id for book in books if isinstance(book, GutenbergBook)
+    }
+
+
+def _normalize_tags(tags):
+    return [{tag} for tag in tags if isinstance(tag, int)
+           ] + [set(tag) for tag in tags if not isinstance(tag, int)]
+
+
+def _query_key(paragraph_id, books, tags, *rest):
+    return (None if paragraph_id is None else tuple(sorted(set(paragraph_id))),
+            None if books is None else tuple(sorted(_normalize_books(books))),
+            None if tags is None else tuple(
+                sorted(tuple(sorted(group)) for group in _normalize_tags(tags))),
+            rest)
+
+
+def _in_bounds(value, high, low):
+    return (high is None or value <= high) and (low is None or value >= low)
+
+
+def _filter_paragraphs(pars, paragraph_id, books, tags, lengths):
+    if paragraph_id is not None:
+        pars = {i: par for i, par in pars.items() if par.id in paragraph_id}
+    if books is not None:
+        books = _normalize_books(books)
+        pars = {i: par for i, par in pars.items() if par.book_id in books}
+    if tags is not None:
+        tags = _normalize_tags(tags)
+        pars = {
+            i: par
+            for i, par in pars.items()
+            if all([not par.tags.isdisjoint(tag) for tag in tags])
+        }
+    max_len, min_len, max_sent, min_sent = lengths
+    if any(bound is not None for bound in lengths):
+        pars = {
+            i: par
+            for i, par in pars.items()
+            if _in_bounds(par.num_words, max_len, min_len) and
+            _in_bounds(par.num_sentences, max_sent, min_sent)
+        }
+    return pars
+
+
+def _store_paragraphs(store, paragraph_id, books, tags, lengths):
+    """
+
+    Resolve the filters on the store indexes and only build paragraphs for the selected rows.
+
+    """
+    max_len, min_len, max_sent, min_sent = lengths
+    selected = store.index.select(
+        books=None if books is None else _normalize_books(books),
+        tags=None if tags is None else _normalize_tags(tags),
+        max_len=max_len,
+        min_len=min_len,
+        max_sent=max_sent,
+        min_sent=min_sent)
+    if paragraph_id is not None:
+        rows = {store.row_of(i) for i in paragraph_id} - {None}
+        selected &= bitmap_from_rows(rows, len(store))
+    return LazyParagraphs(store, selected)
+
+
+def _sequential_paragraphs(pars, num_sequential):
+    """
+
+    Iterate the tuples of num_sequential paragraphs of pars which follow each other by next_id.
+    the windows are found in one linear pass over the rows.
+
+    """
+    if isinstance(pars, LazyParagraphs):
+        next_rows = pars.store.index.next_rows
+        rows = pars.rows()
+        spans = windows(next_rows, rows, num_sequential, pars.bits)
+        return (tuple(
+            pars.by_row(r, cache=False)
+            for r in window_rows(next_rows, span))
+                for span in spans)
+    values = list(pars.values())
+    position = {i: r for r, i in enumerate(pars)}
+    next_rows = next_rows_of(list(pars), [par.next_id for par in values],
+                             position.get)
+    spans = windows(next_rows, range(len(values)), num_sequential)
+    return (tuple(values[r]
+                  for r in window_rows(next_rows, span))
+            for span in spans)
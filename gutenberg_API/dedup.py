@@ -0,0 +1,223 @@
+import json
+import os
+import zlib
+from array import array
+from store import TOKENS_FILE, _map_file
+
+DEDUP_DIR = "minhash"
+_MASK = (1 << 64) - 1
+_PRIME = 0x100000001b3
+_GOLDEN = 0x9e3779b97f4a7c15
+# signatures keep the high 32 bits of every 64-bit minimum
+_TYPECODE = "I"
+_EMPTY = _MASK
+
+
+def _mix(h):
+    # splitmix64 finalizer
+    h = (h ^ (h >> 30)) * 0xbf58476d1ce4e5b9 & _MASK
+    h = (h ^ (h >> 27)) * 0x94d049bb133111eb & _MASK
+    return h ^ (h >> 31)
+
+
+class MinHasher(object):
+
+    def __init__(self, num_perm=64, shingle_size=5, seed=0):
+        """
+
+        MinHash signatures of the word shingles of paragraphs. every shingle is hashed once and only
+        updates the minimum of one of num_perm bins (one permutation hashing); empty bins are filled
+        from the next non-empty bin, so the cost is linear in the number of words instead of in
+        words * num_perm. two signatures agree in a bin with probability close to the Jaccard
+        similarity of the shingle sets. words are lowercased.
+
+        Args:
+            num_perm: length of signatures
+            shingle_size: number of words of a shingle. shorter paragraphs are one shingle
+            seed: seed of the hash functions
+        """
+        if num_perm < 1 or shingle_size < 1:
+            raise ValueError("num_perm and shingle_size should be positive")
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        self._salt = _mix(seed & _MASK)
+        self._word_hashes = dict()
+
+    @property
+    def key(self):
+        return "%d_%d_%d" % (self.num_perm, self.shingle_size, self.seed)
+
+    def _hashes(self, words):
+        cache = self._word_hashes
+        if len(cache) > 1 << 20:
+            cache.clear()
+        res = []
+        for word in words:
+            h = cache.get(word)
+            if h is None:
+                h = cache[word] = _mix(zlib.crc32(word.lower().encode("utf-8")) + 1)
+            res.append(h)
+        return res
+
+    def signature(self, words):
+        """
+
+        Args:
+            words: a sequence of words
+
+        Returns:
+            an array of num_perm integers, or None if words is empty
+
+        """
+        if not words:
+            return None
+        hashes = self._hashes(words)
+        k = min(self.shingle_size, len(hashes))
+        power = pow(_PRIME, k - 1, 1 << 64)
+        num_perm, salt = self.num_perm, self._salt
+        bins = [_EMPTY] * num_perm
+        h = 0
+        for i, w in enumerate(hashes):
+            if i >= k:
+                # roll the polynomial hash of the shingle one word forward
+                h = (h - hashes[i - k] * power) & _MASK
+            h = (h * _PRIME + w) & _MASK
+            if i >= k - 1:
+                v = _mix(h ^ salt)
+                b = v % num_perm
+                if v < bins[b]:
+                    bins[b] = v
+        # densify: an empty bin takes the value of the next non-empty bin, rehashed by the distance
+        following = num_perm + next(b for b in range(num_perm) if bins[b] != _EMPTY)
+        for b in range(num_perm - 1, -1, -1):
+            if bins[b] != _EMPTY:
+                following = b
+            else:
+                source = bins[following % num_perm]
+                bins[b] = _mix(source ^ ((following - b) * _GOLDEN & _MASK))
+        return array(_TYPECODE, [v >> 32 for v in bins])
+
+    def signatures(self, paragraphs):
+        """
+
+        Args:
+            paragraphs: an iterable of word sequences
+
+        Returns:
+            a flat array of the signatures of paragraphs; empty paragraphs have an all zero signature
+
+        """
+        res = array(_TYPECODE)
+        empty = array(_TYPECODE, bytes(4 * self.num_perm))
+        for words in paragraphs:
+            res.extend(self.signature(words) or empty)
+        return res
+
+
+def store_signatures(store, hasher):
+    """
+
+    The signatures of every row of a ParagraphStore. they are computed once and saved in the store
+    directory, keyed by the tokens file; they are recomputed when the store is rewritten, not when it
+    is retagged.
+
+    Args:
+        store: a ParagraphStore
+        hasher: a MinHasher
+
+    Returns:
+        a flat memoryview; the signature of row r is [r * hasher.num_perm:(r + 1) * hasher.num_perm]
+
+    """
+    path = os.path.join(store.path, DEDUP_DIR)
+    data_path = os.path.join(path, hasher.key + ".bin")
+    header_path = os.path.join(path, hasher.key + ".json")
+    stat = os.stat(os.path.join(store.path, TOKENS_FILE))
+    stamp = [stat.st_mtime_ns, stat.st_size, len(store)]
+    if os.path.isfile(header_path):
+        with open(header_path) as f:
+            if json.load(f).get("store") == stamp:
+                return _map_file(data_path, _TYPECODE)
+    os.makedirs(path, exist_ok=True)
+    with open(data_path + ".tmp", "wb") as f:
+        block = 65536
+        for start in range(0, len(store), block):
+            end = min(start + block, len(store))
+            hasher.signatures(store.words(r) for r in range(start, end)).tofile(f)
+    os.replace(data_path + ".tmp", data_path)
+    with open(header_path, "w") as f:
+        json.dump({"store": stamp, "num_perm": hasher.num_perm,
+                   "shingle_size": hasher.shingle_size, "seed": hasher.seed}, f)
+    return _map_file(data_path, _TYPECODE)
+
+
+def lsh_bands(num_perm, threshold):
+    """
+
+    Choose the number of bands of LSH, such that pairs with a similarity of about threshold become
+    candidates with a probability of one half.
+
+    Returns:
+        number of bands, a divisor of num_perm
+
+    """
+    bands = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(bands, key=lambda b: abs((1 / b) ** (b / num_perm) - threshold))
+
+
+def duplicate_rows(signatures, rows, num_perm, threshold=0.8, bands=None):
+    """
+
+    Find near duplicate rows with LSH. every band of the signatures is bucketed in one pass, and a
+    row is compared to the first row of its bucket only, so the cost is linear in the number of rows
+    times bands. duplicates are grouped transitively and the first row of each group is kept.
+
+    Args:
+        signatures: a flat sequence of signatures, as returned by store_signatures
+        rows: the rows to deduplicate in increasing order
+        num_perm: length of signatures
+        threshold: minimum estimated Jaccard similarity of duplicates
+        bands: (Optional) number of LSH bands. if it is None it is chosen by lsh_bands
+
+    Returns:
+        a dictionary {row: the kept row it is a duplicate of}
+
+    """
+    if bands is None:
+        bands = lsh_bands(num_perm, threshold)
+    if num_perm % bands:
+        raise ValueError("bands should divide num_perm")
+    width = num_perm // bands
+    view = memoryview(signatures)
+    min_agree = threshold * num_perm
+    empty = bytes(view[0:num_perm].nbytes)
+    parent = dict()
+
+    def find(r):
+        root = r
+        while root in parent:
+            root = parent[root]
+        while r != root:
+            parent[r], r = root, parent[r]
+        return root
+
+    rows = [r for r in rows if view[r * num_perm:(r + 1) * num_perm].tobytes() != empty]
+    for band in range(bands):
+        buckets = dict()
+        offset = band * width
+        for r in rows:
+            start = r * num_perm
+            key = view[start + offset:start + offset + width].tobytes()
+            first = buckets.setdefault(key, r)
+            if first == r:
+                continue
+            a, b = find(first), find(r)
+            if a == b:
+                continue
+            x = view[first * num_perm:(first + 1) * num_perm]
+            y = view[start:start + num_perm]
+            if sum(map(int.__eq__, x, y)) >= min_agree:
+                a, b = min(a, b), max(a, b)
+                parent[b] = a
+    return {r: find(r) for r in list(parent)}
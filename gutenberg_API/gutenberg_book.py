@@ -1,21 +1,22 @@
 class GutenbergBook(object):
+    __slots__ = ("_id", "_metadata", "_bookshelves")
 
     def __init__(self, id, metadata):
         """
 
         Args:
             id: the gutenberg ID
-            metadata: metadata is a dictionary which includes ["title", "authors", "language", "bookshelves"]
+            metadata: metadata is a dictionary which includes ["title", "authors", "language", "bookshelves"].
+                      it is kept as it is and read when a property is accessed, so it should not be modified.
         """
         if not isinstance(id, int):
             raise TypeError("id must be a positive integer")
         if id <= 0:
             raise TypeError("id must be a positive integer")
         self._id = id
-        self._title = list(metadata["title"])[0]
-        self._authors = metadata["authors"]
-        self._language = list(metadata["language"])[0]
-        self._bookshelves = metadata["bookshelves"]
+        self._metadata = metadata
+        # set by add_bookshelf, otherwise the bookshelves of metadata are used
+        self._bookshelves = None
 
     def __hash__(self):
         return hash(self._id)
@@ -26,18 +27,20 @@ class GutenbergBook(object):
 
     @property
     def title(self):
-        return self._title
+        return next(iter(self._metadata["title"]))
 
     @property
     def authors(self):
-        return self._authors.copy()
+        return set(self._metadata["authors"])
 
     @property
     def language(self):
-        return self._language
+        return next(iter(self._metadata["language"]))
 
     @property
     def bookshelves(self):
+        if self._bookshelves is None:
+            return set(self._metadata["bookshelves"])
         return self._bookshelves.copy()
 
     @property
@@ -48,7 +51,7 @@ class GutenbergBook(object):
     def add_bookshelf(self, shelf):
         if not isinstance(shelf, str):
             raise TypeError("shelf should be a string")
-        self._bookshelves = self._bookshelves | {shelf}
+        self._bookshelves = self.bookshelves | {shelf}
 
 
 def create_gutenberg_books(inputs, dic=False):
@@ -0,0 +1,353 @@
+import json
+import os
+from array import array
+from bisect import bisect_left
+from chains import next_rows_of
+from collections import defaultdict
+
+INDEX_DIR = "index"
+INDEX_HEADER_FILE = "header.json"
+ARRAYS = ("book_ids", "book_offsets", "book_rows", "words_offsets",
+          "words_rows", "sentences_offsets", "sentences_rows", "next_rows")
+
+# set bit positions of every byte value, used to walk a bitmap 8 rows at a time.
+_BITS = [tuple(b for b in range(8) if v >> b & 1) for v in range(256)]
+
+
+def range_bitmap(start, end):
+    """
+
+    Returns:
+        a bitmap with rows start, ..., end - 1 set
+
+    """
+    if end <= start:
+        return 0
+    return ((1 << (end - start)) - 1) << start
+
+
+def bitmap_from_rows(rows, num_rows):
+    buf = bytearray((num_rows + 7) // 8)
+    for r in rows:
+        buf[r >> 3] |= 1 << (r & 7)
+    return int.from_bytes(buf, "little")
+
+
+def iter_rows(bitmap):
+    """
+
+    Iterate the set rows of a bitmap in increasing order.
+
+    Args:
+        bitmap: a non-negative int in which bit i stands for row i
+
+    """
+    size = (bitmap.bit_length() + 63) // 64 * 8
+    words = memoryview(bitmap.to_bytes(size, "little"))
+    if size:
+        words = words.cast("Q")
+    bits = _BITS
+    for w, word in enumerate(words):
+        if not word:
+            continue
+        base = w * 64
+        for shift in range(0, 64, 8):
+            byte = word >> shift & 0xff
+            if byte:
+                for b in bits[byte]:
+                    yield base + shift + b
+
+
+def count_rows(bitmap):
+    return bin(bitmap).count("1")
+
+
+def _group_by_count(counts):
+    """
+
+    Counting sort of rows by a small non-negative integer column.
+
+    Returns:
+        offsets, rows: rows[offsets[n]:offsets[n + 1]] are the rows with count n, in increasing order
+
+    """
+    offsets = array("q", bytes(8 * (max(counts, default=0) + 2)))
+    for n in counts:
+        offsets[n + 1] += 1
+    for n in range(1, len(offsets)):
+        offsets[n] += offsets[n - 1]
+    fill = array("q", offsets)
+    rows = array("q", bytes(8 * len(counts)))
+    for r, n in enumerate(counts):
+        rows[fill[n]] = r
+        fill[n] += 1
+    return offsets, rows
+
+
+class ParagraphIndex(object):
+
+    def __init__(self, num_rows, tag_bitmaps, arrays):
+        """
+
+        Inverted indexes over the rows of a ParagraphStore.
+
+        Args:
+            num_rows: the number of rows of the store
+            tag_bitmaps: a dictionary {tag: bitmap of the rows with that tag}
+            arrays: a dictionary of the arrays in ARRAYS.
+                    book_rows[book_offsets[i]:book_offsets[i + 1]] are the rows of book_ids[i], and
+                    words_rows[words_offsets[n]:words_offsets[n + 1]] are the rows with n words
+                    (likewise for sentences). next_rows[r] is the row after row r or -1.
+        """
+        self._num_rows = num_rows
+        self._tag_bitmaps = tag_bitmaps
+        self._arrays = arrays
+        self._book_ids = arrays["book_ids"]
+        self._book_offsets = arrays["book_offsets"]
+        self._book_rows = arrays["book_rows"]
+
+    @classmethod
+    def build(cls, store):
+        num_rows = len(store)
+        by_mask = defaultdict(list)
+        by_book = defaultdict(list)
+        tag_col, book_col = store.tags, store.book_id
+        for r in range(num_rows):
+            by_mask[tag_col[r]].append(r)
+            by_book[book_col[r]].append(r)
+        tag_rows = defaultdict(list)
+        for mask, rows in by_mask.items():
+            for tag in range(mask.bit_length()):
+                if mask >> tag & 1:
+                    tag_rows[tag].append(rows)
+        tag_bitmaps = {
+            tag: bitmap_from_rows((r for rows in groups for r in rows), num_rows)
+            for tag, groups in tag_rows.items()
+        }
+        arrays = dict()
+        arrays["book_ids"] = array("q", sorted(by_book))
+        arrays["book_offsets"] = array("q", [0])
+        arrays["book_rows"] = array("q")
+        for book in arrays["book_ids"]:
+            arrays["book_rows"].extend(by_book[book])
+            arrays["book_offsets"].append(len(arrays["book_rows"]))
+        for name in ("words", "sentences"):
+            offsets, rows = _group_by_count(getattr(store, "num_" + name))
+            arrays[name + "_offsets"] = offsets
+            arrays[name + "_rows"] = rows
+        arrays["next_rows"] = next_rows_of(store.id, store.next_id, store.row_of)
+        return cls(num_rows, tag_bitmaps, arrays)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        size = (self._num_rows + 7) // 8
+        for tag, bitmap in self._tag_bitmaps.items():
+            with open(os.path.join(path, "tag_%d.bin" % tag), "wb") as f:
+                f.write(bitmap.to_bytes(size, "little"))
+        for name in ARRAYS:
+            with open(os.path.join(path, name + ".bin"), "wb") as f:
+                self._arrays[name].tofile(f)
+        header = {
+            "num_rows": self._num_rows,
+            "tags": sorted(self._tag_bitmaps),
+            "arrays": list(ARRAYS)
+        }
+        with open(os.path.join(path, INDEX_HEADER_FILE), "w") as f:
+            json.dump(header, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, INDEX_HEADER_FILE)) as f:
+            header = json.load(f)
+        tag_bitmaps = dict()
+        for tag in header["tags"]:
+            with open(os.path.join(path, "tag_%d.bin" % tag), "rb") as f:
+                tag_bitmaps[tag] = int.from_bytes(f.read(), "little")
+        arrays = dict()
+        for name in ARRAYS:
+            arrays[name] = array("q")
+            with open(os.path.join(path, name + ".bin"), "rb") as f:
+                arrays[name].frombytes(f.read())
+        return cls(header["num_rows"], tag_bitmaps, arrays)
+
+    @classmethod
+    def open(cls, store):
+        """
+
+        Load the index of store, building and saving it first if it is missing or stale.
+
+        """
+        path = os.path.join(store.path, INDEX_DIR)
+        header_path = os.path.join(path, INDEX_HEADER_FILE)
+        if os.path.isfile(header_path):
+            with open(header_path) as f:
+                header = json.load(f)
+            if header["num_rows"] == len(store) and header.get(
+                    "arrays") == list(ARRAYS):
+                return cls.load(path)
+        index = cls.build(store)
+        index.save(path)
+        return index
+
+    @property
+    def num_rows(self):
+        return self._num_rows
+
+    @property
+    def book_ids(self):
+        return self._book_ids
+
+    @property
+    def next_rows(self):
+        return self._arrays["next_rows"]
+
+    def all_rows(self):
+        return range_bitmap(0, self._num_rows)
+
+    def tag_bitmap(self, tag):
+        return self._tag_bitmaps.get(tag, 0)
+
+    def book_rows(self, book_id):
+        i = bisect_left(self._book_ids, book_id)
+        if i == len(self._book_ids) or self._book_ids[i] != book_id:
+            return self._book_rows[0:0]
+        return self._book_rows[self._book_offsets[i]:self._book_offsets[i + 1]]
+
+    def book_bitmap(self, book_id):
+        rows = self.book_rows(book_id)
+        if not rows:
+            return 0
+        # paragraphs of a book usually have consecutive ids, so their rows are a range
+        if rows[-1] - rows[0] + 1 == len(rows):
+            return range_bitmap(rows[0], rows[-1] + 1)
+        return bitmap_from_rows(rows, self._num_rows)
+
+    def count_bitmap(self, name, low=None, high=None):
+        """
+
+        Args:
+            name: "words" or "sentences"
+            low, high: (Optional) inclusive bounds on the count
+
+        Returns:
+            bitmap of the rows with low <= number of words (sentences) <= high
+
+        """
+        offsets = self._arrays[name + "_offsets"]
+        rows = self._arrays[name + "_rows"]
+        start = offsets[min(max(low or 0, 0), len(offsets) - 1)]
+        end = offsets[-1] if high is None else offsets[min(max(high + 1, 0),
+                                                          len(offsets) - 1)]
+        if start == 0 and end == len(rows):
+            return self.all_rows()
+        return bitmap_from_rows(rows[start:end], self._num_rows)
+
+    def select(self,
+               books=None,
+               tags=None,
+               max_len=None,
+               min_len=None,
+               max_sent=None,
+               min_sent=None):
+        """
+
+        Args:
+            books: (Optional) a set of book ids
+            tags: (Optional) a list of sets of tags. a row is selected if it has at least one tag of every set
+            max_len, min_len: (Optional) bounds on the number of words in a paragraph
+            max_sent, min_sent: (Optional) bounds on the number of sentences in a paragraph
+
+        Returns:
+            bitmap of the selected rows
+
+        """
+        selected = self.all_rows()
+        if max_len is not None or min_len is not None:
+            selected &= self.count_bitmap("words", min_len, max_len)
+        if max_sent is not None or min_sent is not None:
+            selected &= self.count_bitmap("sentences", min_sent, max_sent)
+        if books is not None:
+            bitmap = 0
+            for book in books:
+                bitmap |= self.book_bitmap(book)
+            selected &= bitmap
+        if tags is not None:
+            for group in tags:
+                bitmap = 0
+                for tag in group:
+                    bitmap |= self.tag_bitmap(tag)
+                selected &= bitmap
+        return selected
+
+
+class BookIndex(object):
+    FEATURES = ("authors", "language", "bookshelves")
+
+    def __init__(self, features, stamp=None):
+        """
+
+        Inverted indexes from book metadata values to book ids.
+
+        Args:
+            features: a dictionary {feature: {value: sorted list of book ids}} for feature in FEATURES
+            stamp: (Optional) a description of the metadata file the index was built from
+        """
+        self._features = features
+        self._sets = dict()
+        self.stamp = stamp
+
+    @classmethod
+    def build(cls, books_metadata, stamp=None):
+        features = {feature: defaultdict(list) for feature in cls.FEATURES}
+        for id in sorted(books_metadata):
+            metadata = books_metadata[id]
+            for feature in cls.FEATURES:
+                for value in metadata.get(feature, ()):
+                    features[feature][value].append(id)
+        return cls({feature: dict(values) for feature, values in features.items()},
+                   stamp)
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"stamp": self.stamp, "features": self._features}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["features"], data["stamp"])
+
+    def books(self, feature, value):
+        """
+
+        Returns:
+            the set of ids of books which have value in their feature
+
+        """
+        key = (feature, value)
+        if key not in self._sets:
+            self._sets[key] = frozenset(self._features[feature].get(value, ()))
+        return self._sets[key]
+
+    def select(self, books_features):
+        """
+
+        Args:
+            books_features: a dictionary {feature: set of values}. features should be in FEATURES
+
+        Returns:
+            the set of ids of books which have all values of every feature, or None if there is no value
+            to select by
+
+        """
+        res = None
+        # intersect the smallest sets first
+        sets = sorted((self.books(feature, value)
+                       for feature, values in books_features.items()
+                       for value in values),
+                      key=len)
+        for books in sets:
+            res = set(books) if res is None else res & books
+            if not res:
+                break
+        return res
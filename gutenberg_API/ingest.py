@@ -0,0 +1,286 @@
+"""
+desc: builds the corpus files from local Project Gutenberg plain-text dumps. books are read, split into
+      paragraphs and sentences, tokenized and tagged in a process pool, and streamed to the paragraph store
+      in increasing book id order, so memory does not grow with the corpus.
+
+usage: python gutenberg_API/ingest.py DUMP_DIR [--data-dir data] [--workers 8] [--pickles]
+"""
+import HP
+import argparse
+import instrument
+import os
+import pickle
+import re
+import sys
+from functools import partial
+from multiprocessing import Pool
+from gutenberg_book import book_metadata
+from index import ParagraphIndex
+from store import ParagraphStore, StoreWriter
+from tagging import QUOTE, TagRules, count_quoted
+
+TERMINATORS = {".", "!", "?"}
+CLOSING = {QUOTE, "'", ")", "]"}
+# a period after these words does not end a sentence
+ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "st", "prof", "rev", "capt", "col", "gen", "lt", "sr", "jr",
+                 "vs", "etc", "no", "vol", "ch", "mt"}
+LANGUAGES = {"english": "en", "french": "fr", "german": "de", "spanish": "es", "finnish": "fi",
+             "italian": "it", "dutch": "nl", "portuguese": "pt", "latin": "la", "swedish": "sv",
+             "danish": "da", "chinese": "zh", "hungarian": "hu", "esperanto": "eo", "greek": "el",
+             "norwegian": "no", "tagalog": "tl", "polish": "pl", "russian": "ru", "japanese": "ja"}
+
+_START = re.compile(r"^\*\*\*\s*START OF (THE|THIS) PROJECT GUTENBERG.*$", re.M | re.I)
+_END = re.compile(r"^\*\*\*\s*END OF (THE|THIS) PROJECT GUTENBERG.*$", re.M | re.I)
+_FIELD = re.compile(r"^(Title|Author|Language):\s*(.+)$", re.M)
+_BLANK = re.compile(r"\n\s*\n")
+_WORD = re.compile(r"[^\W_]+(?:['\-][^\W_]+)*|[^\w\s]")
+_QUOTES = str.maketrans({"“": QUOTE, "”": QUOTE, "‘": "'", "’": "'", "_": " "})
+_FILE_NAME = re.compile(r"^(?:pg)?(\d+)(-\d)?\.txt$")
+# preferred files of a book: utf-8, ascii, then latin-1 editions
+_ENCODING_RANK = {"-0": 0, None: 1, "-8": 2}
+
+
+def split_text(text):
+    """
+
+    Split the text of a Gutenberg file into the header and the body, without the license.
+
+    Returns:
+        (header, body)
+
+    """
+    start, end = _START.search(text), _END.search(text)
+    if start is None:
+        return "", text
+    body_end = end.start() if end is not None and end.start() > start.end() else len(text)
+    return text[:start.start()], text[start.end():body_end]
+
+
+def parse_header(header, id):
+    """
+
+    Returns:
+        the metadata of a book from the Title, Author and Language lines of its header, as in
+        gutenberg_book.book_metadata
+
+    """
+    fields = {name: value.strip() for name, value in _FIELD.findall(header)}
+    authors = [a.strip() for a in re.split(r"\s+and\s+|;", fields.get("Author", "")) if a.strip()]
+    language = fields.get("Language", "unknown").split(",")[0].strip()
+    return book_metadata(title=fields.get("Title", str(id)),
+                         authors=authors or ["Unknown"],
+                         language=LANGUAGES.get(language.lower(), language.lower()),
+                         bookshelves=())
+
+
+def tokenize(text):
+    """
+
+    Returns:
+        the words of text. punctuation marks are words, and curly quotes are normalized
+
+    """
+    return _WORD.findall(text.translate(_QUOTES))
+
+
+def _closes(word, current):
+    if word in (QUOTE, "'"):
+        # a quote closes the sentence if it closes a quote opened in it
+        return current.count(word) % 2 == 1
+    return word in CLOSING
+
+
+def split_sentences(words):
+    """
+
+    Returns:
+        a list of sentences, each a list of words. a sentence ends at a terminator and the quotes and
+        brackets which close it
+
+    """
+    sentences, current, ended = [], [], False
+    for i, word in enumerate(words):
+        if ended and word not in TERMINATORS and not _closes(word, current):
+            sentences.append(current)
+            current, ended = [], False
+        current.append(word)
+        if word in TERMINATORS:
+            previous = words[i - 1] if i else ""
+            # abbreviations and initials
+            ended = not (word == "." and (previous.lower() in ABBREVIATIONS or
+                                          (len(previous) == 1 and previous.isupper())))
+    if current:
+        sentences.append(current)
+    return sentences
+
+
+def paragraph_tags(block, sentences, rules=None):
+    """
+
+    Args:
+        block: the raw text of the paragraph
+        sentences: its sentences
+        rules: (Optional) the tagging.TagRules of length and dialogue tags
+
+    Returns:
+        the set of HP.Tags of the paragraph
+
+    """
+    rules = rules or TagRules()
+    num_words = sum(len(sent) for sent in sentences)
+    tags = rules.tags(num_words, len(sentences), count_quoted(sentences))
+    last = sentences[-1] if sentences else []
+    ending = [w for w in last if w not in CLOSING][-1:]
+    if ending and ending[0] in TERMINATORS and any(c.islower() for c in block):
+        tags.add(HP.Tags.PARAGRAPH)
+    else:
+        # headings, tables of contents, verse lines and other blocks which are not prose
+        tags.add(HP.Tags.NOT_PARAGRAPH)
+    return tags
+
+
+def read_book(path, rules=None):
+    """
+
+    Read, split and tag a book. it runs in the worker processes of ingest.
+
+    Args:
+        path: path of a Gutenberg plain-text file named by its book id, e.g. 1342-0.txt
+        rules: (Optional) the tagging.TagRules of length and dialogue tags
+
+    Returns:
+        (book id, metadata, list of (sentences, tags) of its paragraphs in order)
+
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = data.decode("latin-1")
+    text = text.replace("\r\n", "\n")
+    id = int(_FILE_NAME.match(os.path.basename(path)).group(1))
+    header, body = split_text(text)
+    paragraphs = []
+    for block in _BLANK.split(body):
+        block = " ".join(block.split())
+        words = tokenize(block)
+        if not words:
+            continue
+        sentences = split_sentences(words)
+        paragraphs.append((sentences, paragraph_tags(block, sentences, rules)))
+    return id, parse_header(header, id), paragraphs
+
+
+def find_books(dump_dir):
+    """
+
+    Find the text files of books under dump_dir, e.g. a mirror of the Gutenberg archive. when a book has
+    several files (1342.txt, 1342-0.txt, 1342-8.txt) the utf-8 one is preferred.
+
+    Returns:
+        a list of paths in increasing book id order
+
+    """
+    books = dict()
+    for root, _, files in os.walk(dump_dir):
+        for name in files:
+            match = _FILE_NAME.match(name)
+            if match is None:
+                continue
+            id, rank = int(match.group(1)), _ENCODING_RANK.get(match.group(2), 3)
+            if id not in books or rank < books[id][0]:
+                books[id] = (rank, os.path.join(root, name))
+    return [books[id][1] for id in sorted(books)]
+
+
+def ingest(dump_dir,
+           store_path=HP.PARAGRAPH_STORE_PATH,
+           books_path=HP.BOOKS_DATA_PATH,
+           bookshelves_path=HP.BOOK_SHELVES_PATH,
+           num_workers=None,
+           pickles=False,
+           paragraph_metadata_path=HP.PARAGRAPH_METADATA_PATH,
+           paragraph_data_path=HP.PARAGRAPH_DATA_PATH,
+           rules=None):
+    """
+
+    Build the paragraph store and the books metadata from the plain-text books under dump_dir. paragraph
+    ids are consecutive in increasing book id order, and the paragraphs of a book are one prev_id/next_id
+    chain; blocks tagged NOT_PARAGRAPH are kept in the chain, so filtering by tags breaks windows at
+    headings.
+
+    Args:
+        dump_dir: directory of the text files
+        store_path: directory of the paragraph store
+        books_path, bookshelves_path: paths of the books metadata and bookshelves pickles
+        num_workers: (Optional) number of worker processes. if it is None os.cpu_count() is used
+        pickles: if it is True the paragraph pickles are written too. they are built in memory
+        paragraph_metadata_path, paragraph_data_path: paths of the paragraph pickles
+        rules: (Optional) the tagging.TagRules of length and dialogue tags. they can be changed later with
+               tagging.retag
+
+    Returns:
+        a dictionary with the numbers of books and paragraphs
+
+    """
+    paths = find_books(dump_dir)
+    books, shelves = dict(), dict()
+    metadata, text = dict(), dict()
+    id = 0
+    with instrument.current().stage("ingest_books", len(paths)) as stage, \
+            StoreWriter(store_path) as writer, Pool(num_workers) as pool:
+        for book_id, book, paragraphs in pool.imap(partial(read_book, rules=rules), paths, chunksize=4):
+            books[book_id] = book
+            for shelf in book["bookshelves"]:
+                shelves.setdefault(shelf, set()).add(book_id)
+            first = id + 1
+            for i, (sentences, tags) in enumerate(paragraphs):
+                id += 1
+                prev_id = id - 1 if id > first else None
+                next_id = id + 1 if i + 1 < len(paragraphs) else None
+                writer.add(id, sentences, book_id=book_id, prev_id=prev_id, next_id=next_id, tags=tags)
+                if pickles:
+                    metadata[id] = {"id": id, "book_id": book_id, "tags": tags}
+                    if prev_id is not None:
+                        metadata[id]["prev_id"] = prev_id
+                    if next_id is not None:
+                        metadata[id]["next_id"] = next_id
+                    text[id] = sentences
+            stage.count()
+    ParagraphIndex.open(ParagraphStore(store_path))
+    for path, value in ((books_path, books), (bookshelves_path, shelves)):
+        with open(path, "wb") as f:
+            pickle.dump(value, f)
+    if pickles:
+        with open(paragraph_metadata_path, "wb") as f:
+            pickle.dump(metadata, f)
+        with open(paragraph_data_path, "wb") as f:
+            pickle.dump(text, f)
+    return {"books": len(books), "paragraphs": id}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="build the corpus from Gutenberg plain-text files")
+    parser.add_argument("dump_dir")
+    parser.add_argument("--data-dir", default=os.path.dirname(HP.PARAGRAPH_STORE_PATH),
+                        help="directory of the corpus files")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--pickles", action="store_true",
+                        help="also write paragraph_metadata.pkl and paragraph_data.pkl")
+    args = parser.parse_args()
+    os.makedirs(args.data_dir, exist_ok=True)
+    paths = {
+        name: os.path.join(args.data_dir, os.path.basename(getattr(HP, name)))
+        for name in ("PARAGRAPH_STORE_PATH", "BOOKS_DATA_PATH", "BOOK_SHELVES_PATH",
+                     "PARAGRAPH_METADATA_PATH", "PARAGRAPH_DATA_PATH")
+    }
+    res = ingest(args.dump_dir,
+                 store_path=paths["PARAGRAPH_STORE_PATH"],
+                 books_path=paths["BOOKS_DATA_PATH"],
+                 bookshelves_path=paths["BOOK_SHELVES_PATH"],
+                 num_workers=args.workers,
+                 pickles=args.pickles,
+                 paragraph_metadata_path=paths["PARAGRAPH_METADATA_PATH"],
+                 paragraph_data_path=paths["PARAGRAPH_DATA_PATH"])
+    print("%d paragraphs of %d books" % (res["paragraphs"], res["books"]), file=sys.stderr)
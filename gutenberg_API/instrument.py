@@ -0,0 +1,271 @@
+import cProfile
+import json
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+PROFILE_MODES = ("cprofile", "tracemalloc")
+
+
+def peak_rss() -> int:
+    """
+
+    Returns:
+        the peak resident set size of the process in bytes
+
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class Stage(object):
+
+    def __init__(self, instrumentation, name, items_in=None):
+        """
+
+        A running stage. the code of the stage counts its output with count(), or sets items_out.
+
+        Args:
+            instrumentation: the Instrumentation which reports the stage
+            name: name of the stage
+            items_in: (Optional) number of input items
+        """
+        self.name = name
+        self.items_in = items_in
+        self.items_out = 0
+        self.seconds = 0.0
+        self.started = time.perf_counter()
+        # the peak of traced memory before the last nested stage started, in tracemalloc mode
+        self.peak_traced_bytes = 0
+        self._instrumentation = instrumentation
+
+    def count(self, n=1):
+        self.items_out += n
+        self._instrumentation.progress(self)
+
+
+class Instrumentation(object):
+
+    def __init__(self, sinks=(), progress=False, progress_interval=10.0,
+                 profile=None, profile_path=None):
+        """
+
+        Measures the stages of a dataset build and sends a metrics record for each of them to sinks.
+        a record is a dictionary with keys stage, seconds, peak_rss_bytes, items_in, items_out and
+        rows_per_second, plus peak_traced_bytes in tracemalloc mode.
+
+        Args:
+            sinks: callables which receive the record of every finished stage, e.g. a JsonLinesSink
+            progress: if it is True running stages print their progress to stderr
+            progress_interval: minimum number of seconds between two progress lines of a stage
+            profile: (Optional) "cprofile" to profile the whole run, or "tracemalloc" to trace the peak
+                     memory of each stage
+            profile_path: (Optional) file of the cProfile stats. if it is None the top functions are
+                          printed to stderr
+        """
+        if profile is not None and profile not in PROFILE_MODES:
+            raise ValueError("profile should be one of %s" % list(PROFILE_MODES))
+        self.sinks = list(sinks)
+        self._progress = progress
+        self._progress_interval = progress_interval
+        self._profile = profile
+        self._profile_path = profile_path
+        self._profiler = None
+        self._last_progress = dict()
+        # running stages, outermost first
+        self._stages = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sinks or self._progress or self._profile)
+
+    def start(self):
+        if self._profile == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self._profile == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def close(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+            if self._profile_path is not None:
+                self._profiler.dump_stats(self._profile_path)
+            else:
+                pstats.Stats(self._profiler, stream=sys.stderr).sort_stats(
+                    "cumulative").print_stats(30)
+            self._profiler = None
+        elif self._profile == "tracemalloc" and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def stage(self, name, items_in=None):
+        """
+
+        Measure the code in a with block as a stage.
+
+        Args:
+            name: name of the stage
+            items_in: (Optional) number of input items
+
+        Returns:
+            a context manager which yields the Stage
+
+        """
+        stage = Stage(self, name, items_in)
+        if not self.enabled:
+            yield stage
+            return
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            # resetting the peak for this stage would lose the peak of the enclosing one so far
+            if self._stages:
+                parent = self._stages[-1]
+                parent.peak_traced_bytes = max(parent.peak_traced_bytes,
+                                               tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._stages.append(stage)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds = time.perf_counter() - start
+            i = self._stages.index(stage)
+            del self._stages[i]
+            peak = None
+            if tracing:
+                peak = max(stage.peak_traced_bytes, tracemalloc.get_traced_memory()[1])
+                if i > 0:
+                    parent = self._stages[i - 1]
+                    parent.peak_traced_bytes = max(parent.peak_traced_bytes, peak)
+            self.emit(stage, peak)
+
+    def track(self, name, items, items_in=None):
+        """
+
+        Count the items of an iterator as the output of a stage. only the time spent in producing the
+        items is measured, not the time the consumer spends on them. the stage is reported when the
+        iterator is exhausted or closed.
+
+        Args:
+            name: name of the stage
+            items: an iterable
+            items_in: (Optional) number of input items
+
+        Returns:
+            an iterator of items
+
+        """
+        if not self.enabled:
+            return iter(items)
+        return self._track(Stage(self, name, items_in), iter(items))
+
+    def _track(self, stage, items):
+        clock = time.perf_counter
+        try:
+            while True:
+                start = clock()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    stage.seconds += clock() - start
+                    break
+                stage.seconds += clock() - start
+                stage.count()
+                yield item
+        finally:
+            self.emit(stage)
+
+    def progress(self, stage):
+        if not self._progress:
+            return
+        now = time.perf_counter()
+        last = self._last_progress.setdefault(stage, stage.started)
+        if now - last >= self._progress_interval:
+            self._last_progress[stage] = now
+            print("[%s] %d items, %.0f/s" % (stage.name, stage.items_out,
+                                             stage.items_out / (now - stage.started)),
+                  file=sys.stderr)
+
+    def emit(self, stage, peak_traced_bytes=None):
+        self._last_progress.pop(stage, None)
+        record = {
+            "stage": stage.name,
+            "seconds": stage.seconds,
+            "peak_rss_bytes": peak_rss(),
+            "items_in": stage.items_in,
+            "items_out": stage.items_out,
+            "rows_per_second": stage.items_out / stage.seconds if stage.seconds else None,
+        }
+        if peak_traced_bytes is not None:
+            record["peak_traced_bytes"] = peak_traced_bytes
+        if self._progress:
+            print("[%s] done: %d items in %.2fs" % (stage.name, stage.items_out, stage.seconds),
+                  file=sys.stderr)
+        for sink in self.sinks:
+            sink(record)
+
+
+class JsonLinesSink(object):
+
+    def __init__(self, path):
+        """
+
+        A metrics sink which appends every record to a file as a JSON line.
+
+        """
+        self.path = path
+
+    def __call__(self, record):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+class ListSink(list):
+    """
+
+    A metrics sink which keeps the records in memory.
+
+    """
+
+    def __call__(self, record):
+        self.append(record)
+
+
+_current = Instrumentation()
+
+
+def current() -> Instrumentation:
+    """
+
+    Returns:
+        the process-wide Instrumentation. by default it has no sinks and measures nothing
+
+    """
+    return _current
+
+
+@contextmanager
+def use(instrumentation):
+    """
+
+    Make instrumentation the process-wide one in a with block, and start and close it.
+
+    """
+    global _current
+    previous, _current = _current, instrumentation
+    try:
+        with instrumentation:
+            yield instrumentation
+    finally:
+        _current = previous
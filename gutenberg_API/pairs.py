@@ -0,0 +1,177 @@
+import random
+from array import array
+from paragraph import LazyParagraphs
+from index import bitmap_from_rows
+from chains import next_rows_of, run_lengths, window_rows, windows
+
+
+class PairSampler(object):
+
+    def __init__(self, pars, seed=None):
+        """
+
+        Samples pairs and windows of the rows of a collection of paragraphs. rows, chains and books are
+        kept in arrays, so candidates are found with passes over those arrays and Paragraph objects are
+        only built for the sampled rows.
+
+        Args:
+            pars: the paragraphs to sample from; a LazyParagraphs, or a dictionary {id: Paragraph}
+            seed: (Optional) seed of sampling
+        """
+        self._pars = pars
+        self._rng = random.Random(seed)
+        if isinstance(pars, LazyParagraphs):
+            store = pars.store
+            self._rows = array("q", pars.rows())
+            self._next_rows = store.index.next_rows
+            self._selected = pars.bits
+            self._books = store.book_id
+            self._values = None
+        else:
+            self._values = list(pars.values())
+            position = {i: r for r, i in enumerate(pars)}
+            self._rows = array("q", range(len(self._values)))
+            self._next_rows = next_rows_of(list(pars), [par.next_id for par in self._values],
+                                           position.get)
+            self._selected = None
+            self._books = array("q", [par.book_id or 0 for par in self._values])
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def rows(self):
+        return self._rows
+
+    def paragraph(self, row):
+        """
+
+        Returns:
+            the Paragraph of row. stored paragraphs are not cached
+
+        """
+        if self._values is None:
+            return self._pars.by_row(row, cache=False)
+        return self._values[row]
+
+    def book_of(self, row):
+        return self._books[row]
+
+    def num_books(self):
+        return len({self._books[r] for r in self._rows})
+
+    def split(self, is_validation, split_by="book"):
+        """
+
+        Partition the rows into train and validation. with split_by="paragraph" chains are cut where
+        they cross the two splits.
+
+        Args:
+            is_validation: a function from a key to True if the key is in the validation split, e.g.
+                           utils.split_of with fixed validation_split and seed
+            split_by: "book" or "paragraph"; keys are book ids or paragraph ids
+
+        Returns:
+            (train PairSampler, validation PairSampler). they are seeded from this sampler
+
+        """
+        if split_by not in ("book", "paragraph"):
+            raise ValueError('split_by should be one of ["book", "paragraph"]')
+        parts = ([], [])
+        splits = dict()
+        for r in self._rows:
+            if split_by == "book":
+                key = self._books[r]
+                if key not in splits:
+                    splits[key] = bool(is_validation(key))
+                split = splits[key]
+            else:
+                split = bool(is_validation(self.paragraph(r).id))
+            parts[split].append(r)
+        return tuple(self._subset(rows) for rows in parts)
+
+    def _subset(self, rows):
+        seed = self._rng.getrandbits(64)
+        if self._values is None:
+            store = self._pars.store
+            return PairSampler(LazyParagraphs(store, bitmap_from_rows(rows, len(store))), seed)
+        return PairSampler({self._values[r].id: self._values[r] for r in rows}, seed)
+
+    def distance_pairs(self, distance=1, max_pairs=None):
+        """
+
+        Find the pairs of rows at distance steps from each other along the next_id chains, such that
+        every row between them is in the collection too.
+
+        Args:
+            distance: a positive integer. 1 means consecutive paragraphs
+            max_pairs: (Optional) if there are more pairs, a uniform sample of max_pairs of them is returned
+
+        Returns:
+            a list of (first row, second row) in increasing order of the first row
+
+        """
+        if distance < 1:
+            raise ValueError("distance should be positive")
+        run = run_lengths(self._next_rows, self._rows, self._selected)
+        starts = [r for r in self._rows if run[r] > distance]
+        if max_pairs is not None and len(starts) > max_pairs:
+            starts = sorted(self._rng.sample(starts, max_pairs))
+        ends = starts
+        next_rows = self._next_rows
+        for _ in range(distance):
+            ends = [next_rows[r] for r in ends]
+        return list(zip(starts, ends))
+
+    def cross_book_pairs(self, num_pairs):
+        """
+
+        Sample pairs of rows of different books uniformly. rows of the same book are redrawn in rounds,
+        so the cost is linear in num_pairs unless almost all rows are in one book.
+
+        Args:
+            num_pairs: number of pairs
+
+        Returns:
+            a list of (first row, second row)
+
+        """
+        rows, books, rng = self._rows, self._books, self._rng
+        if num_pairs <= 0:
+            return []
+        if self.num_books() < 2:
+            raise ValueError("cross book pairs need paragraphs of at least two books")
+        firsts = rng.choices(rows, k=num_pairs)
+        seconds = rng.choices(rows, k=num_pairs)
+        same = [i for i in range(num_pairs) if books[firsts[i]] == books[seconds[i]]]
+        while same:
+            for i, r in zip(same, rng.choices(rows, k=len(same))):
+                seconds[i] = r
+            same = [i for i in same if books[firsts[i]] == books[seconds[i]]]
+        return list(zip(firsts, seconds))
+
+    def permutation_windows(self, k, num_permutations=1, max_windows=None):
+        """
+
+        Sample permutations of windows of k sequential paragraphs.
+
+        Args:
+            k: length of windows, at least 2
+            num_permutations: number of random orders of each window
+            max_windows: (Optional) if there are more windows, a uniform sample of max_windows is used
+
+        Returns:
+            a list of (rows of the window in their order, order) in which order is a permutation of
+            range(k); the i-th paragraph of the example is rows[order[i]]
+
+        """
+        if k < 2:
+            raise ValueError("k should be at least 2")
+        spans = windows(self._next_rows, self._rows, k, self._selected)
+        if max_windows is not None and len(spans) > max_windows:
+            spans = sorted(self._rng.sample(spans, max_windows))
+        sample = self._rng.sample
+        order = range(k)
+        return [(tuple(window_rows(self._next_rows, span)), tuple(sample(order, k)))
+                for span in spans
+                for _ in range(num_permutations)]
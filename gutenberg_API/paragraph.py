@@ -1,7 +1,12 @@
 from collections import defaultdict
+from collections.abc import Mapping
+from itertools import chain
+from index import iter_rows
 
 
 class Paragraph(object):
+    __slots__ = ("_id", "_text", "_book_id", "_tags", "_next_id", "_prev_id",
+                 "_views")
 
     def __init__(self,
                  text,
@@ -9,30 +14,26 @@ class Paragraph(object):
                  book_id=None,
                  next_id=None,
                  prev_id=None,
-                 tags=set()):
-        if id is not None:
-            assert isinstance(id, int)
-            assert id > 0
-        if book_id is not None:
-            assert isinstance(book_id, int)
-            assert book_id > 0
-        if next_id is not None:
-            assert isinstance(next_id, int)
-            assert next_id > 0
-        if prev_id is not None:
-            assert isinstance(prev_id, int)
-            assert prev_id > 0
-        assert isinstance(tags, set)
-        assert isinstance(text, list)
-        assert all([isinstance(sent, list) for sent in text])
-        assert all(
-            [all([isinstance(word, str) for word in sent]) for sent in text])
+                 tags=set(),
+                 validate=True):
+        """
+
+        Args:
+            text: a list of sentences, each sentence is a list of words
+            id, book_id, next_id, prev_id: (Optional) positive integers
+            tags: a set of integers (HP.Tags)
+            validate: if it is False the types of the arguments are not checked. checking text is
+                      linear in the number of words.
+        """
+        if validate:
+            _validate(text, id, book_id, next_id, prev_id, tags)
         self._id = id
         self._text = text
         self._book_id = book_id
         self._tags = tags
         self._next_id = next_id
         self._prev_id = prev_id
+        self._views = None
 
     @property
     def id(self):
@@ -77,50 +78,209 @@ class Paragraph(object):
             new_tags = {new_tags}
         self._tags = self._tags | set(new_tags)
 
+    @property
+    def num_words(self):
+        return sum(len(sent) for sent in self._text)
+
+    @property
+    def num_sentences(self):
+        return len(self._text)
+
     @property
     def metadata(self):
         return paragraph_metadata(self.id, self.book_id, self.prev_id,
                                   self.next_id, self.tags)
 
+    def _sentences(self):
+        return tuple(tuple(sent) for sent in self._text)
+
+    def _words(self):
+        return tuple(chain.from_iterable(self._text))
+
     def text(self, format="sentences", lowercase=False):
         """
 
-        Return the text of Paragraphs
+        Return the text of Paragraphs. outputs are read-only tuples which are built on the first call
+        and shared by the next calls with the same arguments. outputs of a StoredParagraph are decoded on
+        every call instead, so they are not kept as long as the paragraph is cached.
 
         Args:
-            format: if it is "sentences" then the output will be a list of lists each list contain the tokens of a sentence.
-                    if it is "words" then the output will be the list of tokens.
+            format: if it is "sentences" then the output will be a tuple of tuples each tuple contain the tokens of a sentence.
+                    if it is "words" then the output will be the tuple of tokens.
                     if it is "text" then the output will be a string; the text of paragraph
             lowercase: a boolean. if it is true then the output will be lowercase
 
         Returns:
-            depend on format, a list of strings, a list of lists of strings or a string
+            depend on format, a tuple of strings, a tuple of tuples of strings or a string
 
         """
+        key = (format, lowercase)
+        views = self._views
+        if views is not None and key in views:
+            return views[key]
+        value = self._view(format, lowercase)
+        if self._views is None:
+            self._views = dict()
+        self._views[key] = value
+        return value
+
+    def _view(self, format, lowercase):
         if format == "sentences":
             if lowercase:
-                return [[word.lower() for word in sent] for sent in self._text]
-            else:
-                return [[word for word in sent] for sent in self._text]
-        elif format == "words":
-            words = sum([sent for sent in self._text], [])
+                return tuple(tuple(word.lower() for word in sent)
+                             for sent in self.text("sentences"))
+            return self._sentences()
+        if format == "words":
             if lowercase:
-                return [word.lower() for word in words]
-            else:
-                return words
-        elif format == "text":
-            words = sum([sent for sent in self._text], [])
-            text = " ".join(words)
+                return tuple(word.lower() for word in self.text("words"))
+            return self._words()
+        if format == "text":
             if lowercase:
-                return text.lowercase()
-            else:
-                return text
-        else:
-            raise ValueError(
-                'format should be one of ["sentences", "words", "text"]')
+                return self.text("text").lower()
+            return " ".join(self.text("words"))
+        raise ValueError(
+            'format should be one of ["sentences", "words", "text"]')
+
+
+class StoredParagraph(Paragraph):
+    """
+
+    A Paragraph backed by a row of a ParagraphStore. the text stays in the shared token buffer
+    of the store and is only decoded when it is asked for.
+
+    """
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+        self._id = store.id[row]
+        self._book_id = store.book_id[row] or None
+        self._next_id = store.next_id[row] or None
+        self._prev_id = store.prev_id[row] or None
+        self._tags = store.tag_set(row)
+        self._text = None
+        self._views = None
+
+    @property
+    def row(self):
+        return self._row
+
+    @property
+    def num_words(self):
+        return self._store.num_words[self._row]
+
+    @property
+    def num_sentences(self):
+        return self._store.num_sentences[self._row]
+
+    def text(self, format="sentences", lowercase=False):
+        # the tokens buffer of the store already holds the text; keeping decoded views would copy it for
+        # every paragraph in the result cache of Corpus
+        return self._view(format, lowercase)
+
+    def _sentences(self):
+        return self._store.sentences(self._row, self._words())
 
+    def _words(self):
+        return self._store.words(self._row)
 
-def create_paragraphs(paragraph_metadata, paragraph_text):
+
+class LazyParagraphs(Mapping):
+
+    def __init__(self, store, selected):
+        """
+
+        A read-only dictionary {id: Paragraph} over the selected rows of a ParagraphStore.
+        paragraphs are created on first access, so rows which are never read cost nothing.
+
+        Args:
+            store: a ParagraphStore
+            selected: bitmap of the rows in the collection
+        """
+        self._store = store
+        self._selected = selected
+        self._bits = selected.to_bytes((len(store) + 7) // 8, "little")
+        self._len = None
+        self._cache = dict()
+
+    @property
+    def selected(self):
+        return self._selected
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def bits(self):
+        """
+
+        The selected rows as a bytes bitset, for O(1) membership tests.
+
+        """
+        return self._bits
+
+    def rows(self):
+        """
+
+        Returns:
+            the selected rows of the store in increasing order
+
+        """
+        return list(iter_rows(self._selected))
+
+    def is_selected(self, row):
+        return self._bits[row >> 3] >> (row & 7) & 1 == 1
+
+    def by_row(self, row, cache=True):
+        """
+
+        Args:
+            row: a selected row of the store
+            cache: if it is False a new paragraph is returned and not kept by the collection
+
+        """
+        id = self._store.id[row]
+        par = self._cache.get(id)
+        if par is None:
+            par = StoredParagraph(self._store, row)
+            if cache:
+                self._cache[id] = par
+        return par
+
+    def _row(self, id):
+        if not isinstance(id, int):
+            return None
+        row = self._store.row_of(id)
+        if row is None or not self.is_selected(row):
+            return None
+        return row
+
+    def __contains__(self, id):
+        return self._row(id) is not None
+
+    def __getitem__(self, id):
+        par = self._cache.get(id)
+        if par is None:
+            row = self._row(id)
+            if row is None:
+                raise KeyError(id)
+            par = self.by_row(row)
+        return par
+
+    def __iter__(self):
+        id_col = self._store.id
+        for row in iter_rows(self._selected):
+            yield id_col[row]
+
+    def __len__(self):
+        if self._len is None:
+            self._len = bin(self._selected).count("1")
+        return self._len
+
+
+def create_paragraphs(paragraph_metadata, paragraph_text, validate=True):
     assert set(paragraph_metadata) == set(paragraph_text)
     pars = []
     for i, met in paragraph_metadata.items():
@@ -134,11 +294,32 @@ def create_paragraphs(paragraph_metadata, paragraph_text):
                         book_id=mt["book_id"],
                         next_id=mt["next_id"],
                         prev_id=mt["prev_id"],
-                        tags=tags)
+                        tags=tags,
+                        validate=validate)
         pars.append((i, par))
     return dict(pars)
 
 
+def _validate(text, id, book_id, next_id, prev_id, tags):
+    if id is not None:
+        assert isinstance(id, int)
+        assert id > 0
+    if book_id is not None:
+        assert isinstance(book_id, int)
+        assert book_id > 0
+    if next_id is not None:
+        assert isinstance(next_id, int)
+        assert next_id > 0
+    if prev_id is not None:
+        assert isinstance(prev_id, int)
+        assert prev_id > 0
+    assert isinstance(tags, set)
+    assert isinstance(text, list)
+    assert all([isinstance(sent, list) for sent in text])
+    assert all(
+        [all([isinstance(word, str) for word in sent]) for sent in text])
+
+
 def paragraph_metadata(id=None,
                        book_id=None,
                        prev_id=None,
@@ -0,0 +1,107 @@
+import random
+from index import count_rows, iter_rows
+
+
+class StratifiedSampler(object):
+
+    def __init__(self, bits, next_rows, book_of, seed=None):
+        """
+
+        Samples rows, or windows of sequential rows, with a quota for every stratum and a cap on the
+        samples of every book. rows are drawn at random positions and kept if they are in the stratum, so
+        the cost depends on the quotas and on the density of the strata, not on the number of rows; sparse
+        strata are enumerated instead.
+
+        Args:
+            bits: the rows to sample from as a bytes bitset, as LazyParagraphs.bits
+            next_rows: an array from row to the next row, -1 if there is none
+            book_of: a function from a row to its book id
+            seed: (Optional) seed of sampling
+        """
+        self._bits = bits
+        self._selected = int.from_bytes(bits, "little")
+        self._next_rows = next_rows
+        self._book_of = book_of
+        self._rng = random.Random(seed)
+
+    def _window(self, row, k):
+        """
+
+        Returns:
+            the rows of the window of k selected rows starting at row, or None if there is none
+
+        """
+        bits, next_rows = self._bits, self._next_rows
+        res = [row]
+        for _ in range(k - 1):
+            row = next_rows[row]
+            if row < 0 or not bits[row >> 3] >> (row & 7) & 1:
+                return None
+            res.append(row)
+        return tuple(res)
+
+    def sample(self, strata, quotas, num_sequential=1, max_per_book=None):
+        """
+
+        Args:
+            strata: a dictionary {name: bitmap}. a window is in a stratum if its first row is
+            quotas: a dictionary {name: number of samples}. a stratum with fewer windows gives all of them
+            num_sequential: number of rows of a window
+            max_per_book: (Optional) maximum number of windows of a book over all strata; an int for every
+                          book, or a dictionary {book id: maximum} in which other books are not capped
+
+        Returns:
+            a dictionary {name: list of windows in increasing order}; a window is a tuple of rows. a window is
+            sampled once even if it is in several strata
+
+        """
+        rng = self._rng
+        if max_per_book is None or isinstance(max_per_book, dict):
+            caps = max_per_book or dict()
+        else:
+            caps = None
+        taken = set()
+        per_book = dict()
+        res = dict()
+        for name, quota in quotas.items():
+            stratum = strata[name] & self._selected
+            chosen = []
+            if quota > 0 and stratum:
+                bits = stratum.to_bytes(len(self._bits), "little")
+
+                def accept(row):
+                    if row in taken:
+                        return False
+                    book = self._book_of(row)
+                    cap = max_per_book if caps is None else caps.get(book)
+                    if cap is not None and per_book.get(book, 0) >= cap:
+                        return False
+                    window = self._window(row, num_sequential)
+                    if window is None:
+                        return False
+                    taken.add(row)
+                    per_book[book] = per_book.get(book, 0) + 1
+                    chosen.append(window)
+                    return True
+
+                low = (stratum & -stratum).bit_length() - 1
+                high = stratum.bit_length()
+                count = count_rows(stratum)
+                # rejection sampling while it is cheap; it stops early if most draws are rejected
+                trials = 4 * quota * (high - low) // count + 16
+                if count >= 4 * quota:
+                    for _ in range(trials):
+                        row = rng.randrange(low, high)
+                        if bits[row >> 3] >> (row & 7) & 1:
+                            accept(row)
+                            if len(chosen) == quota:
+                                break
+                if len(chosen) < quota:
+                    rows = list(iter_rows(stratum))
+                    rng.shuffle(rows)
+                    for row in rows:
+                        if len(chosen) == quota:
+                            break
+                        accept(row)
+            res[name] = sorted(chosen)
+        return res
@@ -0,0 +1,288 @@
+import HP
+import json
+import mmap
+import os
+import pickle
+import sys
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from index import INDEX_DIR, INDEX_HEADER_FILE, ParagraphIndex
+
+# 2: the word_count and sentence_count columns were replaced by num_words and num_sentences
+SCHEMA_VERSION = 2
+HEADER_FILE = "header.json"
+
+# column name -> array typecode. every column is a flat fixed-width array on disk.
+# ids use 0 as "missing" since valid paragraph and book ids are positive.
+COLUMNS = {
+    "id": "q",
+    "book_id": "q",
+    "prev_id": "q",
+    "next_id": "q",
+    "tags": "Q",
+    "num_words": "I",
+    "num_sentences": "I",
+    "sentence_offsets": "q",  # row -> first sentence, len = num_rows + 1
+    "word_offsets": "q",  # sentence -> first word, len = num_sentences + 1
+    "byte_offsets": "q",  # row -> first byte in tokens, len = num_rows + 1
+}
+TOKENS_FILE = "tokens.bin"
+# words of a paragraph are stored as one utf-8 run separated by this byte, so a
+# whole paragraph is decoded and split with a single call.
+SEPARATOR = "\x00"
+MAX_TAG = 63
+
+
+def tags_to_mask(tags):
+    mask = 0
+    for tag in tags:
+        if not 0 <= tag <= MAX_TAG:
+            raise ValueError("tags should be integers in [0, %d]" % MAX_TAG)
+        mask |= 1 << tag
+    return mask
+
+
+def mask_to_tags(mask):
+    return {tag for tag in range(mask.bit_length()) if mask >> tag & 1}
+
+
+class StoreWriter(object):
+
+    def __init__(self, path, buffer_rows=65536):
+        """
+
+        Streams paragraphs into a columnar store. rows must be added in increasing id order.
+
+        Args:
+            path: directory of the store. it will be created if it does not exist.
+            buffer_rows: number of rows kept in memory before being flushed to disk
+        """
+        os.makedirs(path, exist_ok=True)
+        self._path = path
+        self._buffer_rows = buffer_rows
+        self._files = {
+            name: open(os.path.join(path, name + ".bin"), "wb")
+            for name in COLUMNS
+        }
+        self._tokens = open(os.path.join(path, TOKENS_FILE), "wb")
+        self._columns = {name: array(code) for name, code in COLUMNS.items()}
+        self._num_rows = 0
+        self._num_sentences = 0
+        self._num_words = 0
+        self._num_bytes = 0
+        self._last_id = 0
+        self._columns["sentence_offsets"].append(0)
+        self._columns["word_offsets"].append(0)
+        self._columns["byte_offsets"].append(0)
+
+    def add(self, id, sentences, book_id=None, prev_id=None, next_id=None, tags=()):
+        if id <= self._last_id:
+            raise ValueError("paragraphs should be added in increasing id order")
+        self._last_id = id
+        cols = self._columns
+        cols["id"].append(id)
+        cols["book_id"].append(book_id or 0)
+        cols["prev_id"].append(prev_id or 0)
+        cols["next_id"].append(next_id or 0)
+        cols["tags"].append(tags_to_mask(tags))
+        cols["num_sentences"].append(len(sentences))
+        words = []
+        for sent in sentences:
+            words.extend(sent)
+            self._num_words += len(sent)
+            cols["word_offsets"].append(self._num_words)
+        self._num_sentences += len(sentences)
+        cols["num_words"].append(len(words))
+        cols["sentence_offsets"].append(self._num_sentences)
+        data = SEPARATOR.join(words)
+        if data.count(SEPARATOR) != max(len(words) - 1, 0):
+            raise ValueError("words should not contain %r" % SEPARATOR)
+        data = data.encode("utf-8")
+        self._tokens.write(data)
+        self._num_bytes += len(data)
+        cols["byte_offsets"].append(self._num_bytes)
+        self._num_rows += 1
+        if len(cols["id"]) >= self._buffer_rows:
+            self._flush()
+
+    def _flush(self):
+        for name, col in self._columns.items():
+            col.tofile(self._files[name])
+            del col[:]
+
+    def close(self):
+        self._flush()
+        for f in self._files.values():
+            f.close()
+        self._tokens.close()
+        header = {
+            "schema_version": SCHEMA_VERSION,
+            "byteorder": sys.byteorder,
+            "num_rows": self._num_rows,
+            "num_sentences": self._num_sentences,
+            "num_words": self._num_words,
+            "columns": COLUMNS,
+        }
+        with open(os.path.join(self._path, HEADER_FILE), "w") as f:
+            json.dump(header, f, indent=2)
+        # indexes of a previous store in the same directory are stale now
+        index_header = os.path.join(self._path, INDEX_DIR, INDEX_HEADER_FILE)
+        if os.path.isfile(index_header):
+            os.remove(index_header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_store(paragraph_metadata, paragraph_text, path=HP.PARAGRAPH_STORE_PATH):
+    """
+
+    Write paragraphs in the columnar store format
+
+    Args:
+        paragraph_metadata: a dictionary {id: metadata(id)} as in HP.PARAGRAPH_METADATA_PATH
+        paragraph_text: a dictionary {id: list of sentences} as in HP.PARAGRAPH_DATA_PATH
+        path: directory of the store
+
+    """
+    assert set(paragraph_metadata) == set(paragraph_text)
+    with StoreWriter(path) as writer:
+        for i in sorted(paragraph_metadata):
+            mt = defaultdict(lambda: None, paragraph_metadata[i])
+            writer.add(i,
+                       paragraph_text[i],
+                       book_id=mt["book_id"],
+                       prev_id=mt["prev_id"],
+                       next_id=mt["next_id"],
+                       tags=mt["tags"] or ())
+    ParagraphIndex.open(ParagraphStore(path))
+
+
+def convert_pickles(metadata_path=HP.PARAGRAPH_METADATA_PATH,
+                    data_path=HP.PARAGRAPH_DATA_PATH,
+                    path=HP.PARAGRAPH_STORE_PATH):
+    """
+
+    One-time conversion of the paragraph pickles to a columnar store.
+
+    """
+    with open(metadata_path, "rb") as pkl:
+        met_data = pickle.load(pkl)
+    with open(data_path, "rb") as pkl:
+        text = pickle.load(pkl, encoding='latin1')
+    write_store(met_data, text, path)
+
+
+def _map_file(path, typecode):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(array(typecode))
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    return view.cast(typecode) if typecode != "B" else view
+
+
+class ParagraphStore(object):
+
+    def __init__(self, path=HP.PARAGRAPH_STORE_PATH):
+        """
+
+        Read-only, memory-mapped view of a columnar paragraph store.
+        rows are ordered by paragraph id. columns are exposed as memoryviews, so only the
+        pages a query touches are read from disk.
+
+        Args:
+            path: directory of the store
+        """
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            header = json.load(f)
+        if header["schema_version"] != SCHEMA_VERSION:
+            raise ValueError("unsupported store schema version %s" %
+                             header["schema_version"])
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError("store was written with %s byteorder" %
+                             header["byteorder"])
+        self._path = path
+        self._header = header
+        for name, code in header["columns"].items():
+            setattr(self, name, _map_file(os.path.join(path, name + ".bin"), code))
+        self.tokens = _map_file(os.path.join(path, TOKENS_FILE), "B")
+        self._index = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def __len__(self):
+        return self._header["num_rows"]
+
+    @property
+    def index(self):
+        """
+
+        The tag and book indexes of the store. they are built on first use if missing.
+
+        """
+        if self._index is None:
+            self._index = ParagraphIndex.open(self)
+        return self._index
+
+    def row_of(self, id):
+        """
+
+        Returns:
+            the row of paragraph id or None if it is not in the store
+
+        """
+        row = bisect_left(self.id, id)
+        if row < len(self) and self.id[row] == id:
+            return row
+        return None
+
+    def tag_set(self, row):
+        return mask_to_tags(self.tags[row])
+
+    def words(self, row):
+        """
+
+        Returns:
+            a tuple of words of the paragraph in row
+
+        """
+        start, end = self.byte_offsets[row], self.byte_offsets[row + 1]
+        if self.num_words[row] == 0:
+            return ()
+        return tuple(
+            str(self.tokens[start:end], "utf-8").split(SEPARATOR))
+
+    def sentences(self, row, words=None):
+        """
+
+        Args:
+            row: a row of the store
+            words: (Optional) the words of row, if they are already decoded
+
+        Returns:
+            a tuple of tuples; the words of each sentence of the paragraph in row
+
+        """
+        if words is None:
+            words = self.words(row)
+        offsets = self.word_offsets
+        first = self.sentence_offsets[row]
+        base = offsets[first]
+        return tuple(
+            words[offsets[s] - base:offsets[s + 1] - base]
+            for s in range(first, self.sentence_offsets[row + 1]))
+
+
+def has_store(path=HP.PARAGRAPH_STORE_PATH):
+    return os.path.isfile(os.path.join(path, HEADER_FILE))
+
+
+if __name__ == '__main__':
+    convert_pickles()
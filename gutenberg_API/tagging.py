@@ -0,0 +1,185 @@
+"""
+desc: recomputes the length and dialogue tags of every paragraph of the store from its word and sentence
+      counts and the number of its quoted sentences, and writes the tags column back in one pass.
+
+usage: python gutenberg_API/tagging.py [--store data/paragraph_store] [--length-bounds 50 200 1000]
+                                       [--whole-dialogue 1.0] [--with-dialogue 1] [--dry-run]
+"""
+import HP
+import argparse
+import instrument
+import json
+import os
+from array import array
+from bisect import bisect_right
+from index import INDEX_DIR, ParagraphIndex
+from store import COLUMNS, HEADER_FILE, TOKENS_FILE, ParagraphStore, _map_file, mask_to_tags, tags_to_mask
+
+QUOTE = '"'
+STATS_DIR = "stats"
+LENGTH_TAGS = (HP.Tags.SHORT, HP.Tags.MEDIUM, HP.Tags.LONG, HP.Tags.TOO_LONG)
+DIALOGUE_TAGS = (HP.Tags.WITHOUT_DIALOGUE, HP.Tags.WITH_DIALOGUE, HP.Tags.WHOLE_DIALOGUE)
+
+
+class TagRules(object):
+
+    def __init__(self, length_bounds=(50, 200, 1000), whole_dialogue=1.0, with_dialogue=1):
+        """
+
+        Definitions of the length and dialogue tags.
+
+        Args:
+            length_bounds: number of words below which a paragraph is SHORT, MEDIUM and LONG; it is
+                           TOO_LONG otherwise
+            whole_dialogue: minimum fraction of quoted sentences of a WHOLE_DIALOGUE paragraph
+            with_dialogue: minimum number of quoted sentences of a WITH_DIALOGUE paragraph; other paragraphs
+                           are WITHOUT_DIALOGUE
+        """
+        if len(length_bounds) != len(LENGTH_TAGS) - 1 or list(length_bounds) != sorted(length_bounds):
+            raise ValueError("length_bounds should be %d increasing numbers" % (len(LENGTH_TAGS) - 1))
+        self.length_bounds = tuple(length_bounds)
+        self.whole_dialogue = whole_dialogue
+        self.with_dialogue = with_dialogue
+
+    def length_tag(self, num_words):
+        return LENGTH_TAGS[bisect_right(self.length_bounds, num_words)]
+
+    def dialogue_tag(self, num_quoted, num_sentences):
+        if num_sentences and num_quoted >= self.whole_dialogue * num_sentences:
+            return HP.Tags.WHOLE_DIALOGUE
+        if num_quoted and num_quoted >= self.with_dialogue:
+            return HP.Tags.WITH_DIALOGUE
+        return HP.Tags.WITHOUT_DIALOGUE
+
+    def tags(self, num_words, num_sentences, num_quoted):
+        """
+
+        Returns:
+            the set of length and dialogue tags of a paragraph
+
+        """
+        return {self.length_tag(num_words), self.dialogue_tag(num_quoted, num_sentences)}
+
+
+def count_quoted(sentences):
+    """
+
+    Returns:
+        the number of sentences with a quote
+
+    """
+    return sum(QUOTE in sent for sent in sentences)
+
+
+def _count_row(store, row):
+    words = store.words(row)
+    if QUOTE not in words:
+        return 0
+    return count_quoted(store.sentences(row, words))
+
+
+def quoted_sentences(store):
+    """
+
+    The number of quoted sentences of every row of a ParagraphStore. they are counted once and saved in
+    the store directory, keyed by the tokens file, so they survive retagging.
+
+    Returns:
+        a memoryview of counts by row
+
+    """
+    path = os.path.join(store.path, STATS_DIR)
+    data_path = os.path.join(path, "quoted_sentences.bin")
+    header_path = os.path.join(path, "quoted_sentences.json")
+    stat = os.stat(os.path.join(store.path, TOKENS_FILE))
+    stamp = [stat.st_mtime_ns, stat.st_size, len(store)]
+    if os.path.isfile(header_path):
+        with open(header_path) as f:
+            if json.load(f).get("tokens") == stamp:
+                return _map_file(data_path, "I")
+    os.makedirs(path, exist_ok=True)
+    counts = array("I", (_count_row(store, r) for r in range(len(store))))
+    with open(data_path + ".tmp", "wb") as f:
+        counts.tofile(f)
+    os.replace(data_path + ".tmp", data_path)
+    with open(header_path, "w") as f:
+        json.dump({"tokens": stamp}, f)
+    return _map_file(data_path, "I")
+
+
+def retag(store_path=HP.PARAGRAPH_STORE_PATH, rules=None, write=True):
+    """
+
+    Recompute the length and dialogue tags of every paragraph with rules, keeping its other tags. the
+    tags column is replaced in one pass, the store indexes are rebuilt and the store header is touched,
+    so Corpus reloads the store and clears its cached results.
+
+    Args:
+        store_path: directory of the paragraph store
+        rules: (Optional) a TagRules. if it is None the default rules are used
+        write: if it is False nothing is written, e.g. to try new rules
+
+    Returns:
+        a dictionary {tag: number of paragraphs with the tag} after retagging
+
+    """
+    rules = rules or TagRules()
+    store = ParagraphStore(store_path)
+    instrumentation = instrument.current()
+    with instrumentation.stage("quoted_sentences", len(store)) as stage:
+        quoted = quoted_sentences(store)
+        stage.items_out = len(store)
+    managed = tags_to_mask(LENGTH_TAGS + DIALOGUE_TAGS)
+    keep = ~managed & (1 << 64) - 1
+    length_masks = [1 << tag for tag in LENGTH_TAGS]
+    whole, with_dialogue = rules.whole_dialogue, rules.with_dialogue
+    whole_mask, with_mask, without_mask = (1 << HP.Tags.WHOLE_DIALOGUE, 1 << HP.Tags.WITH_DIALOGUE,
+                                           1 << HP.Tags.WITHOUT_DIALOGUE)
+    bounds = rules.length_bounds
+    with instrumentation.stage("retag", len(store)) as stage:
+        tags = array(COLUMNS["tags"], bytes(8 * len(store)))
+        counts = dict()
+        for r, (mask, words, sentences, q) in enumerate(zip(store.tags, store.num_words,
+                                                             store.num_sentences, quoted)):
+            if sentences and q >= whole * sentences:
+                dialogue = whole_mask
+            elif q and q >= with_dialogue:
+                dialogue = with_mask
+            else:
+                dialogue = without_mask
+            mask = mask & keep | length_masks[bisect_right(bounds, words)] | dialogue
+            tags[r] = mask
+            counts[mask] = counts.get(mask, 0) + 1
+        stage.items_out = len(store)
+    res = dict()
+    for mask, n in counts.items():
+        for tag in mask_to_tags(mask):
+            res[tag] = res.get(tag, 0) + n
+    if not write:
+        return res
+    path = os.path.join(store_path, "tags.bin")
+    with open(path + ".tmp", "wb") as f:
+        tags.tofile(f)
+    os.replace(path + ".tmp", path)
+    with instrumentation.stage("build_index"):
+        ParagraphIndex.build(ParagraphStore(store_path)).save(os.path.join(store_path, INDEX_DIR))
+    os.utime(os.path.join(store_path, HEADER_FILE))
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="recompute the length and dialogue tags of the store")
+    parser.add_argument("--store", default=HP.PARAGRAPH_STORE_PATH, help="directory of the paragraph store")
+    parser.add_argument("--length-bounds", type=int, nargs=3, default=(50, 200, 1000),
+                        help="words below which a paragraph is SHORT, MEDIUM and LONG")
+    parser.add_argument("--whole-dialogue", type=float, default=1.0,
+                        help="minimum fraction of quoted sentences of WHOLE_DIALOGUE")
+    parser.add_argument("--with-dialogue", type=int, default=1,
+                        help="minimum number of quoted sentences of WITH_DIALOGUE")
+    parser.add_argument("--dry-run", action="store_true", help="only print the tag counts")
+    args = parser.parse_args()
+    counts = retag(args.store, TagRules(args.length_bounds, args.whole_dialogue, args.with_dialogue),
+                   write=not args.dry_run)
+    names = {value: name for name, value in vars(HP.Tags).items() if not name.startswith("_")}
+    for tag in sorted(counts):
+        print("%s\t%d" % (names.get(tag, tag), counts[tag]))
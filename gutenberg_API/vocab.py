@@ -0,0 +1,189 @@
+import unicodedata
+from array import array
+from collections import Counter
+from store import SEPARATOR
+
+PAD = "[PAD]"
+UNK = "[UNK]"
+
+
+class Vocabulary(object):
+
+    def __init__(self, tokens, counts=None, lowercase=False):
+        """
+
+        A mapping between tokens and integer ids. id 0 is PAD and id 1 is UNK.
+
+        Args:
+            tokens: a list of distinct tokens, without PAD and UNK
+            counts: (Optional) a list of the count of each token
+            lowercase: if it is True tokens are lowercased before lookup
+        """
+        self._tokens = [PAD, UNK] + list(tokens)
+        self._counts = [0, 0] + list(counts or [0] * len(tokens))
+        self._ids = {token: i for i, token in enumerate(self._tokens)}
+        if len(self._ids) != len(self._tokens):
+            raise ValueError("tokens should be distinct")
+        self._lowercase = lowercase
+
+    @classmethod
+    def build(cls, store, min_count=1, max_size=None, lowercase=False):
+        """
+
+        Count the tokens of a ParagraphStore in one streaming pass over its token buffer.
+
+        Args:
+            store: a ParagraphStore
+            min_count: tokens with fewer occurrences are dropped
+            max_size: (Optional) maximum number of tokens, the most frequent are kept
+            lowercase: if it is True tokens are lowercased
+
+        Returns:
+            a Vocabulary sorted by decreasing count
+
+        """
+        counter = Counter()
+        tokens, offsets, num_words = store.tokens, store.byte_offsets, store.num_words
+        for row in range(len(store)):
+            if num_words[row]:
+                text = str(tokens[offsets[row]:offsets[row + 1]], "utf-8")
+                if lowercase:
+                    text = text.lower()
+                counter.update(text.split(SEPARATOR))
+        for token in (PAD, UNK):
+            counter.pop(token, None)
+        items = [(token, count)
+                 for token, count in counter.most_common(max_size)
+                 if count >= min_count]
+        return cls([token for token, _ in items], [count for _, count in items],
+                   lowercase)
+
+    def save(self, path):
+        """
+
+        Write the vocabulary as lines of "token\tcount", without PAD and UNK.
+
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("#lowercase\t%d\n" % self._lowercase)
+            for token, count in zip(self._tokens[2:], self._counts[2:]):
+                f.write("%s\t%d\n" % (token, count))
+
+    @classmethod
+    def load(cls, path):
+        tokens, counts = [], []
+        with open(path, encoding="utf-8") as f:
+            lowercase = bool(int(f.readline().rstrip("\n").split("\t")[1]))
+            for line in f:
+                token, count = line.rstrip("\n").rsplit("\t", 1)
+                tokens.append(token)
+                counts.append(int(count))
+        return cls(tokens, counts, lowercase)
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __contains__(self, token):
+        return token in self._ids
+
+    def id(self, token):
+        if self._lowercase:
+            token = token.lower()
+        return self._ids.get(token, 1)
+
+    def token(self, id):
+        return self._tokens[id]
+
+    def count(self, token):
+        return self._counts[self.id(token)]
+
+    def encode(self, words):
+        """
+
+        Args:
+            words: a list of tokens
+
+        Returns:
+            an array('I') of token ids; unknown tokens are UNK
+
+        """
+        if self._lowercase:
+            words = [word.lower() for word in words]
+        get = self._ids.get
+        return array("I", [get(word, 1) for word in words])
+
+    def decode(self, ids):
+        return [self._tokens[i] for i in ids]
+
+
+class WordPiece(object):
+
+    def __init__(self, tokens, unk=UNK, prefix="##", max_chars=100, lowercase=True):
+        """
+
+        Greedy longest-match-first WordPiece tokenizer of BERT, for words which are already split on
+        whitespace and punctuation, as the words of paragraphs are.
+
+        Args:
+            tokens: the wordpiece vocabulary; pieces which continue a word start with prefix
+            unk: the token of words which can not be tokenized
+            prefix: prefix of continuation pieces
+            max_chars: longer words are unk
+            lowercase: if it is True words are lowercased and their accents are removed, as in uncased models
+        """
+        self._tokens = frozenset(tokens)
+        self._unk = unk
+        self._prefix = prefix
+        self._max_chars = max_chars
+        self._lowercase = lowercase
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+
+        Args:
+            path: a vocab.txt file with one piece in each line
+
+        """
+        with open(path, encoding="utf-8") as f:
+            tokens = [line.rstrip("\n") for line in f]
+        return cls(tokens, **kwargs)
+
+    def tokenize(self, word):
+        """
+
+        Returns:
+            the list of pieces of word
+
+        """
+        if self._lowercase:
+            word = "".join(c for c in unicodedata.normalize("NFD", word.lower())
+                           if unicodedata.category(c) != "Mn")
+        if len(word) > self._max_chars:
+            return [self._unk]
+        pieces = []
+        start = 0
+        while start < len(word):
+            end = len(word)
+            while end > start:
+                piece = word[start:end] if start == 0 else self._prefix + word[start:end]
+                if piece in self._tokens:
+                    break
+                end -= 1
+            if end == start:
+                return [self._unk]
+            pieces.append(piece)
+            start = end
+        return pieces
+
+    def __call__(self, words):
+        """
+
+        Args:
+            words: a list of words
+
+        Returns:
+            the number of pieces of each word
+
+        """
+        return [len(self.tokenize(word)) for word in words]
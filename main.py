@@ -1,11 +1,188 @@
-from utils import get_paragraph_words
-from utils import make_transposition_pair_dataset
-from utils import write_tsv
+"""
+desc: command line entry point of the transposition pair dataset.
 
-if __name__ == '__main__':
-    paragraphs = get_paragraph_words(500, 20, 60, 3, tags=[[0, 1, 2]])
-    train_data, validation_data = make_transposition_pair_dataset(
-        paragraphs, 128)
+usage:
+    python main.py OUTPUT_DIR --max-len 500 --min-len 20 --tags SHORT,MEDIUM,LONG --num-tokens 128
+    python main.py OUTPUT_DIR --config variants.json
+
+a config file is a JSON list of variants (or {"variants": [...]}). every variant is a dictionary with a
+"name", which is the sub-directory of OUTPUT_DIR it is written to, and any of the keyword arguments of
+builder.build_sharded_dataset, which override the command line options. the corpus is loaded once and
+shared by all variants.
+"""
+import argparse
+import json
+import os
+from gutenberg_API import HP
+from gutenberg_API.API import default_corpus, get_paragraph_books, instrument
+from builder import build_sharded_dataset
+from writers import FORMATS
+from typing import Dict, List, Optional
+
+# options of build_sharded_dataset which can be given on the command line or in a variant
+VARIANT_OPTIONS = ("max_len", "min_len", "max_sent", "min_sent", "books", "books_features", "tags",
+                   "num_sequential", "num_tokens", "validation_split", "num_shards", "num_workers",
+                   "buffer_size", "seed", "split_by", "format", "writer_options", "vocabulary_path",
+                   "wordpiece_path", "cache_dir", "dedup_threshold")
+
+
+def parse_tags(groups: Optional[List[str]]) -> Optional[List[List[int]]]:
+    """
+    desc: parses --tags options. each option is a comma separated group of tags, of which a paragraph should
+          have at least one; a paragraph should satisfy every group. tags are numbers or names of HP.Tags,
+          e.g. ["SHORT,MEDIUM", "8"] -> [[0, 1], [8]]
+    """
+    if not groups:
+        return None
+    res = []
+    for group in groups:
+        tags = []
+        for tag in group.split(","):
+            tag = tag.strip()
+            if tag.isdigit():
+                tags.append(int(tag))
+            elif hasattr(HP.Tags, tag.upper()):
+                tags.append(getattr(HP.Tags, tag.upper()))
+            else:
+                raise ValueError("unknown tag %s" % tag)
+        res.append(tags)
+    return res
+
+
+def instrumentation_arguments(parser):
+    parser.add_argument("--progress", action="store_true",
+                        help="print the progress of every stage to stderr")
+    parser.add_argument("--metrics", default=None,
+                        help="append a JSON line of metrics for every stage to this file")
+    parser.add_argument("--profile", choices=instrument.PROFILE_MODES, default=None,
+                        help="profile the run with cProfile, or trace the peak memory of each stage")
+    parser.add_argument("--profile-output", default=None,
+                        help="file of the cProfile stats; they are printed if it is not given")
+
+
+def make_instrumentation(args) -> instrument.Instrumentation:
+    sinks = [instrument.JsonLinesSink(args.metrics)] if args.metrics else []
+    return instrument.Instrumentation(sinks, progress=args.progress,
+                                      profile=args.profile,
+                                      profile_path=args.profile_output)
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="write the transposition pair dataset")
+    parser.add_argument("output_dir", help="directory of the dataset, or of the variants with --config")
+    parser.add_argument("--config", default=None, help="JSON file of dataset variants")
+    parser.add_argument("--max-len", type=int, default=512)
+    parser.add_argument("--min-len", type=int, default=10)
+    parser.add_argument("--max-sent", type=int, default=60)
+    parser.add_argument("--min-sent", type=int, default=3)
+    parser.add_argument("--tags", action="append", default=None,
+                        help="comma separated tags of which a paragraph should have one, e.g. SHORT,MEDIUM. "
+                             "can be repeated; every group should be satisfied")
+    parser.add_argument("--books", type=int, nargs="+", default=None, help="ids of the books to use")
+    parser.add_argument("--books-features", type=json.loads, default=None,
+                        help='JSON features of the books to use, e.g. \'{"language": ["en"]}\'')
+    parser.add_argument("--num-sequential", type=int, default=2,
+                        help="pair the first and the last paragraph of windows of this many paragraphs")
+    parser.add_argument("--num-tokens", type=int, default=None,
+                        help="number of tokens kept from each paragraph of a pair, or of subwords of a pair "
+                             "with --wordpiece")
+    parser.add_argument("--wordpiece", dest="wordpiece_path", default=None,
+                        help="WordPiece vocab.txt; --num-tokens becomes a subword budget of each pair")
+    parser.add_argument("--validation-split", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--split-by", choices=("book", "paragraph"), default="book")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="tsv")
+    parser.add_argument("--compression", default=None, help="compression of arrow and parquet outputs")
+    parser.add_argument("--vocabulary", dest="vocabulary_path", default=None,
+                        help="saved Vocabulary; examples are written as token ids")
+    parser.add_argument("--num-shards", type=int, default=16)
+    parser.add_argument("--workers", dest="num_workers", type=int, default=None,
+                        help="number of worker processes, the number of CPUs by default")
+    parser.add_argument("--buffer-size", type=int, default=100000)
+    parser.add_argument("--cache-dir", default=None,
+                        help="directory of the per-book example cache; rebuilds only redo changed books")
+    parser.add_argument("--dedup", dest="dedup_threshold", type=float, default=None,
+                        help="drop pairs with a near duplicate paragraph of another selected paragraph, e.g. of "
+                             "another edition. the value is the minimum Jaccard similarity of duplicates")
+    instrumentation_arguments(parser)
+    return parser
 
-    write_tsv(train_data, 'train.tsv')
-    write_tsv(validation_data, 'dev.tsv')
+
+def load_variants(path: Optional[str], defaults: Dict) -> List[Dict]:
+    """
+    :return: a list of variants, each a dictionary with "name" and all of VARIANT_OPTIONS
+    """
+    if path is None:
+        variants = [dict(defaults, name="")]
+    else:
+        variants = _read_variants(path, defaults)
+    for variant in variants:
+        if variant["format"] == "packed" and variant["vocabulary_path"] is None:
+            raise ValueError("the packed format needs a vocabulary (variant %s)" % variant["name"])
+        if variant["num_sequential"] < 2:
+            raise ValueError("num_sequential should be at least 2 (variant %s)" % variant["name"])
+        if variant["wordpiece_path"] is not None and variant["num_tokens"] is None:
+            raise ValueError("a subword budget needs num_tokens (variant %s)" % variant["name"])
+    return variants
+
+
+def _read_variants(path, defaults):
+    with open(path) as f:
+        variants = json.load(f)
+    if isinstance(variants, dict):
+        variants = variants["variants"]
+    res = []
+    names = set()
+    for variant in variants:
+        unknown = set(variant) - set(VARIANT_OPTIONS) - {"name"}
+        if unknown:
+            raise ValueError("unknown options %s in variant %s" % (sorted(unknown), variant.get("name")))
+        if "name" not in variant or variant["name"] in names:
+            raise ValueError("every variant should have a distinct name")
+        names.add(variant["name"])
+        variant = dict(defaults, **variant)
+        if isinstance(variant["tags"], str):
+            variant["tags"] = parse_tags([variant["tags"]])
+        res.append(variant)
+    return res
+
+
+def build_variant(output_dir: str, variant: Dict) -> Dict:
+    """
+    desc: writes a variant to output_dir/name with build_sharded_dataset.
+
+    :return: the manifest
+    """
+    options = {name: variant[name] for name in VARIANT_OPTIONS if name != "books_features"}
+    if variant["books_features"] is not None:
+        books = default_corpus().book_ids(variant["books_features"])
+        if options["books"] is not None:
+            books &= set(options["books"])
+        options["books"] = sorted(books)
+    with instrument.current().stage("variant %s" % variant["name"]) as stage:
+        manifest = build_sharded_dataset(os.path.join(output_dir, variant["name"]), **options)
+        stage.items_out = manifest["train_examples"] + manifest["dev_examples"]
+    return manifest
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.num_sequential < 2:
+        parser.error("--num-sequential should be at least 2; pairs are the first and the last paragraph of a window")
+    defaults = {name: getattr(args, name, None) for name in VARIANT_OPTIONS}
+    defaults["tags"] = parse_tags(args.tags)
+    defaults["writer_options"] = {"compression": args.compression} if args.compression else None
+    variants = load_variants(args.config, defaults)
+    with instrument.use(make_instrumentation(args)):
+        # load the corpus once; forked workers of every variant share it
+        get_paragraph_books()
+        for variant in variants:
+            manifest = build_variant(args.output_dir, variant)
+            print("%s: %d train and %d dev examples in %s" %
+                  (variant["name"] or "dataset", manifest["train_examples"],
+                   manifest["dev_examples"], os.path.join(args.output_dir, variant["name"])))
+
+
+if __name__ == '__main__':
+    main()
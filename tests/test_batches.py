@@ -0,0 +1,60 @@
+import os
+import sys
+
+sys.path[:0] = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gutenberg_API")]
+
+import pytest  # noqa: E402
+import corpus  # noqa: E402
+import HP  # noqa: E402
+from batches import PairBatches  # noqa: E402
+from corpus import Corpus  # noqa: E402
+from store import ParagraphStore, StoreWriter  # noqa: E402
+from vocab import Vocabulary  # noqa: E402
+
+
+@pytest.fixture
+def store_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "paragraph_store")
+    with StoreWriter(path) as writer:
+        id = 0
+        for book_id in (1, 2, 3):
+            for i in range(6):
+                id += 1
+                sentences = [["paragraph", str(id), "of", "book", str(book_id)]] * (3 + i % 2)
+                writer.add(id, sentences, book_id=book_id,
+                           prev_id=id - 1 if i else None, next_id=id + 1 if i < 5 else None,
+                           tags={HP.Tags.SHORT, HP.Tags.PARAGRAPH})
+    missing = str(tmp_path / "missing.pkl")
+    monkeypatch.setattr(corpus, "_default_corpus",
+                        Corpus(missing, missing, missing, missing, store_path=path))
+    return path
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_epoch(store_path, packed):
+    vocabulary = Vocabulary.build(ParagraphStore(store_path))
+    batches = PairBatches(vocabulary.encode, batch_size=4, packed=packed, num_tokens=8)
+    seen = 0
+    for batch in batches:
+        size = len(batch["labels"])
+        seen += size
+        assert len(batch["first_ids"]) == len(batch["second_ids"]) == size
+        if packed:
+            offsets = batch["offsets"]
+            assert len(offsets) == 2 * size + 1 and offsets[-1] == len(batch["tokens"])
+            segment = list(batch["tokens"][offsets[0]:offsets[1]])
+        else:
+            assert len(batch["first"]) == len(batch["second"]) == 8 * size
+            segment = list(batch["first"][:batch["first_lengths"][0]])
+        assert 0 < len(segment) <= 8
+        # a truncated segment is a slice of the words of its paragraph
+        id = batch["first_ids"][0]
+        words = {"paragraph", str(id), "of", "book", str((id - 1) // 6 + 1)}
+        assert set(vocabulary.decode(segment)) <= words
+    assert seen == batches.num_examples == 2 * 3 * 5
+
+
+def test_single_paragraph_windows(store_path):
+    with pytest.raises(ValueError):
+        PairBatches(Vocabulary.build(ParagraphStore(store_path)).encode, num_sequential=1)
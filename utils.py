@@ -1,7 +1,11 @@
-from gutenberg_API.API import get_paragraphs
-from random import shuffle
+from gutenberg_API.API import get_duplicate_paragraphs, get_paragraphs, instrument, iter_paragraphs
+from writers import open_writer
 import csv
-from typing import List, Optional, Tuple
+import hashlib
+import random
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Callable, Container, Dict, Iterable, Iterator, List, Optional, Tuple
 
 
 def filter(paragraphs: List[Tuple],
@@ -25,16 +29,18 @@ def filter(paragraphs: List[Tuple],
 
     ret = []
 
-    for tuple in paragraphs:
-        flag = False
-        for seq in tuple:
-            world_len = len(seq.text(format="words"))
-            sen_len = len(seq.text(format="sentences"))
-            if world_len > max_len or world_len < min_len or sen_len > max_sent or sen_len < min_sent:
-                flag = True
+    with instrument.current().stage("filter", len(paragraphs)) as stage:
+        for tuple in paragraphs:
+            flag = False
+            for seq in tuple:
+                world_len = seq.num_words
+                sen_len = seq.num_sentences
+                if world_len > max_len or world_len < min_len or sen_len > max_sent or sen_len < min_sent:
+                    flag = True
 
-        if not flag:
-            ret.append(tuple)
+            if not flag:
+                ret.append(tuple)
+        stage.items_out = len(ret)
 
     return ret
 
@@ -47,7 +53,9 @@ def get_paragraph_words(max_len: int = 512,
                         books: Optional[List] = None,
                         tags: Optional[List] = None,
                         num_sequential: int = 2,
-                        shuffle: bool = True) -> List[List]:
+                        shuffle: bool = True,
+                        seed: Optional[int] = None,
+                        dedup_threshold: Optional[float] = None) -> List[List]:
     """
     :param max_len: (Optional) integer. maximum number of words in a paragraph
     :param min_len: (Optional) integer. minimum number of words in a paragraph
@@ -60,24 +68,44 @@ def get_paragraph_words(max_len: int = 512,
                  means that paragraphs with tag 3 and 4 or 5
     :param num_sequential: (Optional) integer. the number of sequential paragraphs
     :param shuffle: (Optional) boolean. whether the output be shuffled or not
+    :param seed: (Optional) seed of shuffling
+    :param dedup_threshold: (Optional) if it is given, tuples with a near duplicate of another selected paragraph
+                            are dropped (see gutenberg_API.API.get_duplicate_paragraphs), so the same text of two
+                            editions can't be in both train and validation
 
     :return: a list of lists of num_sequential consecutive paragraphs satisfying the conditions in which
-             each paragraph is a list of words
+             each paragraph is a read-only tuple of words
     """
 
+    # the length conditions are resolved on the paragraph store before any tuple is built,
+    # which is equivalent to calling filter on the output
     paragraphs = get_paragraphs(paragraph_id=paragraph_id,
                                 books=books,
                                 tags=tags,
-                                num_sequential=num_sequential)
-
-    paragraphs = filter(paragraphs, max_len, min_len, max_sent, min_sent)
-
-    ret = []
-    for tuple in paragraphs:
-        ret.append([p.text("words") for p in tuple])
-
-    if shuffle:
-        shuffle(ret)
+                                num_sequential=num_sequential,
+                                max_len=max_len,
+                                min_len=min_len,
+                                max_sent=max_sent,
+                                min_sent=min_sent)
+    if dedup_threshold is not None:
+        duplicates = get_duplicate_paragraphs(paragraph_id=paragraph_id,
+                                              books=books,
+                                              tags=tags,
+                                              max_len=max_len,
+                                              min_len=min_len,
+                                              max_sent=max_sent,
+                                              min_sent=min_sent,
+                                              threshold=dedup_threshold)
+        paragraphs = list(drop_duplicates(paragraphs, duplicates))
+
+    with instrument.current().stage("paragraph_words", len(paragraphs)) as stage:
+        ret = []
+        for tuple in paragraphs:
+            ret.append([p.text("words") for p in tuple])
+
+        if shuffle:
+            random.Random(seed).shuffle(ret)
+        stage.items_out = len(ret)
 
     return ret
 
@@ -85,7 +113,9 @@ def get_paragraph_words(max_len: int = 512,
 def make_transposition_pair_dataset(
         paragraphs: list[Tuple],
         num_tokens: Optional[int] = None,
-        validation_split: float = 0.1) -> Tuple[List]:
+        validation_split: float = 0.1,
+        seed: Optional[int] = None,
+        split_keys: Optional[List] = None) -> Tuple[List]:
     """
     desc: makes dataset of paragraphs in which each example is a list of :
             [label, first paragraph ID, second paragraph ID, first paragraph text, second paragraph text]
@@ -97,58 +127,593 @@ def make_transposition_pair_dataset(
           if paragraphs are too long for the task, we can have num_tokens tokens at the end of the first paragraph
           and num_tokens tokens at the beginning of the second paragraph
 
+          both orders of a pair are always in the same split. if split_keys is given, pairs are assigned to
+          splits by split_of(key), so e.g. with book ids as keys no book is shared by train and validation.
+
 
     :param paragraphs: list of tuples of two consecutive paragraphs in which each paragraph is a list of its words
+           or an array of its token ids (see gutenberg_API.vocab.Vocabulary.encode)
     :param num_tokens: integer. number of tokens of each paragraph we want to be included. if its None, then all tokens of each
-           paragraph will be included.
+           paragraph will be included. it can also be a TokenBudget, the number of subwords of a pair; then
+           paragraphs should be lists of words
+
     :param validation_split:  float between 0,1. Fraction of the training data to be used as validation data.
+    :param seed: (Optional) seed of shuffling and splitting
+    :param split_keys: (Optional) a list with a key (e.g. book id) for each pair of paragraphs
 
     :return: train_data: a list containing strings. each string is a train example like what mentioned above.
              validation_data: a list containing strings. each string is a validation example like what mentioned above
     """
 
-    all_pairs = []
+    with instrument.current().stage("make_transposition_pair_dataset", len(paragraphs)) as stage:
+        train_data, validation_data = _make_pairs(paragraphs, num_tokens, validation_split, seed,
+                                                  split_keys)
+        stage.items_out = len(train_data) + len(validation_data)
+    return train_data, validation_data
+
+
+def _make_pairs(paragraphs, num_tokens, validation_split, seed, split_keys):
+    if isinstance(num_tokens, TokenBudget):
+        num_tokens.lengths.prefetch(words for pair in paragraphs for words in pair)
+    rng = random.Random(seed)
     num = len(paragraphs)
+    if split_keys is not None:
+        if len(split_keys) != num:
+            raise ValueError("split_keys should have one key for each pair")
+        is_validation = [
+            split_of(key, validation_split, seed) for key in split_keys
+        ]
+    else:
+        order = list(range(num))
+        rng.shuffle(order)
+        is_validation = [False] * num
+        for i in order[int(num * (1 - validation_split)):]:
+            is_validation[i] = True
 
     # here paragraph IDs for the first paragraphs will be index of their pair in the input paragraphs and
     # for the second paragraphs will be number of examples + index of their pair in the input paragraphs
     # paragraph IDs could also be their IDs in gutenberg API
 
+    train_data, validation_data = [], []
     for i, (x, y) in enumerate(paragraphs):
-        if (num_tokens is not None):
-            all_pairs.append([
-                "1",
-                str(i),
-                str(i + num), " ".join(x[max(0,
-                                             len(x) - num_tokens):len(x)]),
-                " ".join(y[:min(len(y), num_tokens)])
-            ])
-
-            all_pairs.append([
-                "0",
-                str(num + i),
-                str(i), " ".join(y[max(0,
-                                       len(y) - num_tokens):len(y)]),
-                " ".join(x[:min(len(x), num_tokens)])
-            ])
-        else:
-            all_pairs.append(
-                ["1", str(i),
-                 str(i + num), " ".join(x), " ".join(y)])
-            all_pairs.append(
-                ["0", str(num + i),
-                 str(i), " ".join(y), " ".join(x)])
-
-    shuffle(all_pairs)
-
-    train_data = all_pairs[:int(len(all_pairs) * (1 - validation_split))]
-    validation_data = all_pairs[int(len(all_pairs) * (1 - validation_split)):]
+        data = validation_data if is_validation[i] else train_data
+        first, second = truncate_pair(x, y, num_tokens)
+        data.append(["1", str(i), str(i + num), _join(first), _join(second)])
+        first, second = truncate_pair(y, x, num_tokens)
+        data.append(["0", str(num + i), str(i), _join(first), _join(second)])
+
+    rng.shuffle(train_data)
+    rng.shuffle(validation_data)
 
     return train_data, validation_data
 
 
+def split_of(key, validation_split: float, seed=None) -> bool:
+    """
+    desc: assigns a key (e.g. a book id or a paragraph id) to a split in O(1) by hashing it with the seed.
+          the same key always goes to the same split, whatever the order, sharding or size of the build.
+
+    :return: True if key is in the validation split
+    """
+    digest = hashlib.blake2b(("%s:%s" % (seed, key)).encode(),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, "little") < validation_split * 2**64
+
+
 def write_tsv(data, data_path: str):
-    with open(data_path, 'w', newline='', encoding='utf-8') as tsvfile:
+    with instrument.current().stage("write_tsv") as stage, \
+            open(data_path, 'w', newline='', encoding='utf-8') as tsvfile:
         writer = csv.writer(tsvfile, delimiter='\t')
         for example in data:
             writer.writerow(example)
+            stage.count()
+
+
+class ShuffleBuffer(object):
+
+    def __init__(self, size: int, rng: Optional[random.Random] = None):
+        """
+        desc: approximate shuffle in bounded memory. the buffer keeps up to size items; once it is full,
+              each new item releases a uniformly chosen buffered one.
+
+        :param size: maximum number of buffered items
+        :param rng: (Optional) random.Random used for shuffling
+        """
+        if size < 1:
+            raise ValueError("size should be positive")
+        self._size = size
+        self._rng = rng or random.Random()
+        self._items = []
+
+    def add(self, item) -> List:
+        """
+        :return: a list of zero or one released items
+        """
+        if len(self._items) < self._size:
+            self._items.append(item)
+            return []
+        i = self._rng.randrange(self._size)
+        released, self._items[i] = self._items[i], item
+        return [released]
+
+    def drain(self) -> Iterator:
+        items, self._items = self._items, []
+        self._rng.shuffle(items)
+        return iter(items)
+
+
+def buffered_shuffle(items: Iterable,
+                     buffer_size: int,
+                     seed: Optional[int] = None) -> Iterator:
+    buffer = ShuffleBuffer(buffer_size, random.Random(seed))
+    for item in items:
+        yield from buffer.add(item)
+    yield from buffer.drain()
+
+
+def iter_paragraph_windows(max_len: int = 512,
+                           min_len: int = 10,
+                           max_sent: int = 60,
+                           min_sent: int = 3,
+                           paragraph_id: Optional[List] = None,
+                           books: Optional[List] = None,
+                           tags: Optional[List] = None,
+                           num_sequential: int = 2,
+                           duplicates: Optional[Container[int]] = None) -> Iterator[Tuple]:
+    """
+    desc: streaming version of get_paragraph_words. yields the tuples of num_sequential consecutive
+          Paragraph objects satisfying the conditions, in corpus order.
+
+    :params: same as get_paragraph_words
+    :param duplicates: (Optional) ids of paragraphs to drop the tuples of, e.g. get_duplicate_paragraphs() of the
+                       whole selection when only some books are iterated
+    """
+    windows = iter_paragraphs(paragraph_id=paragraph_id,
+                              books=books,
+                              tags=tags,
+                              num_sequential=num_sequential,
+                              max_len=max_len,
+                              min_len=min_len,
+                              max_sent=max_sent,
+                              min_sent=min_sent)
+    if duplicates:
+        return drop_duplicates(windows, duplicates)
+    return windows
+
+
+def drop_duplicates(paragraphs: Iterable[Tuple], duplicates: Container[int]) -> Iterator[Tuple]:
+    """
+    desc: drops the tuples of paragraphs which have a paragraph in duplicates.
+
+    :param paragraphs: iterable of tuples of Paragraph objects
+    :param duplicates: ids of paragraphs, e.g. the keys of get_duplicate_paragraphs
+
+    :return: iterator of the other tuples
+    """
+    return instrument.current().track(
+        "drop_duplicates",
+        (window for window in paragraphs if not any(par.id in duplicates for par in window)))
+
+
+def _join(tokens) -> str:
+    return " ".join(map(str, tokens))
+
+
+class SubwordLengths(object):
+
+    def __init__(self, tokenizer: Callable[[List[str]], List[int]], cache_size: int = 1000000):
+        """
+        desc: cache of the subword lengths of words and paragraphs. words are tokenized once, in batches,
+              and paragraphs keep the prefix sums of the lengths of their words, so any budget can be fitted
+              to them with a binary search.
+
+        :param tokenizer: a function from a list of words to the number of subwords of each word, e.g. a
+                          gutenberg_API.vocab.WordPiece
+        :param cache_size: maximum number of cached paragraphs; the cache is cleared when it is full
+        """
+        self._tokenizer = tokenizer
+        self._cache_size = cache_size
+        self._words = dict()
+        self._paragraphs = dict()
+
+    def prefetch(self, texts: Iterable[List[str]]):
+        """
+        desc: tokenizes the unknown words of texts in one batch.
+        """
+        known = self._words
+        unknown = list({word for words in texts for word in words if word not in known})
+        if unknown:
+            known.update(zip(unknown, self._tokenizer(unknown)))
+
+    def prefix(self, words: List[str], key=None) -> array:
+        """
+        :param words: a list of words
+        :param key: (Optional) a key of words, e.g. a paragraph ID, under which the result is cached
+
+        :return: array of the prefix sums of subword lengths; the first i words have prefix[i] subwords
+        """
+        if key is not None:
+            res = self._paragraphs.get(key)
+            if res is not None:
+                return res
+        self.prefetch([words])
+        known = self._words
+        res = array("I", [0])
+        total = 0
+        for word in words:
+            total += known[word]
+            res.append(total)
+        if key is not None:
+            if len(self._paragraphs) >= self._cache_size:
+                self._paragraphs.clear()
+            self._paragraphs[key] = res
+        return res
+
+
+class TokenBudget(object):
+
+    def __init__(self, size: int, tokenizer: Optional[Callable] = None,
+                 lengths: Optional[SubwordLengths] = None):
+        """
+        desc: a subword budget of a pair of paragraphs, which can be passed as num_tokens. the tail of the
+              first paragraph and the head of the second one are kept so that together they have at most
+              size subwords; a paragraph shorter than half of the budget leaves the rest to the other one.
+              paragraphs are cut at word boundaries, so a pair is short of size by less than one word.
+
+        :param size: number of subwords of a pair
+        :param tokenizer: same as SubwordLengths
+        :param lengths: (Optional) a SubwordLengths to share with other budgets, instead of tokenizer
+        """
+        if (tokenizer is None) == (lengths is None):
+            raise ValueError("one of tokenizer and lengths should be given")
+        self.size = size
+        self.lengths = lengths or SubwordLengths(tokenizer)
+
+    def with_size(self, size: int) -> "TokenBudget":
+        """
+        :return: a budget of another size which shares the cached lengths
+        """
+        return TokenBudget(size, lengths=self.lengths)
+
+    def bounds(self, x: List[str], y: List[str], x_key=None, y_key=None) -> Tuple[int, int]:
+        """
+        :param x, y: words of the first and the second paragraph
+        :param x_key, y_key: (Optional) cache keys of x and y, e.g. paragraph IDs
+
+        :return: (start, end); x[start:] and y[:end] fit in the budget
+        """
+        x_prefix = self.lengths.prefix(x, x_key)
+        y_prefix = self.lengths.prefix(y, y_key)
+        x_total, y_total = x_prefix[-1], y_prefix[-1]
+        size = self.size
+        if x_total + y_total <= size:
+            return 0, len(y)
+        y_budget = min(y_total, max(size // 2, size - x_total))
+        start = bisect_left(x_prefix, x_total - (size - y_budget))
+        # words which did not fit in the budget of x are given to y
+        end = bisect_right(y_prefix, size - (x_total - x_prefix[start])) - 1
+        return start, end
+
+
+def truncate_pair(x: List, y: List, num_tokens, x_words=None, y_words=None, x_key=None,
+                  y_key=None) -> Tuple[List, List]:
+    """
+    desc: keeps the tail of x and the head of y, as in make_transposition_pair_dataset.
+
+    :param x, y: tokens (words or token ids) of the first and the second paragraph
+    :param num_tokens: None, a number of tokens of each paragraph, or a TokenBudget of the pair
+    :param x_words, y_words: (Optional) words of x and y, if x and y are token ids. needed by TokenBudget
+    :param x_key, y_key: (Optional) cache keys of x and y for TokenBudget, e.g. paragraph IDs
+
+    :return: truncated x and y
+    """
+    if num_tokens is None:
+        return x, y
+    if isinstance(num_tokens, TokenBudget):
+        start, end = num_tokens.bounds(x if x_words is None else x_words,
+                                       y if y_words is None else y_words, x_key, y_key)
+        return x[start:], y[:end]
+    return x[max(0, len(x) - num_tokens):], y[:num_tokens]
+
+
+def iter_transposition_pairs(windows: Iterable[Tuple],
+                             num_tokens: Optional[int] = None,
+                             encode: Optional[Callable] = None) -> Iterator[Tuple]:
+    """
+    desc: streaming version of make_transposition_pair_dataset without shuffling and splitting.
+          for the first paragraph x and the last paragraph y of each window, yields (1, x, y) and then
+          (0, y, x) examples. with windows of two paragraphs, x and y are consecutive.
+
+    :param windows: iterable of tuples of sequential Paragraph objects
+    :param num_tokens: same as make_transposition_pair_dataset. subword lengths of a TokenBudget are cached
+                       under paragraph IDs
+    :param encode: (Optional) a function from words to token ids, e.g. Vocabulary.encode. if it is given,
+                   examples hold token id arrays instead of word lists and truncation slices those arrays
+
+    :return: iterator of examples (label, first paragraph ID, second paragraph ID, first words, second words)
+             in which IDs are gutenberg paragraph IDs
+    """
+    if isinstance(num_tokens, TokenBudget):
+        # tokenize the new words of a batch of windows together
+        for batch in _batches(windows, 256):
+            num_tokens.lengths.prefetch(par.text("words") for window in batch
+                                        for par in (window[0], window[-1]))
+            yield from _transposition_pairs(batch, num_tokens, encode)
+    else:
+        yield from _transposition_pairs(windows, num_tokens, encode)
+
+
+def _batches(items: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _transposition_pairs(windows, num_tokens, encode):
+    for window in windows:
+        x, y = window[0], window[-1]
+        x_words, y_words = x.text("words"), y.text("words")
+        x_tokens, y_tokens = x_words, y_words
+        if encode is not None:
+            x_tokens, y_tokens = encode(x_words), encode(y_words)
+        first, second = truncate_pair(x_tokens, y_tokens, num_tokens, x_words, y_words, x.id, y.id)
+        yield 1, x.id, y.id, first, second
+        first, second = truncate_pair(y_tokens, x_tokens, num_tokens, y_words, x_words, y.id, x.id)
+        yield 0, y.id, x.id, first, second
+
+
+def write_transposition_dataset(windows: Iterable[Tuple],
+                                train_path: str,
+                                validation_path: str,
+                                num_tokens: Optional[int] = None,
+                                validation_split: float = 0.1,
+                                buffer_size: int = 100000,
+                                seed: Optional[int] = None,
+                                split_by: str = "book",
+                                shuffle_seed=None,
+                                format: str = "tsv",
+                                writer_options: Optional[Dict] = None,
+                                encode: Optional[Callable] = None) -> Tuple[int, int]:
+    """
+    desc: streams windows of consecutive paragraphs to train and validation files. windows are
+          assigned to splits with split_of on their book id or first paragraph id, so both orders of a
+          pair, and with split_by="book" all pairs of a book, go to the same split. each split is shuffled
+          with a ShuffleBuffer of buffer_size examples, so memory does not grow with the corpus.
+
+    :param windows: iterable of tuples of sequential Paragraph objects, e.g. iter_paragraph_windows()
+    :param train_path: path of the train file
+    :param validation_path: path of the validation file
+    :param num_tokens: same as make_transposition_pair_dataset
+    :param validation_split: float between 0,1. Fraction of the pairs to be used as validation data.
+    :param buffer_size: number of examples buffered for shuffling in each split
+    :param seed: (Optional) seed of splitting and shuffling
+    :param split_by: "book" or "paragraph"; the key of split_of
+    :param shuffle_seed: (Optional) seed of shuffling. if it is None seed is used
+    :param format: output format, one of writers.FORMATS
+    :param writer_options: (Optional) keyword arguments of the writer, e.g. compression
+    :param encode: same as iter_transposition_pairs. with format="packed" the ids are written as they are
+
+    :return: number of train and validation examples
+    """
+    windows = instrument.current().track("select_windows", windows)
+    examples = iter_split_examples(windows, num_tokens, validation_split, seed,
+                                   split_by, encode)
+    return write_split_examples(examples,
+                                train_path,
+                                validation_path,
+                                buffer_size=buffer_size,
+                                shuffle_seed=seed if shuffle_seed is None else shuffle_seed,
+                                format=format,
+                                writer_options=writer_options,
+                                token_ids=encode is not None)
+
+
+def iter_split_examples(windows: Iterable[Tuple],
+                        num_tokens: Optional[int] = None,
+                        validation_split: float = 0.1,
+                        seed: Optional[int] = None,
+                        split_by: str = "book",
+                        encode: Optional[Callable] = None) -> Iterator[Tuple[int, Tuple]]:
+    """
+    desc: iter_transposition_pairs with the split of every example, as assigned by
+          write_transposition_dataset.
+
+    :params: same as write_transposition_dataset
+
+    :return: iterator of (split, example) in which split is 1 for validation and 0 for train
+    """
+    if split_by not in ("book", "paragraph"):
+        raise ValueError('split_by should be one of ["book", "paragraph"]')
+    for window in windows:
+        key = window[0].book_id if split_by == "book" else window[0].id
+        split = int(split_of(key, validation_split, seed))
+        for example in iter_transposition_pairs([window], num_tokens, encode):
+            yield split, example
+
+
+def write_split_examples(examples: Iterable[Tuple[int, Tuple]],
+                         train_path: str,
+                         validation_path: str,
+                         buffer_size: int = 100000,
+                         shuffle_seed=None,
+                         format: str = "tsv",
+                         writer_options: Optional[Dict] = None,
+                         token_ids: bool = False) -> Tuple[int, int]:
+    """
+    desc: shuffles (split, example) pairs, e.g. of iter_split_examples, with a ShuffleBuffer per split and
+          writes them to train and validation files.
+
+    :param examples: iterable of (split, example)
+    :param train_path, validation_path, buffer_size, format, writer_options: same as
+           write_transposition_dataset
+    :param shuffle_seed: (Optional) seed of shuffling
+    :param token_ids: if it is True examples hold token ids instead of words
+
+    :return: number of train and validation examples
+    """
+    rng = random.Random(shuffle_seed)
+    buffers = [ShuffleBuffer(buffer_size, rng), ShuffleBuffer(buffer_size, rng)]
+    writer_options = dict(writer_options or dict())
+    if token_ids:
+        if format == "packed":
+            writer_options.setdefault("encode", list)
+        elif format in ("arrow", "parquet"):
+            writer_options.setdefault("token_ids", True)
+    with instrument.current().stage("write_examples") as stage, \
+            open_writer(format, train_path, **writer_options) as train_writer, \
+            open_writer(format, validation_path, **writer_options) as validation_writer:
+        writers = [train_writer, validation_writer]
+        for split, example in examples:
+            writers[split].write_all(buffers[split].add(example))
+            stage.count()
+        for split in range(2):
+            writers[split].write_all(buffers[split].drain())
+    return train_writer.count, validation_writer.count
+
+
+def _words(paragraph, encode):
+    words = paragraph.text("words")
+    return words if encode is None else encode(words)
+
+
+def iter_distance_examples(sampler,
+                           distance: int = 1,
+                           num_tokens: Optional[int] = None,
+                           encode: Optional[Callable] = None,
+                           max_pairs: Optional[int] = None) -> Iterator[Tuple]:
+    """
+    desc: for each pair of paragraphs x and y of the same book in which y is distance paragraphs after x,
+          yields (1, x, y) and then (0, y, x) examples. distance=1 gives the pairs of
+          make_transposition_pair_dataset.
+
+    :param sampler: a PairSampler, e.g. gutenberg_API.API.get_pair_sampler()
+    :param distance: number of next_id steps from x to y
+    :param num_tokens, encode: same as iter_transposition_pairs
+    :param max_pairs: (Optional) maximum number of pairs, sampled uniformly
+
+    :return: iterator of examples (label, first paragraph ID, second paragraph ID, first words, second words)
+    """
+    for x_row, y_row in sampler.distance_pairs(distance, max_pairs):
+        window = (sampler.paragraph(x_row), sampler.paragraph(y_row))
+        yield from iter_transposition_pairs([window], num_tokens, encode)
+
+
+def iter_cross_book_examples(sampler,
+                             num_pairs: int,
+                             num_tokens: Optional[int] = None,
+                             encode: Optional[Callable] = None) -> Iterator[Tuple]:
+    """
+    desc: hard negatives; yields (0, x, y) examples in which x and y are paragraphs of different books,
+          sampled uniformly. like the other examples, they keep the tail of x and the head of y.
+
+    :param sampler: a PairSampler
+    :param num_pairs: number of examples
+    :param num_tokens, encode: same as iter_transposition_pairs
+
+    :return: iterator of examples (label, first paragraph ID, second paragraph ID, first words, second words)
+    """
+    for x_row, y_row in sampler.cross_book_pairs(num_pairs):
+        x, y = sampler.paragraph(x_row), sampler.paragraph(y_row)
+        first, second = truncate_pair(_words(x, encode), _words(y, encode), num_tokens,
+                                  x.text("words"), y.text("words"), x.id, y.id)
+        yield 0, x.id, y.id, first, second
+
+
+def write_pair_dataset(sampler,
+                       train_path: str,
+                       validation_path: str,
+                       distance: int = 1,
+                       negative_ratio: float = 0.0,
+                       max_pairs: Optional[int] = None,
+                       num_tokens: Optional[int] = None,
+                       validation_split: float = 0.1,
+                       seed: Optional[int] = None,
+                       split_by: str = "book",
+                       buffer_size: int = 100000,
+                       format: str = "tsv",
+                       writer_options: Optional[Dict] = None,
+                       encode: Optional[Callable] = None) -> Tuple[int, int]:
+    """
+    desc: writes distance pairs, and cross book negatives, of a PairSampler to train and validation files.
+          the sampler is split with split_of before sampling, so negatives never mix the two splits.
+
+    :param sampler: a PairSampler
+    :param train_path, validation_path, num_tokens, validation_split, seed, split_by, buffer_size, format,
+           writer_options, encode: same as write_transposition_dataset
+    :param distance: same as iter_distance_examples
+    :param negative_ratio: number of cross book negatives for each distance pair. a split with paragraphs
+                           of a single book gets none
+    :param max_pairs: (Optional) maximum number of distance pairs of each split, scaled by the size of the
+                      split
+
+    :return: number of train and validation examples
+    """
+    parts = sampler.split(lambda key: split_of(key, validation_split, seed), split_by)
+
+    def examples():
+        for split, part in enumerate(parts):
+            limit = None
+            if max_pairs is not None:
+                limit = int(max_pairs * len(part) / max(len(sampler), 1))
+            num_pairs = 0
+            for example in iter_distance_examples(part, distance, num_tokens, encode, limit):
+                num_pairs += example[0]
+                yield split, example
+            if negative_ratio > 0 and part.num_books() > 1:
+                for example in iter_cross_book_examples(part, round(negative_ratio * num_pairs),
+                                                        num_tokens, encode):
+                    yield split, example
+
+    return write_split_examples(examples(),
+                                train_path,
+                                validation_path,
+                                buffer_size=buffer_size,
+                                shuffle_seed=seed,
+                                format=format,
+                                writer_options=writer_options,
+                                token_ids=encode is not None)
+
+
+def make_permutation_dataset(sampler,
+                             k: int = 3,
+                             num_permutations: int = 1,
+                             num_tokens: Optional[int] = None,
+                             validation_split: float = 0.1,
+                             seed: Optional[int] = None,
+                             split_by: str = "book",
+                             max_windows: Optional[int] = None) -> Tuple[List]:
+    """
+    desc: makes a dataset of shuffled windows of k sequential paragraphs. each example is a list of:
+            [order, paragraph IDs, text of the first shown paragraph, ..., text of the k-th shown paragraph]
+          in which the i-th shown paragraph is the order[i]-th paragraph of the window, and order and IDs are
+          comma separated. paragraph IDs are in the shown order.
+
+    :param sampler: a PairSampler
+    :param k: number of paragraphs of each example
+    :param num_permutations: number of random orders of each window
+    :param num_tokens: (Optional) number of tokens kept from the beginning of each paragraph
+    :param validation_split, seed, split_by: same as write_transposition_dataset
+    :param max_windows: (Optional) maximum number of windows of each split, scaled by the size of the split
+
+    :return: train_data, validation_data: lists of examples like what mentioned above, which can be written
+             with write_tsv
+    """
+    rng = random.Random(seed)
+    parts = sampler.split(lambda key: split_of(key, validation_split, seed), split_by)
+    res = ([], [])
+    for split, part in enumerate(parts):
+        limit = None
+        if max_windows is not None:
+            limit = int(max_windows * len(part) / max(len(sampler), 1))
+        for rows, order in part.permutation_windows(k, num_permutations, limit):
+            shown = [part.paragraph(rows[i]) for i in order]
+            res[split].append([",".join(map(str, order)),
+                               ",".join(str(par.id) for par in shown)] +
+                              [_join(par.text("words")[:num_tokens]) for par in shown])
+        rng.shuffle(res[split])
+    return res
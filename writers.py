@@ -0,0 +1,263 @@
+import csv
+import json
+import mmap
+import os
+import sys
+from array import array
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+PACKED_VERSION = 1
+
+
+class ExampleWriter(object):
+    """
+    desc: base class of dataset writers. examples are tuples
+          (label, first paragraph ID, second paragraph ID, first words, second words)
+          and are written in blocks of batch_size examples.
+    """
+
+    def __init__(self, path: str, batch_size: int = 10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.count = 0
+        self._batch = []
+
+    def write(self, example: Tuple):
+        self._batch.append(example)
+        self.count += 1
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def write_all(self, examples: Iterable[Tuple]):
+        for example in examples:
+            self.write(example)
+
+    def flush(self):
+        if self._batch:
+            self._write_batch(self._batch)
+            self._batch = []
+
+    def _write_batch(self, batch):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def tsv_row(example: Tuple) -> list:
+    label, first_id, second_id, first, second = example
+    return [
+        str(label),
+        str(first_id),
+        str(second_id), " ".join(map(str, first)), " ".join(map(str, second))
+    ]
+
+
+class TsvWriter(ExampleWriter):
+    """
+    desc: writes examples as TSV rows [label, first ID, second ID, first text, second text],
+          the format of write_tsv.
+    """
+
+    def __init__(self, path: str, batch_size: int = 10000):
+        super().__init__(path, batch_size)
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file, delimiter='\t')
+
+    def _write_batch(self, batch):
+        self._writer.writerows(tsv_row(example) for example in batch)
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+class ArrowWriter(ExampleWriter):
+    """
+    desc: writes examples as Arrow IPC or Parquet record batches with columns
+          label, first_id, second_id, first and second; the last two are lists of tokens, so they do not
+          need to be re-split when loaded. requires pyarrow.
+    """
+
+    def __init__(self,
+                 path: str,
+                 batch_size: int = 10000,
+                 parquet: bool = False,
+                 compression: Optional[str] = None,
+                 token_ids: bool = False):
+        """
+        :param path: output file
+        :param batch_size: number of examples in each record batch (row group for parquet)
+        :param parquet: if it is True a parquet file is written, else an Arrow IPC file
+        :param compression: (Optional) column compression, e.g. "zstd" or "lz4". None means uncompressed
+        :param token_ids: if it is True the first and second columns are lists of int32 token ids
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("pyarrow is required for arrow and parquet outputs")
+        super().__init__(path, batch_size)
+        self._pa = pa
+        tokens = pa.list_(pa.int32() if token_ids else pa.string())
+        self._schema = pa.schema([("label", pa.int8()), ("first_id", pa.int64()),
+                                  ("second_id", pa.int64()), ("first", tokens),
+                                  ("second", tokens)])
+        if parquet:
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path,
+                                            self._schema,
+                                            compression=compression or "none")
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=compression)
+            self._writer = pa.ipc.new_file(path, self._schema, options=options)
+
+    def _write_batch(self, batch):
+        columns = [list(column) for column in zip(*batch)]
+        columns[3] = [list(words) for words in columns[3]]
+        columns[4] = [list(words) for words in columns[4]]
+        record_batch = self._pa.RecordBatch.from_arrays(
+            [self._pa.array(column, type=field.type)
+             for column, field in zip(columns, self._schema)],
+            schema=self._schema)
+        if isinstance(self._writer, self._pa.ipc.RecordBatchFileWriter):
+            self._writer.write_batch(record_batch)
+        else:
+            self._writer.write_table(
+                self._pa.Table.from_batches([record_batch]))
+
+    def close(self):
+        super().close()
+        self._writer.close()
+
+
+class PackedWriter(ExampleWriter):
+    """
+    desc: writes examples in a packed binary format which can be memory-mapped by read_packed:
+            path.tokens: int32 token ids of all segments, back to back
+            path.offsets: int64 offsets; segment i is tokens[offsets[i]:offsets[i + 1]]. example j has
+                          segments 2j (first) and 2j + 1 (second)
+            path.examples: int64 triples (label, first ID, second ID)
+            path.json: header
+          the files are not compressed, so that they stay mmap-able.
+    """
+
+    def __init__(self,
+                 path: str,
+                 encode: Callable[[Sequence[str]], Sequence[int]],
+                 batch_size: int = 10000):
+        """
+        :param path: prefix of the output files
+        :param encode: a function from a list of words to a sequence of token ids. if the words of examples
+                       are already token ids, pass list
+        :param batch_size: number of examples buffered before they are appended to the files
+        """
+        super().__init__(path, batch_size)
+        self._encode = encode
+        self._tokens = open(path + ".tokens", "wb")
+        self._offsets = open(path + ".offsets", "wb")
+        self._examples = open(path + ".examples", "wb")
+        self._num_tokens = 0
+        array("q", [0]).tofile(self._offsets)
+
+    def _write_batch(self, batch):
+        tokens, offsets, examples = array("i"), array("q"), array("q")
+        for label, first_id, second_id, first, second in batch:
+            examples.extend((label, first_id, second_id))
+            for words in (first, second):
+                tokens.extend(self._encode(words))
+                offsets.append(self._num_tokens + len(tokens))
+        self._num_tokens += len(tokens)
+        tokens.tofile(self._tokens)
+        offsets.tofile(self._offsets)
+        examples.tofile(self._examples)
+
+    def close(self):
+        super().close()
+        for f in (self._tokens, self._offsets, self._examples):
+            f.close()
+        header = {
+            "version": PACKED_VERSION,
+            "byteorder": sys.byteorder,
+            "num_examples": self.count,
+            "num_tokens": self._num_tokens,
+        }
+        with open(self.path + ".json", "w") as f:
+            json.dump(header, f)
+
+
+class PackedDataset(object):
+
+    def __init__(self, path: str):
+        """
+        desc: memory-mapped reader of the files written by PackedWriter.
+
+        :param path: prefix of the files
+        """
+        with open(path + ".json") as f:
+            header = json.load(f)
+        if header["version"] != PACKED_VERSION or header["byteorder"] != sys.byteorder:
+            raise ValueError("unsupported packed dataset %s" % path)
+        self._len = header["num_examples"]
+        self.tokens = _map(path + ".tokens", "i")
+        self.offsets = _map(path + ".offsets", "q")
+        self.examples = _map(path + ".examples", "q")
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i: int) -> Tuple:
+        """
+        :return: (label, first ID, second ID, first token ids, second token ids); token ids are memoryviews
+        """
+        if not 0 <= i < self._len:
+            raise IndexError(i)
+        label, first_id, second_id = self.examples[3 * i:3 * i + 3]
+        offsets = self.offsets
+        return (label, first_id, second_id,
+                self.tokens[offsets[2 * i]:offsets[2 * i + 1]],
+                self.tokens[offsets[2 * i + 1]:offsets[2 * i + 2]])
+
+
+def _map(path, typecode):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(array(typecode))
+        return memoryview(mmap.mmap(f.fileno(), 0,
+                                    access=mmap.ACCESS_READ)).cast(typecode)
+
+
+def read_packed(path: str) -> PackedDataset:
+    return PackedDataset(path)
+
+
+# format -> (writer, file extension)
+FORMATS = {
+    "tsv": (TsvWriter, ".tsv"),
+    "arrow": (ArrowWriter, ".arrow"),
+    "parquet": (lambda path, **kw: ArrowWriter(path, parquet=True, **kw),
+                ".parquet"),
+    "packed": (PackedWriter, ""),
+}
+
+
+def open_writer(format: str, path: str, **options: Dict) -> ExampleWriter:
+    """
+    :param format: one of FORMATS
+    :param path: output path; for "packed" it is the prefix of the output files
+    :param options: keyword arguments of the writer, e.g. batch_size, compression or encode
+
+    :return: an ExampleWriter
+    """
+    if format not in FORMATS:
+        raise ValueError("format should be one of %s" % sorted(FORMATS))
+    return FORMATS[format][0](path, **options)
+
+
+def extension(format: str) -> str:
+    return FORMATS[format][1]